@@ -1,28 +1,66 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, Response, stream_with_context, make_response, session, abort
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.utils import secure_filename
+from markupsafe import Markup
+from jinja2 import FileSystemBytecodeCache
 import os
 import datetime
 import uuid
-import pyodbc
-import paramiko
-import firebirdsql
-import sshtunnel
-import openpyxl
-from openpyxl.styles import Font, Border, Side, Alignment, PatternFill
+import json
+import csv
+import io
+import zlib
+import gzip
+import hashlib
+import shutil
+import re
+import unicodedata
+import threading
+import time
+import queue
+from types import SimpleNamespace
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from io import BytesIO
 from config import Config
-import chardet  # Añadido para detección de codificación
+from cache import CacheDisco, crear_cache
+from resiliencia import SingleFlight, CircuitBreaker, CircuitoAbierto, Bulkhead, Saturado
+from indices import IndicePrefijos, IndiceFrecuencias
+# pyodbc, sshtunnel (y paramiko), firebirdsql, openpyxl y chardet se importan en las funciones que
+# los usan: la mayoría de las peticiones no los necesita y así arrancan más rápido waitress,
+# los procesos del pool de exportaciones y los scripts que importan app.py.
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
-# Asegurar que existe el directorio de uploads
+# Asegurar que existen los directorios de uploads y exportaciones
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['EXPORT_FOLDER'], exist_ok=True)
+
+# Plantillas compiladas en disco: tras reiniciar se cargan sin volver a compilarlas
+os.makedirs(app.config['JINJA_CACHE_FOLDER'], exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['JINJA_CACHE_FOLDER'])
 
 # Configurar la base de datos
 db = SQLAlchemy(app)
 
+# Caché en disco de exportaciones generadas (compartida entre procesos)
+cache_exportaciones = CacheDisco(app.config['EXPORT_CACHE_FOLDER'], app.config['EXPORT_CACHE_MAX_BYTES'], '.xlsx')
+
+# Cachés con el backend de CACHE_BACKEND: en memoria de cada proceso, o compartidas entre los
+# procesos del servidor (SQLite en el mismo equipo, Redis entre equipos)
+def crear_cache_configurada(espacio, max_caracteres, ttl=None, backend=None):
+    return crear_cache(backend or app.config['CACHE_BACKEND'], espacio, max_caracteres, ttl,
+                       ruta_sqlite=app.config['CACHE_SQLITE_RUTA'], url_redis=app.config['CACHE_REDIS_URL'])
+
+# Fragmentos HTML ya renderizados (detalles de recibos y opciones de procedencia)
+cache_fragmentos = crear_cache_configurada('fragmentos', app.config['FRAGMENTOS_CACHE_MAX_CARACTERES'],
+                                           app.config['FRAGMENTOS_CACHE_TTL'])
+# Resultados de consultas a producción y Microsip (catálogo de procedencias, artículos por orden de compra)
+cache_datos = crear_cache_configurada('datos', app.config['DATOS_CACHE_MAX_CARACTERES'])
+# Selecciones de recibos y trabajos de exportación, compartidos entre los procesos del servidor
+cache_sesiones = crear_cache_configurada('sesiones', app.config['SESIONES_CACHE_MAX_CARACTERES'],
+                                         backend=app.config['SESIONES_CACHE_BACKEND'])
+
 # Función para manejar problemas de codificación en archivos
 def read_file_safely(file_path):
     """
@@ -38,6 +76,7 @@ def read_file_safely(file_path):
             continue
     
     # Si todas las codificaciones fallan, intenta el modo binario y detecta la codificación
+    import chardet
     with open(file_path, 'rb') as f:
         content = f.read()
         detection = chardet.detect(content)
@@ -93,10 +132,74 @@ class ReciboMaterial(db.Model):
     estatus = db.Column(db.String(50))
     reporte_focc03 = db.Column(db.String(100))
     idordencompra = db.Column(db.Integer)
+    # Línea de la orden de compra en Microsip elegida al capturar (evita buscar el artículo por descripción)
+    docto_cm_det_id = db.Column(db.Integer)
+    articulo_id = db.Column(db.Integer)
+    clave_articulo = db.Column(db.String(100))
     procedencia = db.Column(db.String(100))
     archivo = db.Column(db.String(255))
     fecha_creacion = db.Column(db.DateTime, default=datetime.datetime.now)
-    fecha_modificacion = db.Column(db.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+    fecha_modificacion = db.Column(db.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now, index=True)
+
+class MarcaExportacion(db.Model):
+    """Última fecha_modificacion exportada por cada consumidor de exportaciones incrementales."""
+    __tablename__ = 'marcas_exportacion'
+    
+    consumidor = db.Column(db.String(100), primary_key=True)
+    ultima_modificacion = db.Column(db.DateTime)
+    fecha_actualizacion = db.Column(db.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+class ImportacionRecibo(db.Model):
+    """Bitácora de recibos enviados a producción por importar_sqlserver."""
+    __tablename__ = 'importaciones_recibos'
+    
+    recibo_id = db.Column(db.Integer, primary_key=True)
+    idrecibo = db.Column(db.Integer)  # tb_recibomtlcalidad.idrecibo en producción
+    hash_contenido = db.Column(db.String(64))
+    fecha_importacion = db.Column(db.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+class EnvioProduccion(db.Model):
+    """
+    Bandeja de salida: recibos guardados pendientes de enviar a producción.
+    Se escribe en la misma transacción que el recibo y la vacía el enviador en segundo plano.
+    """
+    __tablename__ = 'envios_produccion'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    recibo_id = db.Column(db.Integer, index=True)
+    estado = db.Column(db.String(20), default='pendiente', index=True)  # pendiente, en_proceso, enviado, fallido
+    intentos = db.Column(db.Integer, default=0)
+    proximo_intento = db.Column(db.DateTime, default=datetime.datetime.now, index=True)
+    ultimo_error = db.Column(db.String(500))
+    # Aumenta cada vez que el recibo se vuelve a guardar mientras el envío está pendiente
+    version = db.Column(db.Integer, default=0)
+    # Identifica el lote que tomó el envío; con 'en_proceso', proximo_intento marca el vencimiento del reclamo
+    reclamo = db.Column(db.String(32))
+    fecha_creacion = db.Column(db.DateTime, default=datetime.datetime.now)
+    fecha_actualizacion = db.Column(db.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+def actualizar_esquema():
+    """
+    Crea las tablas que falten y agrega las columnas e índices nuevos a tablas existentes,
+    ya que db.create_all() no modifica tablas que ya fueron creadas.
+    """
+    db.create_all()
+    inspector = db.inspect(db.engine)
+    for tabla in db.metadata.sorted_tables:
+        existentes = {columna['name'] for columna in inspector.get_columns(tabla.name)}
+        with db.engine.begin() as conexion:
+            for columna in tabla.columns:
+                if columna.name not in existentes:
+                    tipo = columna.type.compile(dialect=db.engine.dialect)
+                    conexion.execute(db.text(f'ALTER TABLE {tabla.name} ADD {columna.name} {tipo}'))
+        for indice in tabla.indexes:
+            indice.create(db.engine, checkfirst=True)
+
+@app.cli.command('actualizar-esquema')
+def actualizar_esquema_comando():
+    """Aplica los cambios de esquema pendientes: flask --app app actualizar-esquema"""
+    actualizar_esquema()
+    print('Esquema actualizado')
 
 # Funciones de utilidad para bases de datos
 def get_sqlserver_conn():
@@ -111,13 +214,33 @@ def get_sqlserver_conn():
             f"PWD={Config.SQLSERVER_LOCAL['password']};"
             "Charset=UTF-8"  # Establecer charset explícitamente
         )
+        import pyodbc
         return pyodbc.connect(conn_str)
     except Exception as e:
         print(f"Error al conectar a SQL Server: {str(e)}")
         raise
 
+# Circuit breakers de las dependencias remotas: si no responden se deja de esperar por ellas
+circuito_produccion = CircuitBreaker('SQL Server de producción', app.config['CIRCUITO_FALLOS'], app.config['CIRCUITO_ESPERA'])
+circuito_firebird = CircuitBreaker('Microsip (Firebird)', app.config['CIRCUITO_FALLOS'], app.config['CIRCUITO_ESPERA'])
+
+# El túnel SSH y el servidor de Firebird solo admiten unas pocas sesiones simultáneas
+bulkhead_firebird = Bulkhead('Microsip (Firebird)', app.config['FIREBIRD_MAX_CONCURRENTES'],
+                             app.config['FIREBIRD_MAX_EN_COLA'], app.config['FIREBIRD_ESPERA_COLA'])
+
+def respuesta_saturado(error):
+    """Respuesta 503 con Retry-After cuando una dependencia no admite más solicitudes."""
+    respuesta = jsonify({'status': 'error', 'message': f'{error}. Intente de nuevo en unos segundos.'})
+    respuesta.status_code = 503
+    respuesta.headers['Retry-After'] = str(max(1, int(error.reintentar_en)))
+    return respuesta
+
 def get_sqlserver_prod_conn():
-    """Conexión a SQL Server de producción con manejo de codificación."""
+    """Conexión a SQL Server de producción; lanza CircuitoAbierto si producción está marcada como caída."""
+    return circuito_produccion.llamar(conectar_sqlserver_prod)
+
+def conectar_sqlserver_prod():
+    """Conexión a SQL Server de producción con manejo de codificación y tiempos de espera."""
     try:
         # Añadir parámetros de codificación a la cadena de conexión
         conn_str = (
@@ -128,59 +251,261 @@ def get_sqlserver_prod_conn():
             f"PWD={Config.SQLSERVER_PROD['password']};"
             "Charset=UTF-8"  # Establecer charset explícitamente
         )
-        return pyodbc.connect(conn_str)
+        import pyodbc
+        conn = pyodbc.connect(conn_str, timeout=app.config['SQLSERVER_PROD_TIMEOUT_CONEXION'])
+        conn.timeout = app.config['SQLSERVER_PROD_TIMEOUT_CONSULTA']
+        return conn
     except Exception as e:
         print(f"Error al conectar a SQL Server de producción: {str(e)}")
         raise
 
+def conectar_firebird(puerto):
+    """
+    Abre una conexión a Firebird por el puerto local de un túnel SSH ya iniciado.
+    Prueba varias codificaciones; devuelve (conexión, codificación) o lanza excepción.
+    """
+    import firebirdsql
+    
+    # Probar diferentes sets de caracteres si uno falla
+    encodings = ['ISO8859_1', 'UTF8', 'WIN1252']
+    
+    # Probar cada codificación hasta que una funcione
+    last_error = None
+    for encoding in encodings:
+        try:
+            firebird_config = Config.FIREBIRD_CONFIG
+            conn = firebirdsql.connect(
+                host='localhost',
+                database=firebird_config['database'],
+                user=firebird_config['user'],
+                password=firebird_config['password'],
+                charset=encoding,  # Probar diferentes codificaciones
+                port=puerto,
+                timeout=app.config['FIREBIRD_TIMEOUT']  # Conexión y lectura del socket
+            )
+            return conn, encoding
+        except Exception as e:
+            last_error = e
+            continue
+    
+    # Si llegamos aquí, todas las codificaciones fallaron
+    raise Exception(f'Error en conexión con todas las codificaciones: {str(last_error)}')
+
+# Túnel y conexión a Firebird que el calentamiento deja abiertos para la primera consulta
+_firebird_precalentado = {'resultado': None, 'abierto': 0}
+_firebird_precalentado_lock = threading.Lock()
+
+def tomar_firebird_precalentado():
+    """
+    Entrega una sola vez el túnel y la conexión abiertos por el calentamiento (quien los recibe
+    los cierra como cualquier otro), o None si no hay o tienen más de CALENTAR_FIREBIRD_VIGENCIA segundos.
+    """
+    with _firebird_precalentado_lock:
+        resultado = _firebird_precalentado['resultado']
+        abierto = _firebird_precalentado['abierto']
+        _firebird_precalentado['resultado'] = None
+    if resultado is None:
+        return None
+    if time.time() - abierto < app.config['CALENTAR_FIREBIRD_VIGENCIA'] and resultado['tunnel'].is_active:
+        return resultado
+    try:
+        resultado['conn'].close()
+    except Exception:
+        pass
+    if resultado['tunnel'].is_active:
+        resultado['tunnel'].close()
+    return None
+
 def get_firebird_conn():
-    """Establece túnel SSH y conexión a Firebird con manejo de codificación."""
+    """Establece túnel SSH y conexión a Firebird; no lo intenta si Firebird está marcado como caído."""
+    resultado = tomar_firebird_precalentado()
+    if resultado is not None:
+        return resultado
+    try:
+        return circuito_firebird.llamar(abrir_conexion_firebird)
+    except Exception as e:
+        return {'status': False, 'message': str(e)}
+
+def abrir_conexion_firebird():
+    """Abre el túnel SSH y una conexión a Firebird con manejo de codificación; lanza excepción si falla."""
+    import socket
+    import sshtunnel
+    # sshtunnel lee sus tiempos de espera de variables del módulo: conexión al servidor SSH
+    # y comprobación del túnel al iniciarlo
+    sshtunnel.SSH_TIMEOUT = app.config['SSH_TIMEOUT']
+    sshtunnel.TUNNEL_TIMEOUT = app.config['SSH_TIMEOUT']
+    socket_ssh = None
     try:
-        # Verificar si ya existe un túnel
         ssh_config = Config.SSH_CONFIG
+        # Con (host, puerto) paramiko conecta sin tiempo de espera; con un socket propio
+        # sshtunnel lo conecta aplicando SSH_TIMEOUT
+        familia = socket.getaddrinfo(ssh_config['host'], ssh_config['port'], type=socket.SOCK_STREAM)[0][0]
+        socket_ssh = socket.socket(familia, socket.SOCK_STREAM)
         tunnel = sshtunnel.SSHTunnelForwarder(
             (ssh_config['host'], ssh_config['port']),
             ssh_username=ssh_config['username'],
             ssh_password=ssh_config['password'],
+            ssh_proxy=socket_ssh,
             remote_bind_address=(ssh_config['remote_host'], ssh_config['remote_port']),
-            local_bind_address=('127.0.0.1', ssh_config['local_port'])
+            local_bind_address=('127.0.0.1', ssh_config['local_port']),
+            set_keepalive=app.config['SSH_KEEPALIVE']
         )
         
         tunnel.start()
         
-        # Probar diferentes sets de caracteres si uno falla
-        encodings = ['ISO8859_1', 'UTF8', 'WIN1252']
-        
-        # Probar cada codificación hasta que una funcione
-        last_error = None
-        for encoding in encodings:
-            try:
-                firebird_config = Config.FIREBIRD_CONFIG
-                conn = firebirdsql.connect(
-                    host='localhost',
-                    database=firebird_config['database'],
-                    user=firebird_config['user'],
-                    password=firebird_config['password'],
-                    charset=encoding,  # Probar diferentes codificaciones
-                    port=tunnel.local_bind_port
-                )
-                
-                return {'status': True, 'conn': conn, 'tunnel': tunnel, 'message': f'Conexión exitosa con codificación {encoding}'}
-            except Exception as e:
-                last_error = e
-                continue
-                
-        # Si llegamos aquí, todas las codificaciones fallaron
-        if tunnel.is_active:
-            tunnel.close()
-        return {'status': False, 'message': f'Error en conexión con todas las codificaciones: {str(last_error)}'}
+        conn, encoding = conectar_firebird(tunnel.local_bind_port)
+        return {'status': True, 'conn': conn, 'tunnel': tunnel, 'message': f'Conexión exitosa con codificación {encoding}'}
     except Exception as e:
         if 'tunnel' in locals() and tunnel.is_active:
             tunnel.close()
-        return {'status': False, 'message': f'Error en conexión: {str(e)}'}
+        if socket_ssh is not None:
+            socket_ssh.close()
+        raise Exception(f'Error en conexión: {str(e)}')
+
+def dividir_en_bloques(valores, tamano):
+    """Divide una lista en bloques de como máximo `tamano` elementos."""
+    for inicio in range(0, len(valores), tamano):
+        yield valores[inicio:inicio + tamano]
+
+# Columnas que lee cada listado o exportación (id y fecha_creacion se usan para ordenar)
+CAMPOS_LISTADO = [
+    'id', 'idcode', 'fecha', 'orden_compra', 'proveedor', 'num_remision',
+    'descripcion_material', 'cliente', 'reporte_focc03', 'archivo', 'fecha_creacion'
+]
+CAMPOS_EXPORTACION = [
+    'id', 'idcode', 'fecha', 'orden_compra', 'proveedor', 'num_remision', 'cantidad', 'tipo',
+    'descripcion_material', 'grado_acero', 'num_placa', 'num_colada', 'num_certificado',
+    'ot', 'cliente', 'estatus', 'reporte_focc03', 'procedencia', 'fecha_creacion'
+]
+CAMPOS_REPORTE_FOCC03 = [
+    'cantidad', 'descripcion_material', 'grado_acero', 'num_placa', 'num_colada',
+    'num_certificado', 'ot', 'estatus', 'num_remision'
+]
+
+def consulta_lectura(campos):
+    """
+    Consulta de solo lectura de las columnas indicadas de ReciboMaterial.
+    Devuelve filas ligeras (tuplas con acceso por atributo, p. ej. fila.proveedor) en lugar
+    de instancias del ORM: sin mapa de identidad ni seguimiento de cambios en la sesión.
+    """
+    return db.session.query(*[getattr(ReciboMaterial, campo) for campo in campos])
+
+def obtener_recibos_por_ids(ids, campos=None):
+    """
+    Carga recibos por ID dividiendo el IN en bloques, para no exceder el límite
+    de 2100 parámetros por consulta de SQL Server con selecciones grandes.
+    Con `campos` devuelve filas de solo lectura de esas columnas (debe incluir fecha_creacion).
+    Devuelve los recibos ordenados por fecha de creación descendente.
+    """
+    ids = sorted(set(ids))
+    consulta = consulta_lectura(campos) if campos else ReciboMaterial.query
+    recibos = []
+    for bloque in dividir_en_bloques(ids, app.config['MAX_PARAMETROS_IN']):
+        recibos.extend(consulta.filter(ReciboMaterial.id.in_(bloque)).all())
+    recibos.sort(key=lambda r: r.fecha_creacion or datetime.datetime.min, reverse=True)
+    return recibos
+
+def obtener_importaciones_por_ids(ids):
+    """Carga de la bitácora de importación las entradas de los recibos indicados, por bloques."""
+    importaciones = {}
+    for bloque in dividir_en_bloques(sorted(set(ids)), app.config['MAX_PARAMETROS_IN']):
+        for importacion in ImportacionRecibo.query.filter(ImportacionRecibo.recibo_id.in_(bloque)).all():
+            importaciones[importacion.recibo_id] = importacion
+    return importaciones
+
+def registrar_envios(recibo_ids):
+    """
+    Agrega a la bandeja de salida los recibos indicados, en la sesión actual (sin commit),
+    para que queden en la misma transacción que el guardado. Un recibo que ya tiene
+    un envío pendiente o en proceso no se duplica, pero el envío sube de versión: si el enviador
+    ya había leído el recibo anterior, no lo marcará como enviado y lo enviará de nuevo (enviar_pendientes).
+    """
+    if not app.config['OUTBOX_ACTIVO']:
+        return
+    
+    pendientes = set()
+    for bloque in dividir_en_bloques(sorted(set(recibo_ids)), app.config['MAX_PARAMETROS_IN']):
+        filtro = (EnvioProduccion.recibo_id.in_(bloque), EnvioProduccion.estado.in_(('pendiente', 'en_proceso')))
+        # El UPDATE bloquea los envíos abiertos hasta el commit; si el enviador los cerró antes,
+        # ya no están abiertos y se crea un envío nuevo
+        db.session.query(EnvioProduccion).filter(*filtro).update(
+            {'version': db.func.coalesce(EnvioProduccion.version, 0) + 1}, synchronize_session=False)
+        pendientes.update(recibo_id for recibo_id, in db.session.query(EnvioProduccion.recibo_id).filter(*filtro))
+    
+    nuevos = [{'recibo_id': recibo_id, 'estado': 'pendiente', 'intentos': 0, 'version': 0,
+               'proximo_intento': datetime.datetime.now()}
+              for recibo_id in dict.fromkeys(recibo_ids) if recibo_id not in pendientes]
+    if nuevos:
+        db.session.bulk_insert_mappings(EnvioProduccion, nuevos)
+
+def insertar_recibos(registros):
+    """Inserta recibos en bloque y los agrega a la bandeja de salida en la misma transacción."""
+    if app.config['OUTBOX_ACTIVO']:
+        # return_defaults obtiene los IDs generados para registrar los envíos
+        db.session.bulk_insert_mappings(ReciboMaterial, registros, return_defaults=True)
+        registrar_envios([registro['id'] for registro in registros])
+    else:
+        db.session.bulk_insert_mappings(ReciboMaterial, registros)
+
+# Campos del recibo que determinan lo enviado a producción
+CAMPOS_IMPORTACION = [
+    'orden_compra', 'idordencompra', 'docto_cm_det_id', 'articulo_id', 'clave_articulo',
+    'descripcion_material', 'cantidad', 'idcode', 'cliente', 'procedencia'
+]
+
+def hash_importacion(recibo):
+    """Hash del contenido del recibo que se envía a producción, para detectar cambios desde la última importación."""
+    contenido = json.dumps([getattr(recibo, campo) for campo in CAMPOS_IMPORTACION], default=str)
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+def guardar_seleccion(ids):
+    """
+    Guarda una lista de IDs en el servidor y devuelve el token que la identifica.
+    Se guarda en cache_sesiones para que el token sirva en cualquier proceso; vence tras SELECCION_TTL.
+    """
+    token = uuid.uuid4().hex
+    cache_sesiones.guardar(('seleccion', token), [int(i) for i in ids], ttl=app.config['SELECCION_TTL'])
+    return token
+
+def obtener_seleccion(token):
+    """Devuelve los IDs de una selección guardada, o None si no existe o ya venció."""
+    return cache_sesiones.obtener(('seleccion', str(token)))
+
+def obtener_ids_solicitud():
+    """
+    Obtiene los IDs de recibos de la petición actual. Acepta, en este orden:
+    un token de selección ('seleccion'), una lista JSON ('ids') o una lista
+    separada por comas en el formulario o la URL ('ids').
+    """
+    datos_json = request.get_json(silent=True) or {}
+    
+    token = datos_json.get('seleccion') or request.values.get('seleccion')
+    if token:
+        ids = obtener_seleccion(token)
+        if ids is None:
+            raise ValueError('La selección no existe o ya venció')
+        return ids
+    
+    ids = datos_json.get('ids')
+    if ids is None:
+        ids = request.values.get('ids', '')
+    if isinstance(ids, str):
+        ids = [valor for valor in ids.split(',') if valor.strip()]
+    return [int(valor) for valor in ids if int(valor) > 0]
+
+# Consultas idénticas concurrentes se agrupan en una sola ejecución
+vuelo_procedencias = SingleFlight('procedencias')
+vuelo_articulos_oc = SingleFlight('articulos_oc')
 
 def get_procedencias():
-    """Obtiene lista de procedencias de SQL Server"""
+    """Obtiene lista de procedencias de SQL Server (una sola consulta para llamadas concurrentes)"""
+    return vuelo_procedencias.ejecutar('procedencias', consultar_procedencias)
+
+# Último catálogo de procedencias obtenido: se usa mientras producción no responde
+_procedencias_conocidas = {'datos': [], 'degradado': False, 'actualizado': 0}
+
+def consultar_procedencias():
+    """Consulta el catálogo de procedencias en SQL Server de producción (o el último conocido si falla)"""
     try:
         conn = get_sqlserver_prod_conn()
         cursor = conn.cursor()
@@ -193,207 +518,781 @@ def get_procedencias():
                 'descripcion': safe_encode(row[1])
             })
         conn.close()
+        ahora = time.time()
+        _procedencias_conocidas.update(datos=procedencias, degradado=False, actualizado=ahora)
+        cache_datos.guardar(('procedencias',), {'datos': procedencias, 'actualizado': ahora},
+                            app.config['PROCEDENCIAS_TTL'])
         return procedencias
     except Exception as e:
         print(f"Error al obtener procedencias: {str(e)}")
-        return []
+        _procedencias_conocidas['degradado'] = True
+        return _procedencias_conocidas['datos']
+
+@app.context_processor
+def estado_dependencias():
+    """Dependencias caídas o servidas con datos anteriores, para mostrar el aviso de modo degradado."""
+    degradados = [circuito.nombre for circuito in (circuito_produccion, circuito_firebird) if circuito.abierto()]
+    if _procedencias_conocidas['degradado'] and circuito_produccion.nombre not in degradados:
+        degradados.insert(0, circuito_produccion.nombre)
+    return {'servicios_degradados': degradados}
+
+# Archivos estáticos: URL con la huella del contenido para que el navegador los guarde sin vencimiento
+_huellas_estaticos = {}
+
+def huella_estatico(nombre):
+    """Huella del contenido de un archivo de static/ (se recalcula si cambia), o None si no existe."""
+    ruta = os.path.join(app.static_folder, nombre)
+    try:
+        modificado = os.path.getmtime(ruta)
+    except OSError:
+        return None
+    huella = _huellas_estaticos.get(nombre)
+    if huella is None or huella[0] != modificado:
+        with open(ruta, 'rb') as f:
+            huella = (modificado, hashlib.md5(f.read()).hexdigest()[:12])
+        _huellas_estaticos[nombre] = huella
+    return huella[1]
+
+def url_estatico(nombre):
+    """URL de un archivo de static/ con la huella de su contenido (?v=...), o None si no existe."""
+    huella = huella_estatico(nombre)
+    return url_for('static', filename=nombre, v=huella) if huella else None
+
+def url_recurso(nombre):
+    """Copia local de una biblioteca de RECURSOS_EXTERNOS (descargar_recursos.py) o, si aún no existe, su CDN."""
+    return url_estatico(nombre) or app.config['RECURSOS_EXTERNOS'][nombre]
+
+@app.context_processor
+def recursos_estaticos():
+    return {'url_estatico': url_estatico, 'url_recurso': url_recurso}
+
+# Tipos de contenido que vale la pena comprimir (las descargas de Excel y los CSV en streaming no)
+TIPOS_COMPRIMIBLES = {'text/html', 'application/json', 'text/css', 'application/javascript',
+                      'text/javascript', 'text/plain', 'image/svg+xml'}
+
+@app.after_request
+def comprimir_respuesta(response):
+    """
+    Comprime con gzip las respuestas de texto si el navegador lo acepta, y marca los estáticos
+    con huella para guardarse un año en el navegador (al cambiar el archivo cambia la URL).
+    """
+    estatico = request.endpoint == 'static'
+    # Solo con la huella vigente: una URL con otra huella (o inventada) no debe quedar fija un año
+    if (estatico and response.status_code == 200 and request.args.get('v')
+            and request.args['v'] == huella_estatico(request.view_args.get('filename', ''))):
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    
+    if (response.status_code != 200 or 'Content-Encoding' in response.headers
+            or response.mimetype not in TIPOS_COMPRIMIBLES):
+        return response
+    # Las respuestas en streaming (CSV, descargas) no se acumulan en memoria para comprimirlas
+    if response.is_streamed and not estatico:
+        return response
+    response.vary.add('Accept-Encoding')
+    if not request.accept_encodings['gzip']:
+        return response
+    
+    response.direct_passthrough = False
+    datos = response.get_data()
+    if len(datos) < app.config['COMPRESION_MINIMA']:
+        return response
+    response.set_data(gzip.compress(datos, compresslevel=app.config['COMPRESION_NIVEL']))
+    response.headers['Content-Encoding'] = 'gzip'
+    
+    # Misma versión con otra codificación: la etiqueta fuerte pasa a débil (sigue validando 304)
+    etag, debil = response.get_etag()
+    if etag and not debil:
+        response.set_etag(etag, weak=True)
+    return response
+
+def version_despliegue():
+    """
+    Huella de app.py y de las plantillas. Es la misma en todos los procesos de un despliegue,
+    por lo que sus ETag y los fragmentos de una caché compartida coinciden entre ellos.
+    """
+    huella = hashlib.sha1()
+    rutas = [os.path.abspath(__file__)] + sorted(
+        os.path.join(carpeta, nombre)
+        for carpeta, _, nombres in os.walk(os.path.join(app.root_path, app.template_folder))
+        for nombre in nombres)
+    for ruta in rutas:
+        with open(ruta, 'rb') as f:
+            huella.update(f.read())
+    return huella.hexdigest()
+
+# Respuestas condicionales (ETag): identifica la versión del código y de las plantillas
+VERSION_DESPLIEGUE = version_despliegue()
+
+def procedencias_vigentes():
+    """
+    Catálogo de procedencias para las páginas con ETag: el último conocido, el que otro proceso
+    guardó en cache_datos, o consultado de nuevo si tiene más de PROCEDENCIAS_TTL segundos.
+    Forma parte de la versión de la página.
+    """
+    if time.time() - _procedencias_conocidas['actualizado'] > app.config['PROCEDENCIAS_TTL']:
+        compartido = cache_datos.obtener(('procedencias',))
+        if compartido is None:
+            return get_procedencias()
+        _procedencias_conocidas.update(datos=compartido['datos'], degradado=False,
+                                       actualizado=compartido['actualizado'])
+    return _procedencias_conocidas['datos']
+
+def calcular_etag(*partes):
+    """ETag a partir de las versiones de los datos que componen una respuesta."""
+    return hashlib.sha1(json.dumps([VERSION_DESPLIEGUE, *partes], default=str).encode('utf-8')).hexdigest()
+
+def version_recursos():
+    """
+    Versión de lo que las páginas enlazan fuera de las plantillas: la huella de los archivos de
+    static/ (los ?v= de url_estatico), si cada biblioteca de RECURSOS_EXTERNOS se sirve local o
+    de su CDN, y SERVICIO_OC_URL. Cambia sin reiniciar, así que se calcula en cada validación.
+    """
+    nombres = set(app.config['RECURSOS_EXTERNOS'])
+    for carpeta, _, archivos in os.walk(app.static_folder):
+        relativa = os.path.relpath(carpeta, app.static_folder)
+        nombres.update(os.path.normpath(os.path.join(relativa, archivo)).replace(os.sep, '/') for archivo in archivos)
+    return [sorted((nombre, huella_estatico(nombre)) for nombre in nombres), app.config['SERVICIO_OC_URL']]
+
+def etag_pagina(*partes):
+    """
+    ETag de una página HTML: además de sus datos depende del aviso de servicios degradados y de
+    los recursos que enlaza (un cambio solo de JavaScript debe llegar a quien ya tiene la página).
+    """
+    return calcular_etag(*partes, estado_dependencias()['servicios_degradados'], version_recursos())
+
+def no_modificado(etag):
+    """
+    Devuelve una respuesta 304 si el navegador ya tiene la versión `etag`, o None si hay que generarla.
+    Con mensajes flash pendientes siempre se genera: la página debe mostrarlos.
+    """
+    if session.get('_flashes') or not request.if_none_match.contains_weak(etag):
+        return None
+    respuesta = Response(status=304)
+    respuesta.set_etag(etag, weak=True)
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta
+
+def con_etag(respuesta, etag):
+    """Agrega el ETag a la respuesta; no-cache hace que el navegador la revalide en cada uso."""
+    respuesta = make_response(respuesta)
+    respuesta.set_etag(etag, weak=True)
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta
+
+def filtrar_listado(consulta, filtro):
+    """Aplica a una consulta de recibos el filtro de texto del listado."""
+    if not filtro:
+        return consulta
+    # Manejar posibles problemas de codificación en el filtro
+    filtro_safe = safe_encode(filtro)
+    return consulta.filter(
+        db.or_(
+            ReciboMaterial.idcode.ilike(f'%{filtro_safe}%'),
+            ReciboMaterial.orden_compra.ilike(f'%{filtro_safe}%'),
+            ReciboMaterial.proveedor.ilike(f'%{filtro_safe}%'),
+            ReciboMaterial.descripcion_material.ilike(f'%{filtro_safe}%'),
+            ReciboMaterial.cliente.ilike(f'%{filtro_safe}%')
+        )
+    )
 
 # Rutas de la aplicación
 @app.route('/')
 def index():
     filtro = request.args.get('filtro', '')
+    today = datetime.datetime.now().strftime('%Y-%m-%d')
+    
+    # Versión del listado filtrado (alta, edición o baja): si el navegador ya la tiene, no se genera
+    version = filtrar_listado(
+        db.session.query(db.func.max(ReciboMaterial.fecha_modificacion), db.func.count(ReciboMaterial.id)),
+        filtro
+    ).one()
+    procedencias = procedencias_vigentes()
+    etag = etag_pagina('listado', filtro, tuple(version), today, procedencias)
+    respuesta = no_modificado(etag)
+    if respuesta:
+        return respuesta
     
     # Obtener recibos con filtro opcional
-    if filtro:
-        # Manejar posibles problemas de codificación en el filtro
-        filtro_safe = safe_encode(filtro)
-        query = ReciboMaterial.query.filter(
-            db.or_(
-                ReciboMaterial.idcode.ilike(f'%{filtro_safe}%'),
-                ReciboMaterial.orden_compra.ilike(f'%{filtro_safe}%'),
-                ReciboMaterial.proveedor.ilike(f'%{filtro_safe}%'),
-                ReciboMaterial.descripcion_material.ilike(f'%{filtro_safe}%'),
-                ReciboMaterial.cliente.ilike(f'%{filtro_safe}%')
-            )
-        )
+    recibos = filtrar_listado(consulta_lectura(CAMPOS_LISTADO), filtro).order_by(ReciboMaterial.fecha_creacion.desc()).all()
+    
+    return con_etag(
+        render_template('index.html', recibos=recibos, filtro=filtro, today=today,
+                        opciones_procedencia=opciones_procedencia(procedencias)),
+        etag
+    )
+
+def opciones_procedencia(procedencias):
+    """Opciones del <select> de procedencias, renderizadas una sola vez por versión del catálogo."""
+    clave = ('procedencias', hashlib.sha1(json.dumps(procedencias, default=str).encode('utf-8')).hexdigest())
+    html = cache_fragmentos.obtener(clave)
+    if html is None:
+        html = cache_fragmentos.guardar(clave, render_template('_opciones_procedencia.html', procedencias=procedencias))
+    return Markup(html)
+
+def recibo_a_dict(recibo):
+    """Convierte un recibo en diccionario serializable a JSON."""
+    return {
+        'id': recibo.id,
+        'idcode': recibo.idcode,
+        'fecha': recibo.fecha.strftime('%Y-%m-%d') if recibo.fecha else '',
+        'orden_compra': recibo.orden_compra,
+        'proveedor': recibo.proveedor,
+        'num_remision': recibo.num_remision,
+        'cantidad': recibo.cantidad,
+        'tipo': recibo.tipo,
+        'descripcion_material': recibo.descripcion_material,
+        'grado_acero': recibo.grado_acero,
+        'num_placa': recibo.num_placa,
+        'num_colada': recibo.num_colada,
+        'num_certificado': recibo.num_certificado,
+        'ot': recibo.ot,
+        'cliente': recibo.cliente,
+        'estatus': recibo.estatus,
+        'reporte_focc03': recibo.reporte_focc03,
+        'procedencia': recibo.procedencia,
+        'idordencompra': recibo.idordencompra,
+        'docto_cm_det_id': recibo.docto_cm_det_id,
+        'articulo_id': recibo.articulo_id,
+        'clave_articulo': recibo.clave_articulo,
+        'archivo': recibo.archivo
+    }
+
+def guardar_archivo_adjunto(archivo):
+    """Guarda un archivo subido en UPLOAD_FOLDER con nombre único. Devuelve el nombre o None."""
+    if not archivo or not archivo.filename:
+        return None
+    
+    # Manejar problemas potenciales de codificación en el nombre del archivo
+    try:
+        filename = archivo.filename
+    except UnicodeDecodeError:
+        # Si el nombre del archivo tiene problemas de codificación, generar uno seguro
+        extension = os.path.splitext(str(archivo.filename.encode('utf-8', errors='replace')))[1]
+        filename = f"archivo_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}{extension}"
+    
+    # Generar nombre único para el archivo
+    extension = os.path.splitext(filename)[1]
+    nombre_archivo = f"{uuid.uuid4().hex}{extension}"
+    ruta_completa = os.path.join(app.config['UPLOAD_FOLDER'], nombre_archivo)
+    
+    # Guardar archivo
+    archivo.save(ruta_completa)
+    return nombre_archivo
+
+def archivo_compartido(nombre_archivo, excluir_id):
+    """Indica si otro recibo (p. ej. de la misma entrega) usa el mismo archivo adjunto."""
+    return db.session.query(ReciboMaterial.id).filter(
+        ReciboMaterial.archivo == nombre_archivo,
+        ReciboMaterial.id != excluir_id
+    ).first() is not None
+
+# Campos de texto de ReciboMaterial que se capturan tal cual
+CAMPOS_TEXTO_RECIBO = [
+    'idcode', 'orden_compra', 'proveedor', 'num_remision', 'tipo',
+    'descripcion_material', 'grado_acero', 'num_placa', 'num_colada',
+    'num_certificado', 'ot', 'cliente', 'estatus', 'reporte_focc03', 'procedencia',
+    'clave_articulo'
+]
+
+# Llaves de Microsip guardadas en el recibo (orden de compra, línea y artículo)
+CAMPOS_ENTEROS_RECIBO = {
+    'idordencompra': 'ID de orden de compra',
+    'docto_cm_det_id': 'ID de línea de orden de compra',
+    'articulo_id': 'ID de artículo'
+}
+
+# Campos comunes a todas las líneas de una entrega (alta por lote)
+CAMPOS_ENCABEZADO_LOTE = ['orden_compra', 'proveedor', 'num_remision', 'fecha', 'idordencompra']
+
+# Encabezados reconocidos en archivos de importación (normalizados, sin acentos).
+# Incluye los encabezados de exportar_excel para poder reimportar un archivo exportado.
+ENCABEZADOS_IMPORTACION = {
+    'id code': 'idcode',
+    'orden de compra': 'orden_compra',
+    'oc': 'orden_compra',
+    'numero de remision': 'num_remision',
+    'remision': 'num_remision',
+    'descripcion del material': 'descripcion_material',
+    'descripcion': 'descripcion_material',
+    'grado de acero': 'grado_acero',
+    'grado': 'grado_acero',
+    'numero de placa': 'num_placa',
+    'placa': 'num_placa',
+    'numero de colada': 'num_colada',
+    'colada': 'num_colada',
+    'numero de certificado': 'num_certificado',
+    'certificado': 'num_certificado',
+    'reporte fo-cc-03': 'reporte_focc03',
+    'clave articulo': 'clave_articulo',
+    **{campo: campo for campo in CAMPOS_TEXTO_RECIBO + list(CAMPOS_ENTEROS_RECIBO) + ['fecha', 'cantidad']}
+}
+
+def normalizar_encabezado(texto):
+    """Normaliza un encabezado: minúsculas, sin acentos y con espacios simples."""
+    texto = unicodedata.normalize('NFKD', str(texto or ''))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.lower().split())
+
+def valor_celda(valor):
+    """Convierte el valor de una celda a lo que espera normalizar_linea_recibo."""
+    if isinstance(valor, float) and valor.is_integer():
+        # Excel guarda números enteros (idcode, placa, etc.) como flotantes
+        return str(int(valor))
+    if isinstance(valor, (datetime.date, datetime.datetime)) or valor is None:
+        return valor
+    return str(valor)
+
+def leer_filas_archivo(archivo):
+    """
+    Generador de filas (listas de valores) de un archivo .xlsx o .csv/.txt subido.
+    Usa openpyxl en modo read_only o un lector CSV en streaming para no cargar el archivo completo.
+    """
+    extension = os.path.splitext(archivo.filename or '')[1].lower()
+    
+    if extension == '.xlsx':
+        import openpyxl
+        wb = openpyxl.load_workbook(archivo.stream, read_only=True, data_only=True)
+        try:
+            for fila in wb.active.iter_rows(values_only=True):
+                yield list(fila)
+        finally:
+            wb.close()
+    
+    elif extension in ('.csv', '.txt', '.tsv'):
+        # Detectar codificación y delimitador con una muestra del inicio del archivo
+        muestra = archivo.stream.read(64 * 1024)
+        archivo.stream.seek(0)
+        try:
+            muestra.decode('utf-8')
+            codificacion = 'utf-8-sig'
+        except UnicodeDecodeError as e:
+            # Un corte a mitad de carácter al final de la muestra no indica otra codificación
+            if e.start >= len(muestra) - 3:
+                codificacion = 'utf-8-sig'
+            else:
+                import chardet
+                codificacion = chardet.detect(muestra)['encoding'] or 'latin-1'
+        texto_muestra = muestra.decode(codificacion, errors='replace')
+        try:
+            dialecto = csv.Sniffer().sniff(texto_muestra, delimiters=',;\t|')
+        except csv.Error:
+            dialecto = csv.excel_tab if extension == '.tsv' else csv.excel
+        
+        flujo = io.TextIOWrapper(archivo.stream, encoding=codificacion, errors='replace', newline='')
+        try:
+            for fila in csv.reader(flujo, dialecto):
+                yield fila
+        finally:
+            flujo.detach()
+    
     else:
-        query = ReciboMaterial.query
+        raise ValueError('Formato no soportado; use un archivo .xlsx o .csv')
+
+def normalizar_linea_recibo(linea):
+    """
+    Valida una línea de recibo (diccionario con valores de texto) y la convierte
+    a los tipos de ReciboMaterial. Lanza ValueError con un mensaje legible si algún valor no es válido.
+    """
+    datos = {}
+    for campo in CAMPOS_TEXTO_RECIBO:
+        valor = linea.get(campo)
+        valor = safe_encode(str(valor).strip()) if valor is not None else ''
+        longitud = ReciboMaterial.__table__.c[campo].type.length
+        if longitud and len(valor) > longitud:
+            raise ValueError(f'El campo {campo} excede {longitud} caracteres')
+        datos[campo] = valor
     
-    recibos = query.order_by(ReciboMaterial.fecha_creacion.desc()).all()
-    procedencias = get_procedencias()
+    # Fecha: acepta fechas ya convertidas, 'YYYY-MM-DD' o 'DD/MM/YYYY'
+    fecha = linea.get('fecha')
+    if isinstance(fecha, datetime.datetime):
+        fecha = fecha.date()
+    elif isinstance(fecha, datetime.date):
+        pass
+    elif fecha:
+        fecha_texto = str(fecha).strip()
+        fecha = None
+        for formato in ('%Y-%m-%d', '%d/%m/%Y'):
+            try:
+                fecha = datetime.datetime.strptime(fecha_texto, formato).date()
+                break
+            except ValueError:
+                continue
+        if fecha is None:
+            raise ValueError(f'Fecha inválida: {fecha_texto}')
+    else:
+        fecha = None
+    datos['fecha'] = fecha
     
-    today = datetime.datetime.now().strftime('%Y-%m-%d')
+    cantidad = linea.get('cantidad')
+    if cantidad is None or str(cantidad).strip() == '':
+        datos['cantidad'] = None
+    else:
+        try:
+            datos['cantidad'] = float(str(cantidad).strip().replace(',', ''))
+        except ValueError:
+            raise ValueError(f'Cantidad inválida: {cantidad}')
     
-    return render_template('index.html', recibos=recibos, filtro=filtro, procedencias=procedencias, today=today)
+    for campo, etiqueta in CAMPOS_ENTEROS_RECIBO.items():
+        datos[campo] = leer_entero(linea.get(campo), etiqueta)
+    
+    return datos
+
+def leer_entero(valor, etiqueta):
+    """Convierte un valor opcional a entero; lanza ValueError con la etiqueta del campo si no es válido."""
+    if valor is None or str(valor).strip() == '':
+        return None
+    try:
+        return int(str(valor).strip())
+    except ValueError:
+        raise ValueError(f'{etiqueta} inválido: {valor}')
+
+def procesar_guardado_recibo():
+    """
+    Crea o actualiza un recibo con los datos del formulario de la petición actual.
+    Devuelve el recibo guardado y el mensaje para el usuario; lanza excepción si falla.
+    """
+    accion = request.form.get('accion')
+    
+    if accion not in ['nuevo', 'editar']:
+        raise ValueError('Acción no válida')
+    
+    # Obtener datos del formulario y aplicar safe_encode
+    datos = {
+        'idcode': safe_encode(request.form.get('idcode', '')),
+        'fecha': request.form.get('fecha', datetime.datetime.now().strftime('%Y-%m-%d')),
+        'orden_compra': safe_encode(request.form.get('orden_compra', '')),
+        'proveedor': safe_encode(request.form.get('proveedor', '')),
+        'num_remision': safe_encode(request.form.get('num_remision', '')),
+        'cantidad': request.form.get('cantidad', ''),
+        'tipo': safe_encode(request.form.get('tipo', '')),
+        'descripcion_material': safe_encode(request.form.get('descripcion_material', '')),
+        'grado_acero': safe_encode(request.form.get('grado_acero', '')),
+        'num_placa': safe_encode(request.form.get('num_placa', '')),
+        'num_colada': safe_encode(request.form.get('num_colada', '')),
+        'num_certificado': safe_encode(request.form.get('num_certificado', '')),
+        'ot': safe_encode(request.form.get('ot', '')),
+        'cliente': safe_encode(request.form.get('cliente', '')),
+        'estatus': safe_encode(request.form.get('estatus', '')),
+        'reporte_focc03': safe_encode(request.form.get('reporte_focc03', '')),
+        'procedencia': safe_encode(request.form.get('procedencia', '')),
+        'clave_articulo': safe_encode(request.form.get('clave_articulo', ''))
+    }
+    
+    # Llaves de Microsip del artículo elegido en la búsqueda por orden de compra
+    for campo, etiqueta in CAMPOS_ENTEROS_RECIBO.items():
+        datos[campo] = leer_entero(request.form.get(campo), etiqueta)
+    
+    # Procesar archivo adjunto con manejo de encoding
+    nombre_archivo = guardar_archivo_adjunto(request.files.get('archivo'))
+    
+    # Crear o actualizar recibo
+    if accion == 'nuevo':
+        recibo = ReciboMaterial(
+            idcode=datos['idcode'],
+            fecha=datetime.datetime.strptime(datos['fecha'], '%Y-%m-%d').date() if datos['fecha'] else None,
+            orden_compra=datos['orden_compra'],
+            proveedor=datos['proveedor'],
+            num_remision=datos['num_remision'],
+            cantidad=float(datos['cantidad']) if datos['cantidad'] else None,
+            tipo=datos['tipo'],
+            descripcion_material=datos['descripcion_material'],
+            grado_acero=datos['grado_acero'],
+            num_placa=datos['num_placa'],
+            num_colada=datos['num_colada'],
+            num_certificado=datos['num_certificado'],
+            ot=datos['ot'],
+            cliente=datos['cliente'],
+            estatus=datos['estatus'],
+            reporte_focc03=datos['reporte_focc03'],
+            procedencia=datos['procedencia'],
+            idordencompra=datos['idordencompra'],
+            docto_cm_det_id=datos['docto_cm_det_id'],
+            articulo_id=datos['articulo_id'],
+            clave_articulo=datos['clave_articulo'],
+            archivo=nombre_archivo
+        )
+        db.session.add(recibo)
+        mensaje = 'Recibo creado correctamente'
+    else:
+        # Editar recibo existente
+        id_recibo = request.form.get('id')
+        recibo = ReciboMaterial.query.get_or_404(id_recibo)
+        anteriores = {campo: getattr(recibo, campo) for campo in CAMPOS_AUTOCOMPLETAR}
+        
+        # Actualizar campos
+        recibo.idcode = datos['idcode']
+        recibo.fecha = datetime.datetime.strptime(datos['fecha'], '%Y-%m-%d').date() if datos['fecha'] else None
+        recibo.orden_compra = datos['orden_compra']
+        recibo.proveedor = datos['proveedor']
+        recibo.num_remision = datos['num_remision']
+        recibo.cantidad = float(datos['cantidad']) if datos['cantidad'] else None
+        recibo.tipo = datos['tipo']
+        recibo.descripcion_material = datos['descripcion_material']
+        recibo.grado_acero = datos['grado_acero']
+        recibo.num_placa = datos['num_placa']
+        recibo.num_colada = datos['num_colada']
+        recibo.num_certificado = datos['num_certificado']
+        recibo.ot = datos['ot']
+        recibo.cliente = datos['cliente']
+        recibo.estatus = datos['estatus']
+        recibo.reporte_focc03 = datos['reporte_focc03']
+        recibo.procedencia = datos['procedencia']
+        recibo.idordencompra = datos['idordencompra']
+        recibo.docto_cm_det_id = datos['docto_cm_det_id']
+        recibo.articulo_id = datos['articulo_id']
+        recibo.clave_articulo = datos['clave_articulo']
+        
+        # Actualizar archivo solo si hay uno nuevo
+        if nombre_archivo:
+            # Eliminar archivo anterior si existe y ningún otro recibo lo comparte
+            if recibo.archivo and not archivo_compartido(recibo.archivo, recibo.id):
+                ruta_anterior = os.path.join(app.config['UPLOAD_FOLDER'], recibo.archivo)
+                if os.path.exists(ruta_anterior):
+                    os.remove(ruta_anterior)
+            
+            recibo.archivo = nombre_archivo
+        
+        mensaje = 'Recibo actualizado correctamente'
+    
+    # Encolar el envío a producción en la misma transacción
+    db.session.flush()
+    registrar_envios([recibo.id])
+    db.session.commit()
+    cache_fragmentos.invalidar('detalles', recibo.id)
+    
+    if accion == 'editar':
+        registrar_autocompletado([anteriores], -1)
+    registrar_autocompletado([datos])
+    return recibo, mensaje
 
 @app.route('/guardar_recibo', methods=['POST'])
 def guardar_recibo():
     try:
-        accion = request.form.get('accion')
+        recibo, mensaje = procesar_guardado_recibo()
+        flash(mensaje, 'success')
         
-        if accion not in ['nuevo', 'editar']:
-            flash('Acción no válida', 'danger')
-            return redirect(url_for('index'))
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error: {str(e)}', 'danger')
+    
+    return redirect(url_for('index'))
+
+@app.route('/guardar_recibo_json', methods=['POST'])
+def guardar_recibo_json():
+    """Variante AJAX de guardar_recibo: devuelve solo la fila guardada, sin recargar el listado."""
+    try:
+        recibo, mensaje = procesar_guardado_recibo()
+        return jsonify({'status': 'success', 'message': mensaje, 'recibo': recibo_a_dict(recibo)})
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': f'Error: {str(e)}'})
+
+@app.route('/guardar_recibos_lote', methods=['POST'])
+def guardar_recibos_lote():
+    """
+    Alta de varias líneas de una misma entrega en una sola petición.
+    Acepta JSON {'encabezado': {...}, 'lineas': [...]} o un formulario multipart con los
+    campos del encabezado, 'lineas' como texto JSON y un 'archivo' compartido por todas las líneas.
+    Todas las líneas se validan juntas y se insertan con un solo commit.
+    """
+    try:
+        if request.is_json:
+            payload = request.get_json()
+            encabezado = payload.get('encabezado', {})
+            lineas = payload.get('lineas', [])
+        else:
+            encabezado = {campo: request.form.get(campo) for campo in CAMPOS_ENCABEZADO_LOTE
+                          if request.form.get(campo) is not None}
+            lineas = json.loads(request.form.get('lineas') or '[]')
         
-        # Obtener datos del formulario y aplicar safe_encode
-        datos = {
-            'idcode': safe_encode(request.form.get('idcode', '')),
-            'fecha': request.form.get('fecha', datetime.datetime.now().strftime('%Y-%m-%d')),
-            'orden_compra': safe_encode(request.form.get('orden_compra', '')),
-            'proveedor': safe_encode(request.form.get('proveedor', '')),
-            'num_remision': safe_encode(request.form.get('num_remision', '')),
-            'cantidad': request.form.get('cantidad', ''),
-            'tipo': safe_encode(request.form.get('tipo', '')),
-            'descripcion_material': safe_encode(request.form.get('descripcion_material', '')),
-            'grado_acero': safe_encode(request.form.get('grado_acero', '')),
-            'num_placa': safe_encode(request.form.get('num_placa', '')),
-            'num_colada': safe_encode(request.form.get('num_colada', '')),
-            'num_certificado': safe_encode(request.form.get('num_certificado', '')),
-            'ot': safe_encode(request.form.get('ot', '')),
-            'cliente': safe_encode(request.form.get('cliente', '')),
-            'estatus': safe_encode(request.form.get('estatus', '')),
-            'reporte_focc03': safe_encode(request.form.get('reporte_focc03', '')),
-            'procedencia': safe_encode(request.form.get('procedencia', ''))
-        }
+        if not isinstance(lineas, list) or not lineas:
+            return jsonify({'status': 'error', 'message': 'No se especificaron líneas para guardar'})
+        
+        if len(lineas) > app.config['MAX_LINEAS_LOTE']:
+            return jsonify({'status': 'error',
+                            'message': f"El lote excede el máximo de {app.config['MAX_LINEAS_LOTE']} líneas"})
         
-        # Procesar archivo adjunto con manejo de encoding
-        archivo = request.files.get('archivo')
-        nombre_archivo = None
+        # Los campos del encabezado se aplican a todas las líneas
+        encabezado = {campo: valor for campo, valor in encabezado.items() if campo in CAMPOS_ENCABEZADO_LOTE}
         
-        if archivo and archivo.filename:
-            # Manejar problemas potenciales de codificación en el nombre del archivo
+        # Validar todas las líneas antes de insertar cualquiera
+        registros = []
+        errores = []
+        for numero, linea in enumerate(lineas, 1):
             try:
-                filename = archivo.filename
-            except UnicodeDecodeError:
-                # Si el nombre del archivo tiene problemas de codificación, generar uno seguro
-                extension = os.path.splitext(str(archivo.filename.encode('utf-8', errors='replace')))[1]
-                filename = f"archivo_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}{extension}"
-            
-            # Generar nombre único para el archivo
-            extension = os.path.splitext(filename)[1]
-            nombre_archivo = f"{uuid.uuid4().hex}{extension}"
-            ruta_completa = os.path.join(app.config['UPLOAD_FOLDER'], nombre_archivo)
-            
-            # Guardar archivo
-            archivo.save(ruta_completa)
-        
-        # Crear o actualizar recibo
-        if accion == 'nuevo':
-            recibo = ReciboMaterial(
-                idcode=datos['idcode'],
-                fecha=datetime.datetime.strptime(datos['fecha'], '%Y-%m-%d').date() if datos['fecha'] else None,
-                orden_compra=datos['orden_compra'],
-                proveedor=datos['proveedor'],
-                num_remision=datos['num_remision'],
-                cantidad=float(datos['cantidad']) if datos['cantidad'] else None,
-                tipo=datos['tipo'],
-                descripcion_material=datos['descripcion_material'],
-                grado_acero=datos['grado_acero'],
-                num_placa=datos['num_placa'],
-                num_colada=datos['num_colada'],
-                num_certificado=datos['num_certificado'],
-                ot=datos['ot'],
-                cliente=datos['cliente'],
-                estatus=datos['estatus'],
-                reporte_focc03=datos['reporte_focc03'],
-                procedencia=datos['procedencia'],
-                archivo=nombre_archivo
-            )
-            db.session.add(recibo)
-            mensaje = 'Recibo creado correctamente'
-        else:
-            # Editar recibo existente
-            id_recibo = request.form.get('id')
-            recibo = ReciboMaterial.query.get_or_404(id_recibo)
-            
-            # Actualizar campos
-            recibo.idcode = datos['idcode']
-            recibo.fecha = datetime.datetime.strptime(datos['fecha'], '%Y-%m-%d').date() if datos['fecha'] else None
-            recibo.orden_compra = datos['orden_compra']
-            recibo.proveedor = datos['proveedor']
-            recibo.num_remision = datos['num_remision']
-            recibo.cantidad = float(datos['cantidad']) if datos['cantidad'] else None
-            recibo.tipo = datos['tipo']
-            recibo.descripcion_material = datos['descripcion_material']
-            recibo.grado_acero = datos['grado_acero']
-            recibo.num_placa = datos['num_placa']
-            recibo.num_colada = datos['num_colada']
-            recibo.num_certificado = datos['num_certificado']
-            recibo.ot = datos['ot']
-            recibo.cliente = datos['cliente']
-            recibo.estatus = datos['estatus']
-            recibo.reporte_focc03 = datos['reporte_focc03']
-            recibo.procedencia = datos['procedencia']
+                registros.append(normalizar_linea_recibo({**linea, **encabezado}))
+            except (ValueError, TypeError, AttributeError) as e:
+                errores.append({'linea': numero, 'mensaje': str(e)})
+        
+        if errores:
+            return jsonify({
+                'status': 'error',
+                'message': f'Se encontraron {len(errores)} líneas con errores; no se guardó ningún recibo',
+                'errores': errores
+            })
+        
+        # Un solo certificado compartido por todas las líneas de la entrega
+        nombre_archivo = guardar_archivo_adjunto(request.files.get('archivo'))
+        for registro in registros:
+            registro['archivo'] = nombre_archivo
+        
+        insertar_recibos(registros)
+        db.session.commit()
+        registrar_autocompletado(registros)
+        
+        return jsonify({
+            'status': 'success',
+            'message': f'Se guardaron {len(registros)} recibos correctamente',
+            'insertados': len(registros)
+        })
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': f'Error: {str(e)}'})
+
+@app.route('/importar_archivo_recibos', methods=['POST'])
+def importar_archivo_recibos():
+    """
+    Importa recibos desde una lista de empaque (.xlsx o .csv) del proveedor.
+    Las filas se validan y se insertan por lotes; las filas con error se omiten
+    y se reportan con su número de fila.
+    """
+    archivo = request.files.get('archivo')
+    if not archivo or not archivo.filename:
+        return jsonify({'status': 'error', 'message': 'No se recibió ningún archivo'})
+    
+    tamano_lote = app.config['IMPORTACION_TAMANO_LOTE']
+    max_errores = app.config['IMPORTACION_MAX_ERRORES']
+    insertados = 0
+    total_errores = 0
+    errores = []
+    procedencias_por_nombre = None
+    
+    def registrar_error(numero_fila, mensaje):
+        nonlocal total_errores
+        total_errores += 1
+        if len(errores) < max_errores:
+            errores.append({'fila': numero_fila, 'mensaje': mensaje})
+    
+    try:
+        filas = leer_filas_archivo(archivo)
+        
+        # La primera fila no vacía contiene los encabezados
+        columnas = None
+        numero_fila = 0
+        for encabezados in filas:
+            numero_fila += 1
+            if any(valor not in (None, '') for valor in encabezados):
+                columnas = [ENCABEZADOS_IMPORTACION.get(normalizar_encabezado(e)) for e in encabezados]
+                break
+        
+        if not columnas or not any(columnas):
+            return jsonify({'status': 'error', 'message': 'No se reconocieron columnas en el archivo'})
+        
+        lote = []
+        for fila in filas:
+            numero_fila += 1
+            if not any(valor not in (None, '') for valor in fila):
+                continue
             
-            # Actualizar archivo solo si hay uno nuevo
-            if nombre_archivo:
-                # Eliminar archivo anterior si existe
-                if recibo.archivo:
-                    ruta_anterior = os.path.join(app.config['UPLOAD_FOLDER'], recibo.archivo)
-                    if os.path.exists(ruta_anterior):
-                        os.remove(ruta_anterior)
+            linea = {campo: valor_celda(valor) for campo, valor in zip(columnas, fila) if campo}
+            try:
+                # La procedencia puede venir como ID o como descripción del catálogo
+                procedencia = str(linea.get('procedencia') or '').strip()
+                if procedencia and not procedencia.isdigit():
+                    if procedencias_por_nombre is None:
+                        procedencias_por_nombre = {
+                            normalizar_encabezado(p['descripcion']): str(p['id']) for p in get_procedencias()
+                        }
+                    linea['procedencia'] = procedencias_por_nombre.get(normalizar_encabezado(procedencia))
+                    if linea['procedencia'] is None:
+                        raise ValueError(f'Procedencia desconocida: {procedencia}')
                 
-                recibo.archivo = nombre_archivo
+                lote.append(normalizar_linea_recibo(linea))
+            except ValueError as e:
+                registrar_error(numero_fila, str(e))
+                continue
             
-            mensaje = 'Recibo actualizado correctamente'
-        
-        db.session.commit()
-        flash(mensaje, 'success')
+            if len(lote) >= tamano_lote:
+                insertar_recibos(lote)
+                db.session.commit()
+                registrar_autocompletado(lote)
+                insertados += len(lote)
+                lote = []
         
+        if lote:
+            insertar_recibos(lote)
+            db.session.commit()
+            registrar_autocompletado(lote)
+            insertados += len(lote)
+    
     except Exception as e:
         db.session.rollback()
-        flash(f'Error: {str(e)}', 'danger')
+        return jsonify({
+            'status': 'error',
+            'message': f'Error al importar el archivo: {str(e)}',
+            'insertados': insertados,
+            'total_errores': total_errores,
+            'errores': errores
+        })
     
-    return redirect(url_for('index'))
+    mensaje = f'Se importaron {insertados} recibos'
+    if total_errores:
+        mensaje += f'. {total_errores} filas con errores no se importaron.'
+    else:
+        mensaje += ' correctamente.'
+    
+    return jsonify({
+        'status': 'success' if insertados > 0 else 'error',
+        'message': mensaje,
+        'insertados': insertados,
+        'total_errores': total_errores,
+        'errores': errores
+    })
+
+def version_recibo(id):
+    """Versión de un recibo (su fecha_modificacion) sin cargarlo; 404 si no existe."""
+    fila = db.session.query(ReciboMaterial.fecha_modificacion).filter(ReciboMaterial.id == id).first()
+    if fila is None:
+        abort(404)
+    return fila[0]
 
 @app.route('/obtener_recibo/<int:id>')
 def obtener_recibo(id):
-    recibo = ReciboMaterial.query.get_or_404(id)
+    etag = calcular_etag('recibo', id, version_recibo(id))
+    respuesta = no_modificado(etag)
+    if respuesta:
+        return respuesta
     
-    # Convertir a diccionario
-    data = {
-        'id': recibo.id,
-        'idcode': recibo.idcode,
-        'fecha': recibo.fecha.strftime('%Y-%m-%d') if recibo.fecha else '',
-        'orden_compra': recibo.orden_compra,
-        'proveedor': recibo.proveedor,
-        'num_remision': recibo.num_remision,
-        'cantidad': recibo.cantidad,
-        'tipo': recibo.tipo,
-        'descripcion_material': recibo.descripcion_material,
-        'grado_acero': recibo.grado_acero,
-        'num_placa': recibo.num_placa,
-        'num_colada': recibo.num_colada,
-        'num_certificado': recibo.num_certificado,
-        'ot': recibo.ot,
-        'cliente': recibo.cliente,
-        'estatus': recibo.estatus,
-        'reporte_focc03': recibo.reporte_focc03,
-        'procedencia': recibo.procedencia,
-        'archivo': recibo.archivo
-    }
+    recibo = ReciboMaterial.query.get_or_404(id)
     
-    return jsonify({'status': 'success', 'recibo': data})
+    return con_etag(jsonify({'status': 'success', 'recibo': recibo_a_dict(recibo)}), etag)
 
 @app.route('/detalles_recibo/<int:id>')
 def detalles_recibo(id):
-    recibo = ReciboMaterial.query.get_or_404(id)
+    procedencias = procedencias_vigentes()
+    etag = etag_pagina('detalles', id, version_recibo(id), procedencias)
+    respuesta = no_modificado(etag)
+    if respuesta:
+        return respuesta
     
-    # Obtener nombre de procedencia si existe
-    nombre_procedencia = ""
-    if recibo.procedencia:
-        try:
-            conn = get_sqlserver_prod_conn()
-            cursor = conn.cursor()
-            cursor.execute("SELECT descripcion FROM tbprocedenciacalidad WHERE idprocedencia = ?", recibo.procedencia)
-            row = cursor.fetchone()
-            if row:
-                nombre_procedencia = safe_encode(row[0])  # Aplicar safe_encode para evitar problemas de codificación
-            conn.close()
-        except Exception as e:
-            print(f"Error al obtener procedencia: {str(e)}")
+    # El ETag ya reúne la versión del recibo, el catálogo y el aviso de degradado: sirve de clave
+    clave = ('detalles', id, etag)
+    html = cache_fragmentos.obtener(clave)
+    if html is None:
+        recibo = ReciboMaterial.query.get_or_404(id)
+        
+        # Nombre de la procedencia desde el catálogo vigente (tbprocedenciacalidad)
+        nombre_procedencia = ""
+        if recibo.procedencia:
+            nombre_procedencia = next((p['descripcion'] for p in procedencias
+                                       if str(p['id']) == str(recibo.procedencia)), '')
+        
+        html = cache_fragmentos.guardar(clave, render_template(
+            'detalles_recibo.html', recibo=recibo, nombre_procedencia=nombre_procedencia))
     
-    return render_template('detalles_recibo.html', recibo=recibo, nombre_procedencia=nombre_procedencia)
+    return con_etag(html, etag)
 
 @app.route('/descargar_archivo/<int:id>')
 def descargar_archivo(id):
@@ -415,117 +1314,492 @@ def descargar_archivo(id):
     
     return send_file(ruta_archivo, as_attachment=True)
 
-@app.route('/exportar_excel')
+@app.route('/seleccion', methods=['POST'])
+def crear_seleccion():
+    """Guarda en el servidor una selección de IDs y devuelve un token para exportar o importar."""
+    try:
+        ids = obtener_ids_solicitud()
+        if not ids:
+            return jsonify({'status': 'error', 'message': 'No se especificaron IDs'})
+        return jsonify({'status': 'success', 'token': guardar_seleccion(ids), 'total': len(ids)})
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)})
+
+# Encabezados del listado exportado (Excel y CSV)
+ENCABEZADOS_EXPORTACION = [
+    'ID Code', 'Fecha', 'Orden de Compra', 'Proveedor', 'Número de Remisión',
+    'Cantidad', 'Tipo', 'Descripción del Material', 'Grado de Acero', 'Número de Placa',
+    'Número de Colada', 'Número de Certificado', 'OT', 'Cliente', 'Estatus',
+    'Reporte FO-CC-03', 'Procedencia'
+]
+
+def mapa_procedencias():
+    """Devuelve el catálogo de procedencias como diccionario {id (texto): descripción}."""
+    return {str(p['id']): p['descripcion'] for p in get_procedencias()}
+
+def fila_exportacion(recibo, procedencias):
+    """Valores de un recibo en el orden de ENCABEZADOS_EXPORTACION."""
+    return [
+        recibo.idcode,
+        recibo.fecha.strftime('%d/%m/%Y') if recibo.fecha else '',
+        recibo.orden_compra,
+        recibo.proveedor,
+        recibo.num_remision,
+        recibo.cantidad,
+        recibo.tipo,
+        recibo.descripcion_material,
+        recibo.grado_acero,
+        recibo.num_placa,
+        recibo.num_colada,
+        recibo.num_certificado,
+        recibo.ot,
+        recibo.cliente,
+        recibo.estatus,
+        recibo.reporte_focc03,
+        procedencias.get(str(recibo.procedencia), '') if recibo.procedencia else ''
+    ]
+
+def obtener_parametros_exportacion():
+    """
+    Lee de la petición actual qué recibos exportar:
+    - todos=1: todo el listado
+    - desde=<fecha ISO> y/o consumidor=<nombre>: solo los creados o modificados después de
+      esa fecha o de la última exportación registrada para el consumidor (modo incremental).
+      Con consumidor se repiten los últimos EXPORTACION_INCREMENTAL_SOLAPE segundos ya
+      exportados: el consumidor descarta los recibos repetidos por su ID Code.
+    - ids / seleccion: los recibos indicados
+    """
+    datos_json = request.get_json(silent=True) or {}
+    
+    def valor(clave):
+        return datos_json.get(clave, request.values.get(clave))
+    
+    parametros = {
+        'todos': str(valor('todos')) in ('1', 'True', 'true'),
+        'ids': [],
+        'delta': False,
+        'desde': None,
+        'hasta': None,
+        'consumidor': (valor('consumidor') or '').strip() or None
+    }
+    desde = valor('desde')
+    
+    if desde or parametros['consumidor']:
+        parametros['delta'] = True
+        if desde:
+            try:
+                parametros['desde'] = datetime.datetime.fromisoformat(str(desde))
+            except ValueError:
+                raise ValueError(f'Fecha "desde" inválida: {desde}')
+        else:
+            marca = db.session.get(MarcaExportacion, parametros['consumidor'])
+            if marca and marca.ultima_modificacion:
+                parametros['desde'] = marca.ultima_modificacion - datetime.timedelta(
+                    seconds=app.config['EXPORTACION_INCREMENTAL_SOLAPE'])
+        
+        # Cota superior fija y con retraso: fecha_modificacion se asigna antes del commit, así que
+        # un guardado en curso puede confirmarse con una fecha anterior a la última ya visible.
+        # Lo posterior a la cota entra en la siguiente exportación.
+        limite = datetime.datetime.now() - datetime.timedelta(seconds=app.config['EXPORTACION_INCREMENTAL_RETRASO'])
+        maximo = db.session.query(db.func.max(ReciboMaterial.fecha_modificacion)).scalar()
+        parametros['hasta'] = min(maximo, limite) if maximo else None
+    elif not parametros['todos']:
+        parametros['ids'] = obtener_ids_solicitud()
+    
+    return parametros
+
+def hay_recibos_por_exportar(parametros):
+    """Indica si los parámetros describen algún conjunto de recibos a exportar."""
+    return parametros['todos'] or parametros['delta'] or bool(parametros['ids'])
+
+def consulta_exportacion(parametros):
+    """Consulta (sin ejecutar) para exportaciones completas o incrementales."""
+    if parametros['delta']:
+        # Usa el índice sobre fecha_modificacion: el costo depende de los cambios, no del tamaño de la tabla
+        consulta = consulta_lectura(CAMPOS_EXPORTACION)
+        if parametros['desde']:
+            consulta = consulta.filter(ReciboMaterial.fecha_modificacion > parametros['desde'])
+        if parametros['hasta']:
+            consulta = consulta.filter(ReciboMaterial.fecha_modificacion <= parametros['hasta'])
+        return consulta.order_by(ReciboMaterial.fecha_modificacion)
+    return consulta_lectura(CAMPOS_EXPORTACION).order_by(ReciboMaterial.fecha_creacion.desc())
+
+def consultar_recibos_exportacion(parametros):
+    """Obtiene los recibos a exportar: todos, los cambios recientes o los IDs indicados (por bloques)."""
+    if parametros['ids']:
+        return obtener_recibos_por_ids(parametros['ids'], CAMPOS_EXPORTACION)
+    return consulta_exportacion(parametros).all()
+
+def avanzar_marca_exportacion(parametros):
+    """Registra hasta dónde se exportó para el consumidor de una exportación incremental."""
+    if not parametros['consumidor'] or not parametros['hasta']:
+        return
+    marca = db.session.get(MarcaExportacion, parametros['consumidor'])
+    if marca is None:
+        marca = MarcaExportacion(consumidor=parametros['consumidor'])
+        db.session.add(marca)
+    # Con el solape, la cota de esta exportación puede quedar antes de la marca anterior: nunca retroceder
+    if marca.ultima_modificacion is None or parametros['hasta'] > marca.ultima_modificacion:
+        marca.ultima_modificacion = parametros['hasta']
+    db.session.commit()
+
+def version_recibos(parametros=None, reporte=None):
+    """
+    Versión de los datos de una exportación: (máxima fecha_modificacion, cantidad de recibos).
+    Cambia con cualquier alta, edición o baja dentro de la selección.
+    """
+    consulta = db.session.query(db.func.max(ReciboMaterial.fecha_modificacion), db.func.count(ReciboMaterial.id))
+    
+    if reporte is not None:
+        return consulta.filter(ReciboMaterial.reporte_focc03 == reporte).one()
+    
+    if parametros['ids']:
+        maximo, total = None, 0
+        for bloque in dividir_en_bloques(sorted(set(parametros['ids'])), app.config['MAX_PARAMETROS_IN']):
+            maximo_bloque, total_bloque = consulta.filter(ReciboMaterial.id.in_(bloque)).one()
+            if maximo_bloque and (maximo is None or maximo_bloque > maximo):
+                maximo = maximo_bloque
+            total += total_bloque
+        return maximo, total
+    
+    return consulta.one()
+
+def clave_cache_exportacion(tipo, **datos):
+    """Clave de caché a partir del tipo de exportación y sus parámetros normalizados."""
+    return json.dumps({'tipo': tipo, **datos}, sort_keys=True, default=str)
+
+def catalogo_exportacion():
+    """
+    Catálogo de procedencias {id (texto): descripción} para el libro de exportación, y si el
+    libro puede guardarse en caché: no si producción no respondió o el catálogo está vacío,
+    para no seguir sirviendo la columna Procedencia en blanco o vieja cuando se recupere.
+    """
+    procedencias = procedencias_vigentes()
+    vigente = bool(procedencias) and not _procedencias_conocidas['degradado']
+    return {str(p['id']): p['descripcion'] for p in procedencias}, vigente
+
+def clave_cache_recibos(parametros, procedencias):
+    """Clave de caché del listado exportado; None si la exportación no debe guardarse en caché."""
+    if parametros['delta']:
+        # Las exportaciones incrementales avanzan la marca del consumidor: siempre se generan
+        return None
+    return clave_cache_exportacion(
+        'recibos',
+        todos=parametros['todos'],
+        ids=sorted(set(parametros['ids'])),
+        version=version_recibos(parametros),
+        procedencias=hashlib.sha1(json.dumps(procedencias, sort_keys=True).encode('utf-8')).hexdigest()
+    )
+
+def nombre_exportacion(parametros, extension):
+    prefijo = 'Recibos_Material_Cambios' if parametros['delta'] else 'Recibos_Material'
+    return f"{prefijo}_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.{extension}"
+
+def construir_libro_recibos(recibos, procedencias):
+    """Genera el libro de Excel con el listado de recibos y el nombre de su procedencia (catalogo_exportacion)."""
+    import openpyxl
+    from openpyxl.styles import Font, PatternFill
+    
+    # Crear libro de Excel
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Recibos de Material"
+    
+    # Estilo para encabezados
+    header_font = Font(color="FFFFFF", bold=True)
+    header_fill = PatternFill(start_color="DC0000", end_color="DC0000", fill_type="solid")
+    
+    # Escribir encabezados
+    for col_num, header in enumerate(ENCABEZADOS_EXPORTACION, 1):
+        cell = ws.cell(row=1, column=col_num, value=header)
+        cell.font = header_font
+        cell.fill = header_fill
+    
+    # Escribir datos; las procedencias se resuelven con el catálogo cargado una sola vez
+    for row_num, recibo in enumerate(recibos, 2):
+        for col_num, valor in enumerate(fila_exportacion(recibo, procedencias), 1):
+            ws.cell(row=row_num, column=col_num, value=valor)
+    
+    # Ajustar anchos de columna
+    for col in ws.columns:
+        max_length = 0
+        column = col[0].column_letter
+        for cell in col:
+            if cell.value:
+                max_length = max(max_length, len(str(cell.value)))
+        adjusted_width = (max_length + 2)
+        ws.column_dimensions[column].width = adjusted_width
+    
+    return wb
+
+@app.route('/exportar_excel', methods=['GET', 'POST'])
 def exportar_excel():
     try:
-        # Determinar si exportar todos o seleccionados
-        todos = request.args.get('todos') == '1'
-        ids = request.args.get('ids')
+        # Determinar qué exportar: todos, cambios recientes o seleccionados (URL, POST o token)
+        parametros = obtener_parametros_exportacion()
         
-        if not todos and not ids:
+        if not hay_recibos_por_exportar(parametros):
             flash('No se especificaron IDs para exportar', 'danger')
             return redirect(url_for('index'))
         
+        # Descargas repetidas de datos y catálogo sin cambios se sirven desde la caché
+        procedencias, catalogo_vigente = catalogo_exportacion()
+        clave = clave_cache_recibos(parametros, procedencias)
+        ruta_cache = cache_exportaciones.obtener(clave) if clave else None
+        if ruta_cache:
+            return send_file(
+                ruta_cache,
+                as_attachment=True,
+                download_name=nombre_exportacion(parametros, 'xlsx'),
+                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            )
+        
         # Obtener recibos
-        if todos:
-            recibos = ReciboMaterial.query.order_by(ReciboMaterial.fecha_creacion.desc()).all()
-        else:
-            ids_list = [int(id) for id in ids.split(',')]
-            recibos = ReciboMaterial.query.filter(ReciboMaterial.id.in_(ids_list)).order_by(ReciboMaterial.fecha_creacion.desc()).all()
+        recibos = consultar_recibos_exportacion(parametros)
         
-        if not recibos:
+        # En modo incremental un resultado vacío es válido (libro solo con encabezados)
+        if not recibos and not parametros['delta']:
             flash('No hay recibos para exportar', 'danger')
             return redirect(url_for('index'))
         
-        # Crear libro de Excel
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Recibos de Material"
+        wb = construir_libro_recibos(recibos, procedencias)
         
-        # Estilo para encabezados
-        header_font = Font(color="FFFFFF", bold=True)
-        header_fill = PatternFill(start_color="DC0000", end_color="DC0000", fill_type="solid")
+        # Crear buffer para el archivo
+        output = BytesIO()
+        wb.save(output)
+        output.seek(0)
+        avanzar_marca_exportacion(parametros)
+        if clave and catalogo_vigente:
+            cache_exportaciones.guardar(clave, output.getvalue())
         
-        # Definir encabezados
-        headers = [
-            'ID Code', 'Fecha', 'Orden de Compra', 'Proveedor', 'Número de Remisión',
-            'Cantidad', 'Tipo', 'Descripción del Material', 'Grado de Acero', 'Número de Placa',
-            'Número de Colada', 'Número de Certificado', 'OT', 'Cliente', 'Estatus',
-            'Reporte FO-CC-03', 'Procedencia'
-        ]
+        # Nombre del archivo
+        filename = nombre_exportacion(parametros, 'xlsx')
         
-        # Escribir encabezados
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col_num, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
+        return send_file(
+            output,
+            as_attachment=True,
+            download_name=filename,
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
         
-        # Obtener conexión para procedencias
-        conn = None
-        try:
-            conn = get_sqlserver_prod_conn()
-            cursor = conn.cursor()
-            
-            # Escribir datos
-            for row_num, recibo in enumerate(recibos, 2):
-                ws.cell(row=row_num, column=1, value=recibo.idcode)
-                ws.cell(row=row_num, column=2, value=recibo.fecha.strftime('%d/%m/%Y') if recibo.fecha else '')
-                ws.cell(row=row_num, column=3, value=recibo.orden_compra)
-                ws.cell(row=row_num, column=4, value=recibo.proveedor)
-                ws.cell(row=row_num, column=5, value=recibo.num_remision)
-                ws.cell(row=row_num, column=6, value=recibo.cantidad)
-                ws.cell(row=row_num, column=7, value=recibo.tipo)
-                ws.cell(row=row_num, column=8, value=recibo.descripcion_material)
-                ws.cell(row=row_num, column=9, value=recibo.grado_acero)
-                ws.cell(row=row_num, column=10, value=recibo.num_placa)
-                ws.cell(row=row_num, column=11, value=recibo.num_colada)
-                ws.cell(row=row_num, column=12, value=recibo.num_certificado)
-                ws.cell(row=row_num, column=13, value=recibo.ot)
-                ws.cell(row=row_num, column=14, value=recibo.cliente)
-                ws.cell(row=row_num, column=15, value=recibo.estatus)
-                ws.cell(row=row_num, column=16, value=recibo.reporte_focc03)
-                
-                # Obtener nombre de procedencia
-                nombre_procedencia = ''
-                if recibo.procedencia:
-                    cursor.execute("SELECT descripcion FROM tbprocedenciacalidad WHERE idprocedencia = ?", recibo.procedencia)
-                    row = cursor.fetchone()
-                    if row:
-                        nombre_procedencia = safe_encode(row[0])  # Aplicar safe_encode
-                
-                ws.cell(row=row_num, column=17, value=nombre_procedencia)
-        finally:
-            if conn:
-                conn.close()
+    except Exception as e:
+        flash(f'Error al exportar: {str(e)}', 'danger')
+        return redirect(url_for('index'))
+
+def generar_csv_recibos(recibos, procedencias, delimitador, comprimir, al_terminar=None):
+    """
+    Generador que produce el CSV por bloques a medida que se recorren los recibos,
+    opcionalmente comprimido con gzip, para que la memoria se mantenga constante.
+    al_terminar se invoca cuando se generó el archivo completo.
+    """
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31) if comprimir else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimitador, lineterminator='\r\n')
+    
+    def vaciar():
+        datos = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return compresor.compress(datos) if compresor else datos
+    
+    # BOM para que Excel reconozca UTF-8 al abrir el archivo
+    buffer.write('\ufeff')
+    writer.writerow(ENCABEZADOS_EXPORTACION)
+    yield vaciar()
+    
+    for recibo in recibos:
+        writer.writerow(['' if valor is None else valor for valor in fila_exportacion(recibo, procedencias)])
+        if buffer.tell() >= 64 * 1024:
+            bloque = vaciar()
+            if bloque:
+                yield bloque
+    
+    bloque = vaciar()
+    if compresor:
+        bloque += compresor.flush()
+    if bloque:
+        yield bloque
+    
+    if al_terminar:
+        al_terminar()
+
+@app.route('/exportar_csv', methods=['GET', 'POST'])
+def exportar_csv():
+    """
+    Exporta el listado como CSV (o TSV con formato=tsv) en streaming, con las mismas
+    columnas que exportar_excel. Con gzip=1 se entrega comprimido como .csv.gz.
+    """
+    try:
+        parametros = obtener_parametros_exportacion()
         
-        # Ajustar anchos de columna
-        for col in ws.columns:
-            max_length = 0
-            column = col[0].column_letter
-            for cell in col:
-                if cell.value:
-                    max_length = max(max_length, len(str(cell.value)))
-            adjusted_width = (max_length + 2)
-            ws.column_dimensions[column].width = adjusted_width
+        if not hay_recibos_por_exportar(parametros):
+            flash('No se especificaron IDs para exportar', 'danger')
+            return redirect(url_for('index'))
         
-        # Crear buffer para el archivo
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
+        tsv = request.values.get('formato') == 'tsv'
+        comprimir = request.values.get('gzip') == '1'
+        procedencias = mapa_procedencias()
+        
+        if parametros['ids']:
+            recibos = obtener_recibos_por_ids(parametros['ids'], CAMPOS_EXPORTACION)
+        else:
+            # yield_per materializa los recibos por bloques en lugar de cargarlos todos
+            recibos = consulta_exportacion(parametros).yield_per(1000)
+        
+        filename = nombre_exportacion(parametros, 'tsv' if tsv else 'csv')
+        if comprimir:
+            filename += '.gz'
+        
+        response = Response(
+            stream_with_context(generar_csv_recibos(
+                recibos, procedencias, '\t' if tsv else ',', comprimir,
+                al_terminar=lambda: avanzar_marca_exportacion(parametros)
+            )),
+            mimetype='application/gzip' if comprimir else f'text/{"tab-separated-values" if tsv else "csv"}'
+        )
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    
+    except Exception as e:
+        flash(f'Error al exportar: {str(e)}', 'danger')
+        return redirect(url_for('index'))
+
+# Exportaciones en segundo plano: el estado de cada trabajo vive en cache_sesiones
+# (('exportacion', trabajo) -> {'estado', 'archivo', 'nombre', 'creado', ...}) para consultarlo desde cualquier proceso
+_trabajos_lock = threading.Lock()
+_pool_exportacion = None
+
+def obtener_pool_exportacion():
+    """Crea bajo demanda el pool de procesos para exportaciones largas."""
+    global _pool_exportacion
+    with _trabajos_lock:
+        if _pool_exportacion is None:
+            _pool_exportacion = ProcessPoolExecutor(max_workers=app.config['EXPORTACION_PROCESOS'])
+        return _pool_exportacion
+
+def ejecutar_exportacion(parametros, ruta_destino):
+    """
+    Genera el libro de exportación dentro de un proceso del pool y lo guarda en ruta_destino.
+    Se escribe primero a un archivo temporal para que la descarga nunca vea un archivo a medias.
+    """
+    with app.app_context():
+        ruta_temporal = ruta_destino + '.tmp'
+        
+        procedencias, catalogo_vigente = catalogo_exportacion()
+        clave = clave_cache_recibos(parametros, procedencias)
+        ruta_cache = cache_exportaciones.obtener(clave) if clave else None
+        if ruta_cache:
+            shutil.copyfile(ruta_cache, ruta_temporal)
+            os.replace(ruta_temporal, ruta_destino)
+            return version_recibos(parametros)[1]
+        
+        recibos = consultar_recibos_exportacion(parametros)
+        if not recibos and not parametros['delta']:
+            raise ValueError('No hay recibos para exportar')
+        wb = construir_libro_recibos(recibos, procedencias)
+        wb.save(ruta_temporal)
+        os.replace(ruta_temporal, ruta_destino)
+        avanzar_marca_exportacion(parametros)
+        if clave and catalogo_vigente:
+            with open(ruta_destino, 'rb') as f:
+                cache_exportaciones.guardar(clave, f.read())
+        return len(recibos)
+
+def guardar_trabajo_exportacion(trabajo_id, trabajo):
+    """Guarda el estado del trabajo en cache_sesiones; vence junto con su archivo (EXPORTACION_TTL)."""
+    cache_sesiones.guardar(('exportacion', trabajo_id), trabajo, ttl=app.config['EXPORTACION_TTL'])
+
+def obtener_trabajo_exportacion(trabajo_id):
+    """Devuelve el estado guardado del trabajo, o None si no existe o ya venció."""
+    return cache_sesiones.obtener(('exportacion', str(trabajo_id)))
+
+def terminar_trabajo_exportacion(trabajo_id, trabajo, future):
+    """Al terminar el proceso del pool, registra el resultado del trabajo para todos los procesos."""
+    trabajo = dict(trabajo)
+    try:
+        trabajo.update(estado='terminado', total=future.result())
+    except Exception as e:
+        trabajo.update(estado='error', message=str(e))
+    try:
+        guardar_trabajo_exportacion(trabajo_id, trabajo)
+    except Exception as e:
+        print(f"Error al registrar la exportación {trabajo_id}: {str(e)}")
+
+def limpiar_exportaciones_vencidas():
+    """Elimina los archivos de exportación con más antigüedad que EXPORTACION_TTL (los trabajos vencen solos)."""
+    limite = time.time() - app.config['EXPORTACION_TTL']
+    carpeta = app.config['EXPORT_FOLDER']
+    for nombre in os.listdir(carpeta):
+        ruta = os.path.join(carpeta, nombre)
+        try:
+            if os.path.isfile(ruta) and os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+        except OSError as e:
+            print(f"Error al eliminar exportación vencida {nombre}: {str(e)}")
+
+@app.route('/exportaciones', methods=['POST'])
+def crear_exportacion():
+    """Encola una exportación a Excel y devuelve el trabajo para consultar su estado."""
+    try:
+        limpiar_exportaciones_vencidas()
         
-        # Nombre del archivo
-        filename = f"Recibos_Material_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.xlsx"
+        parametros = obtener_parametros_exportacion()
+        if not hay_recibos_por_exportar(parametros):
+            return jsonify({'status': 'error', 'message': 'No se especificaron IDs para exportar'})
         
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        trabajo_id = uuid.uuid4().hex
+        ruta = os.path.join(app.config['EXPORT_FOLDER'], f'{trabajo_id}.xlsx')
+        trabajo = {
+            'estado': 'pendiente',
+            'archivo': ruta,
+            'nombre': nombre_exportacion(parametros, 'xlsx'),
+            'creado': time.time()
+        }
+        guardar_trabajo_exportacion(trabajo_id, trabajo)
+        future = obtener_pool_exportacion().submit(ejecutar_exportacion, parametros, ruta)
+        future.add_done_callback(lambda f: terminar_trabajo_exportacion(trabajo_id, trabajo, f))
         
+        return jsonify({
+            'status': 'success',
+            'trabajo': trabajo_id,
+            'url_estado': url_for('estado_exportacion', trabajo_id=trabajo_id)
+        })
+    
     except Exception as e:
-        flash(f'Error al exportar: {str(e)}', 'danger')
+        return jsonify({'status': 'error', 'message': f'Error al crear la exportación: {str(e)}'})
+
+@app.route('/exportaciones/<trabajo_id>')
+def estado_exportacion(trabajo_id):
+    """Estado de un trabajo de exportación: pendiente, terminado o error."""
+    limpiar_exportaciones_vencidas()
+    
+    trabajo = obtener_trabajo_exportacion(trabajo_id)
+    if not trabajo:
+        return jsonify({'status': 'error', 'message': 'La exportación no existe o ya venció'}), 404
+    
+    respuesta = {'status': 'success', 'trabajo': trabajo_id, 'estado': trabajo['estado']}
+    if trabajo['estado'] == 'error':
+        respuesta['message'] = trabajo.get('message')
+    elif trabajo['estado'] == 'terminado':
+        respuesta['total'] = trabajo.get('total')
+        respuesta['url_descarga'] = url_for('descargar_exportacion', trabajo_id=trabajo_id)
+    
+    return jsonify(respuesta)
+
+@app.route('/exportaciones/<trabajo_id>/descargar')
+def descargar_exportacion(trabajo_id):
+    trabajo = obtener_trabajo_exportacion(trabajo_id)
+    
+    if not trabajo or trabajo['estado'] != 'terminado' or not os.path.exists(trabajo['archivo']):
+        flash('La exportación no está disponible o ya venció', 'danger')
         return redirect(url_for('index'))
+    
+    return send_file(
+        trabajo['archivo'],
+        as_attachment=True,
+        download_name=trabajo['nombre'],
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
 
 @app.route('/exportar_reporte_focc03')
 def exportar_reporte_focc03():
@@ -537,14 +1811,38 @@ def exportar_reporte_focc03():
             flash('Reporte no especificado', 'danger')
             return redirect(url_for('index'))
         
+        # Nombre del archivo
+        filename = f"Reporte_FOCC03_{reporte}_{datetime.datetime.now().strftime('%Y-%m-%d')}.xlsx"
+        
+        # El reporte incluye la fecha del día, así que forma parte de la clave de caché.
+        # No lleva columna de procedencia: no depende del catálogo de producción
+        clave = clave_cache_exportacion(
+            'focc03',
+            reporte=reporte,
+            fecha=datetime.date.today().isoformat(),
+            version=version_recibos(reporte=reporte)
+        )
+        ruta_cache = cache_exportaciones.obtener(clave)
+        if ruta_cache:
+            return send_file(
+                ruta_cache,
+                as_attachment=True,
+                download_name=filename,
+                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            )
+        
         # Obtener recibos con el mismo reporte FO-CC-03
-        recibos = ReciboMaterial.query.filter_by(reporte_focc03=reporte).order_by(ReciboMaterial.fecha_creacion).all()
+        recibos = (consulta_lectura(CAMPOS_REPORTE_FOCC03)
+                   .filter(ReciboMaterial.reporte_focc03 == reporte)
+                   .order_by(ReciboMaterial.fecha_creacion).all())
         
         if not recibos:
             flash('No hay recibos para el reporte especificado', 'danger')
             return redirect(url_for('index'))
         
         # Crear libro de Excel
+        import openpyxl
+        from openpyxl.styles import Font, Border, Side, Alignment, PatternFill
         wb = openpyxl.Workbook()
         ws = wb.active
         ws.title = "Reporte FO-CC-03"
@@ -639,9 +1937,7 @@ def exportar_reporte_focc03():
         output = BytesIO()
         wb.save(output)
         output.seek(0)
-        
-        # Nombre del archivo
-        filename = f"Reporte_FOCC03_{reporte}_{datetime.datetime.now().strftime('%Y-%m-%d')}.xlsx"
+        cache_exportaciones.guardar(clave, output.getvalue())
         
         return send_file(
             output,
@@ -654,274 +1950,700 @@ def exportar_reporte_focc03():
         flash(f'Error al exportar reporte: {str(e)}', 'danger')
         return redirect(url_for('index'))
 
-@app.route('/importar_sqlserver', methods=['POST'])
-def importar_sqlserver():
-    response = {
-        'status': 'error',
-        'message': 'No se pudo procesar la solicitud',
-        'logs': []
+def resolver_articulo_firebird(recibo, obtener_cursor_fb, add_log):
+    """
+    Obtiene DOCTO_CM_ID, ARTICULO_ID, CLAVE_ARTICULO y nombre del artículo de un recibo.
+    - Si el recibo ya guarda el artículo elegido en buscar_articulos_por_oc, no consulta Firebird.
+    - Si solo guarda DOCTO_CM_DET_ID, busca la línea de la orden por llave exacta.
+    - Los recibos capturados sin elegir artículo se buscan por descripción (LIKE).
+    Devuelve None si no se pudo resolver.
+    """
+    if recibo.idordencompra and recibo.articulo_id and recibo.clave_articulo:
+        add_log("Artículo ya registrado en el recibo; no se consulta Firebird")
+        return {
+            'docto_cm_id': recibo.idordencompra,
+            'docto_cm_det_id': recibo.docto_cm_det_id,
+            'articulo_id': recibo.articulo_id,
+            'clave_articulo': recibo.clave_articulo,
+            'nombre_articulo': safe_encode(recibo.descripcion_material)
+        }
+    
+    cursor_fb = obtener_cursor_fb()
+    
+    if recibo.docto_cm_det_id:
+        cursor_fb.execute("""
+            SELECT 
+                DET."DOCTO_CM_ID",
+                DET."CLAVE_ARTICULO",
+                DET."ARTICULO_ID",
+                ART."NOMBRE" AS ARTICULO
+            FROM 
+                "DOCTOS_CM_DET" DET
+                INNER JOIN "ARTICULOS" ART ON ART."ARTICULO_ID" = DET."ARTICULO_ID"
+            WHERE 
+                DET."DOCTO_CM_DET_ID" = ?
+        """, (recibo.docto_cm_det_id,))
+        articulo_row = cursor_fb.fetchone()
+        
+        if articulo_row:
+            return {
+                'docto_cm_id': articulo_row[0],
+                'docto_cm_det_id': recibo.docto_cm_det_id,
+                'articulo_id': articulo_row[2],
+                'clave_articulo': articulo_row[1],
+                'nombre_articulo': safe_encode(articulo_row[3])
+            }
+        add_log(f"No se encontró DOCTO_CM_DET_ID {recibo.docto_cm_det_id}; se buscará por descripción")
+    
+    # 1. Obtener DOCTO_CM_ID de Firebird (si no se guardó al capturar)
+    docto_cm_id = recibo.idordencompra
+    if not docto_cm_id:
+        if not recibo.orden_compra:
+            add_log(f"Recibo ID {recibo.id} no tiene orden de compra")
+            return None
+        
+        cursor_fb.execute('SELECT "DOCTO_CM_ID" FROM "DOCTOS_CM" WHERE "FOLIO" = ? AND "TIPO_DOCTO" = ?', 
+                         (recibo.orden_compra, 'O'))
+        docto_cm_id_row = cursor_fb.fetchone()
+        
+        if not docto_cm_id_row:
+            add_log(f"No se encontró DOCTO_CM_ID para la orden de compra {recibo.orden_compra}")
+            return None
+        
+        docto_cm_id = docto_cm_id_row[0]
+        add_log(f"DOCTO_CM_ID encontrado: {docto_cm_id}")
+    
+    # 2. Obtener detalles del artículo directamente de DOCTOS_CM_DET
+    # Usamos LIKE con safe_encode para manejar problemas de codificación
+    descripcion_material_safe = safe_encode(recibo.descripcion_material)
+    cursor_fb.execute("""
+        SELECT 
+            DET."DOCTO_CM_DET_ID",
+            DET."CLAVE_ARTICULO",
+            DET."ARTICULO_ID",
+            ART."NOMBRE" AS ARTICULO,
+            DET."UNIDADES",
+            DET."PRECIO_UNITARIO"
+        FROM 
+            "DOCTOS_CM_DET" DET
+            INNER JOIN "ARTICULOS" ART ON ART."ARTICULO_ID" = DET."ARTICULO_ID"
+        WHERE 
+            DET."DOCTO_CM_ID" = ?
+            AND ART."NOMBRE" LIKE ?
+    """, (docto_cm_id, f"%{descripcion_material_safe}%"))
+    
+    articulo_row = cursor_fb.fetchone()
+    
+    if not articulo_row:
+        add_log(f"No se encontró el artículo '{descripcion_material_safe}' en la orden {recibo.orden_compra}")
+        return None
+    
+    return {
+        'docto_cm_id': docto_cm_id,
+        'docto_cm_det_id': articulo_row[0],
+        'articulo_id': articulo_row[2],
+        'clave_articulo': articulo_row[1],
+        'nombre_articulo': safe_encode(articulo_row[3])
     }
+
+class PoolFirebird:
+    """
+    Conexiones a Firebird compartiendo un solo túnel SSH, para resolver artículos en paralelo.
+    El túnel y las conexiones se abren solo cuando se piden; cada hilo toma una conexión
+    libre o abre una nueva, por lo que nunca hay más conexiones que hilos de trabajo.
+    Cada conexión ocupa un lugar de bulkhead_firebird: la primera con `reservar` y las
+    siguientes solo si hay uno libre (si no, se espera a que se libere una conexión propia).
+    """
     
-    def add_log(message):
-        response['logs'].append(message)
+    def __init__(self, add_log):
+        self.add_log = add_log
+        self.libres = queue.LifoQueue()
+        self.conexiones = []
+        self.tunel = None
+        self.error = None
+        self.lock = threading.Lock()
+        self.lugares = 0  # Lugares del bulkhead tomados (uno por conexión abierta o por abrir)
     
-    try:
-        # Verificar IDs de recibos
-        ids = request.json.get('ids', [])
-        if not ids:
-            raise Exception('No se especificaron IDs para importar')
+    def reservar(self):
+        """Toma el lugar de la primera conexión; lanza Saturado si Firebird no admite más sesiones."""
+        bulkhead_firebird.adquirir()
+        with self.lock:
+            self.lugares += 1
+    
+    def _lugar_disponible(self):
+        """Indica si hay un lugar del bulkhead para una conexión más (tomándolo si hace falta)."""
+        if self.lugares > len(self.conexiones):
+            return True
+        if bulkhead_firebird.intentar_adquirir():
+            self.lugares += 1
+            return True
+        return False
+    
+    def tomar(self):
+        try:
+            return self.libres.get_nowait()
+        except queue.Empty:
+            pass
         
-        # Validar IDs
-        ids = [int(id) for id in ids if int(id) > 0]
-        if not ids:
-            raise Exception('No se especificaron IDs válidos')
+        with self.lock:
+            if self.error:
+                raise Exception(self.error)
+            if not self._lugar_disponible():
+                conn = None
+            elif self.tunel is None:
+                firebird_result = get_firebird_conn()
+                if not firebird_result['status']:
+                    self.error = f'Error al conectar con Firebird: {firebird_result["message"]}'
+                    raise Exception(self.error)
+                self.tunel = firebird_result['tunnel']
+                conn = firebird_result['conn']
+            else:
+                try:
+                    conn, _ = conectar_firebird(self.tunel.local_bind_port)
+                except Exception:
+                    if not self.conexiones:
+                        raise
+                    conn = None
+            if conn is not None:
+                self.conexiones.append(conn)
+                return conn
         
-        add_log("Iniciando proceso de importación")
+        # Sin lugar en el bulkhead o el servidor no aceptó otra conexión: esperar a que se libere una de las abiertas
+        try:
+            return self.libres.get(timeout=60)
+        except queue.Empty:
+            raise Exception('No hay conexiones a Firebird disponibles')
+    
+    def devolver(self, conn):
+        self.libres.put(conn)
+    
+    def descartar(self, conn):
+        """Cierra una conexión que falló para no reutilizarla."""
+        with self.lock:
+            if conn in self.conexiones:
+                self.conexiones.remove(conn)
+        try:
+            conn.close()
+        except Exception:
+            pass
+    
+    def cerrar(self):
+        if self.tunel is not None:
+            self.add_log(f"Se usaron {len(self.conexiones)} conexiones a Firebird")
+        for conn in self.conexiones:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self.conexiones = []
+        if self.tunel is not None and self.tunel.is_active:
+            self.tunel.close()
+        with self.lock:
+            for _ in range(self.lugares):
+                bulkhead_firebird.liberar()
+            self.lugares = 0
+
+def resolver_articulo_en_hilo(datos, pool_fb):
+    """
+    Resuelve el artículo de un recibo en un hilo de trabajo con una conexión del pool.
+    Los mensajes se acumulan para que el escritor los agregue en el orden de los recibos.
+    Devuelve (artículo, mensajes, excepción).
+    """
+    mensajes = []
+    conexion = []
+    
+    def obtener_cursor_fb():
+        if not conexion:
+            conexion.append(pool_fb.tomar())
+        return conexion[0].cursor()
+    
+    try:
+        articulo = resolver_articulo_firebird(datos, obtener_cursor_fb, mensajes.append)
+        if conexion:
+            pool_fb.devolver(conexion[0])
+        return articulo, mensajes, None
+    except Exception as e:
+        if conexion:
+            pool_fb.descartar(conexion[0])
+        return None, mensajes, e
+
+# Evita que el envío automático y una importación manual escriban el mismo recibo a la vez
+_importacion_lock = threading.Lock()
+
+def importar_con_turno(ids, add_log):
+    """
+    Ejecuta _importar_recibos cuando termina la importación en curso, esperando como máximo
+    FIREBIRD_ESPERA_COLA segundos; si no, lanza Saturado en lugar de ocupar el hilo sin límite.
+    """
+    if not _importacion_lock.acquire(timeout=app.config['FIREBIRD_ESPERA_COLA']):
+        raise Saturado('Hay otra importación a producción en curso', app.config['FIREBIRD_ESPERA_COLA'])
+    try:
+        return _importar_recibos(ids, add_log)
+    finally:
+        _importacion_lock.release()
+
+def _importar_recibos(ids, add_log):
+    """
+    Envía los recibos indicados a SQL Server de producción.
+    La resolución de artículos en Firebird corre en paralelo con FIREBIRD_POOL_SIZE hilos;
+    la escritura en producción se hace en el hilo actual, en el orden de `ids`, con una
+    transacción por recibo. Devuelve un diccionario id -> (estado, mensaje), con estado
+    'procesado', 'omitido' (sin cambios desde la última importación), 'rechazado' (no se
+    enviará mientras no se corrija el recibo: no existe o no tiene orden de compra o artículo)
+    o 'error' (puede resolverse al reintentar).
+    """
+    # Sin duplicados y conservando el orden de la selección
+    ids = list(dict.fromkeys(ids))
+    resultados = {}
+    
+    conn_prod = None
+    pool_fb = PoolFirebird(add_log)
+    ejecutor = ThreadPoolExecutor(max_workers=app.config['FIREBIRD_POOL_SIZE'])
+    try:
+        # Lugar del bulkhead para la primera conexión a Firebird (Saturado si no hay)
+        pool_fb.reservar()
         
         # Conexión a SQL Server de producción
         conn_prod = get_sqlserver_prod_conn()
         add_log("Conexión a SQL Server de producción establecida")
         
-        # Establecer conexión con Firebird vía SSH
-        firebird_result = get_firebird_conn()
-        if not firebird_result['status']:
-            raise Exception(f'Error al conectar con Firebird: {firebird_result["message"]}')
-        
-        fb_conn = firebird_result['conn']
-        tunnel = firebird_result['tunnel']
-        add_log("Conexión a Firebird establecida")
+        # Cargar todos los recibos seleccionados y su bitácora con consultas por bloques
+        recibos_por_id = {recibo.id: recibo for recibo in obtener_recibos_por_ids(ids)}
+        importaciones = obtener_importaciones_por_ids(ids)
         
-        # Procesar cada recibo
-        recibos_procesados = 0
-        errores = 0
+        # 1-2. Resolver en paralelo la orden de compra y el artículo de los recibos por enviar.
+        # Los hilos reciben una copia de los datos: los objetos de la sesión no se comparten entre hilos.
+        resoluciones = {}
+        for id in ids:
+            recibo = recibos_por_id.get(id)
+            if not recibo:
+                continue
+            importacion = importaciones.get(id)
+            if importacion and importacion.hash_contenido == hash_importacion(recibo):
+                continue
+            datos = SimpleNamespace(**recibo_a_dict(recibo))
+            resoluciones[id] = ejecutor.submit(resolver_articulo_en_hilo, datos, pool_fb)
         
+        # Escribir en producción en el orden de la selección
         for id in ids:
             try:
                 # Obtener datos del recibo
-                recibo = ReciboMaterial.query.get(id)
+                recibo = recibos_por_id.get(id)
                 if not recibo:
                     add_log(f"Recibo ID {id} no encontrado")
-                    errores += 1
-                    continue
-                
-                add_log(f"Procesando recibo ID {id}: {safe_encode(recibo.descripcion_material)}")
-                
-                # 1. Obtener DOCTO_CM_ID de Firebird
-                if not recibo.orden_compra:
-                    add_log(f"Recibo ID {id} no tiene orden de compra")
-                    errores += 1
-                    continue
-                
-                cursor_fb = fb_conn.cursor()
-                cursor_fb.execute('SELECT "DOCTO_CM_ID" FROM "DOCTOS_CM" WHERE "FOLIO" = ? AND "TIPO_DOCTO" = ?', 
-                                 (recibo.orden_compra, 'O'))
-                docto_cm_id_row = cursor_fb.fetchone()
-                
-                if not docto_cm_id_row:
-                    add_log(f"No se encontró DOCTO_CM_ID para la orden de compra {recibo.orden_compra}")
-                    errores += 1
+                    resultados[id] = ('rechazado', 'Recibo no encontrado')
                     continue
                 
-                docto_cm_id = docto_cm_id_row[0]
-                add_log(f"DOCTO_CM_ID encontrado: {docto_cm_id}")
-                
-                # 2. Insertar en tb_recibomtlcalidad
-                cursor_prod = conn_prod.cursor()
-                cursor_prod.execute("INSERT INTO tb_recibomtlcalidad (idOrdenCompra, lote) VALUES (?, ?)",
-                                   (docto_cm_id, 1))
-                conn_prod.commit()
-                
-                # Obtener el ID generado
-                cursor_prod.execute("SELECT @@IDENTITY")
-                idrecibo = cursor_prod.fetchval()
-                
-                if not idrecibo:
-                    add_log("Error al obtener el ID del recibo insertado")
-                    conn_prod.rollback()
-                    errores += 1
+                # Omitir los recibos ya enviados que no cambiaron desde entonces
+                importacion = importaciones.get(id)
+                if id not in resoluciones:
+                    add_log(f"Recibo ID {id} sin cambios desde su importación (idrecibo {importacion.idrecibo}); se omite")
+                    resultados[id] = ('omitido', None)
                     continue
                 
-                add_log(f"Registro insertado en tb_recibomtlcalidad con ID: {idrecibo}")
-                
-                # 3. Obtener detalles del artículo directamente de DOCTOS_CM_DET
-                # Usamos LIKE con safe_encode para manejar problemas de codificación
-                descripcion_material_safe = safe_encode(recibo.descripcion_material)
-                cursor_fb.execute("""
-                    SELECT 
-                        DET."DOCTO_CM_DET_ID",
-                        DET."CLAVE_ARTICULO",
-                        DET."ARTICULO_ID",
-                        ART."NOMBRE" AS ARTICULO,
-                        DET."UNIDADES",
-                        DET."PRECIO_UNITARIO"
-                    FROM 
-                        "DOCTOS_CM_DET" DET
-                        INNER JOIN "ARTICULOS" ART ON ART."ARTICULO_ID" = DET."ARTICULO_ID"
-                    WHERE 
-                        DET."DOCTO_CM_ID" = ?
-                        AND ART."NOMBRE" LIKE ?
-                """, (docto_cm_id, f"%{descripcion_material_safe}%"))
-                
-                articulo_row = cursor_fb.fetchone()
+                add_log(f"Procesando recibo ID {id}: {safe_encode(recibo.descripcion_material)}")
                 
-                if not articulo_row:
-                    add_log(f"No se encontró el artículo '{descripcion_material_safe}' en la orden {recibo.orden_compra}")
-                    conn_prod.rollback()
-                    errores += 1
+                articulo, mensajes, error = resoluciones.pop(id).result()
+                for mensaje in mensajes:
+                    add_log(mensaje)
+                if error:
+                    raise error
+                if not articulo:
+                    resultados[id] = ('rechazado', mensajes[-1] if mensajes else 'No se pudo resolver el artículo')
                     continue
                 
-                clave_articulo = articulo_row[1]
-                articulo_id = articulo_row[2]
-                nombre_articulo = safe_encode(articulo_row[3])
-                
-                add_log(f"Artículo encontrado: ID={articulo_id}, Clave={clave_articulo}, Nombre={nombre_articulo}")
+                add_log(f"Artículo encontrado: ID={articulo['articulo_id']}, Clave={articulo['clave_articulo']}, "
+                        f"Nombre={articulo['nombre_articulo']}")
                 
-                # 5. Actualizar el ID de orden de compra en la tabla local
-                recibo.idordencompra = docto_cm_id
+                # 3. Guardar en el recibo local las llaves resueltas para no volver a buscarlas
+                recibo.idordencompra = articulo['docto_cm_id']
+                recibo.docto_cm_det_id = articulo['docto_cm_det_id']
+                recibo.articulo_id = articulo['articulo_id']
+                recibo.clave_articulo = articulo['clave_articulo']
                 db.session.commit()
                 
-                # 4. Insertar en tb_recibomtlcalidaddetalle
-                cursor_prod.execute("""
-                    INSERT INTO tb_recibomtlcalidaddetalle (
-                        idrecibo, idProducto, descripcion, cantidad, idClave, 
-                        usuarioalta, fechaalta, lote, comentarios, idestatus, 
-                        iduom, idprocedencia, idordencompra
-                    ) VALUES (?, ?, ?, ?, ?, ?, GETDATE(), ?, ?, ?, ?, ?, ?)
-                """, (
-                    idrecibo,
-                    clave_articulo,
-                    nombre_articulo,
+                cursor_prod = conn_prod.cursor()
+                valores_detalle = (
+                    articulo['clave_articulo'],
+                    articulo['nombre_articulo'],
                     recibo.cantidad,
                     recibo.orden_compra,
-                    'jennifert',
                     recibo.idcode,
                     safe_encode(recibo.cliente),  # Aplicar safe_encode a todos los textos
-                    9,
-                    21,
                     recibo.procedencia,
                     recibo.idordencompra
-                ))
+                )
+                
+                idrecibo = None
+                if importacion:
+                    # 4a. Recibo ya importado que cambió: actualizar sus registros en producción
+                    cursor_prod.execute("UPDATE tb_recibomtlcalidad SET idOrdenCompra = ? WHERE idrecibo = ?",
+                                       (articulo['docto_cm_id'], importacion.idrecibo))
+                    cursor_prod.execute("""
+                        UPDATE tb_recibomtlcalidaddetalle SET
+                            idProducto = ?, descripcion = ?, cantidad = ?, idClave = ?,
+                            lote = ?, comentarios = ?, idprocedencia = ?, idordencompra = ?
+                        WHERE idrecibo = ?
+                    """, valores_detalle + (importacion.idrecibo,))
+                    
+                    if cursor_prod.rowcount > 0:
+                        idrecibo = importacion.idrecibo
+                        add_log(f"Registro actualizado en producción con ID: {idrecibo}")
+                    else:
+                        add_log(f"El registro {importacion.idrecibo} ya no existe en producción; se insertará de nuevo")
+                
+                if not idrecibo:
+                    # 4b. Insertar en tb_recibomtlcalidad
+                    cursor_prod.execute("INSERT INTO tb_recibomtlcalidad (idOrdenCompra, lote) VALUES (?, ?)",
+                                       (articulo['docto_cm_id'], 1))
+                    
+                    # Obtener el ID generado
+                    cursor_prod.execute("SELECT @@IDENTITY")
+                    idrecibo = cursor_prod.fetchval()
+                    
+                    if not idrecibo:
+                        add_log("Error al obtener el ID del recibo insertado")
+                        conn_prod.rollback()
+                        resultados[id] = ('error', 'Error al obtener el ID del recibo insertado')
+                        continue
+                    
+                    add_log(f"Registro insertado en tb_recibomtlcalidad con ID: {idrecibo}")
+                    
+                    # 5. Insertar en tb_recibomtlcalidaddetalle (mismo commit que el encabezado)
+                    cursor_prod.execute("""
+                        INSERT INTO tb_recibomtlcalidaddetalle (
+                            idProducto, descripcion, cantidad, idClave, lote, comentarios,
+                            idprocedencia, idordencompra, idrecibo,
+                            usuarioalta, fechaalta, idestatus, iduom
+                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, GETDATE(), ?, ?)
+                    """, valores_detalle + (idrecibo, 'jennifert', 9, 21))
+                    add_log("Registro insertado en tb_recibomtlcalidaddetalle")
                 
                 conn_prod.commit()
-                add_log("Registro insertado en tb_recibomtlcalidaddetalle")
                 
-                recibos_procesados += 1
+                # 6. Registrar en la bitácora lo enviado para omitirlo si no cambia
+                if not importacion:
+                    importacion = ImportacionRecibo(recibo_id=recibo.id)
+                    db.session.add(importacion)
+                importacion.idrecibo = int(idrecibo)
+                importacion.hash_contenido = hash_importacion(recibo)
+                db.session.commit()
+                
+                resultados[id] = ('procesado', None)
                 add_log(f"Recibo ID {id} procesado correctamente")
                 
             except Exception as e:
                 add_log(f"Error en recibo ID {id}: {str(e)}")
-                if 'cursor_prod' in locals() and 'conn_prod' in locals():
-                    conn_prod.rollback()
-                errores += 1
+                conn_prod.rollback()
+                db.session.rollback()
+                resultados[id] = ('error', str(e))
                 continue
-        
-        # Cerrar conexiones
-        if 'conn_prod' in locals():
+    
+    finally:
+        # Cancelar resoluciones pendientes si la escritura se interrumpió y cerrar conexiones
+        ejecutor.shutdown(wait=True, cancel_futures=True)
+        if conn_prod:
             conn_prod.close()
+        pool_fb.cerrar()
+    
+    return resultados
+
+@app.route('/importar_sqlserver', methods=['POST'])
+def importar_sqlserver():
+    response = {
+        'status': 'error',
+        'message': 'No se pudo procesar la solicitud',
+        'logs': []
+    }
+    
+    def add_log(message):
+        response['logs'].append(message)
+    
+    try:
+        # Verificar IDs de recibos (lista JSON o token de selección)
+        ids = obtener_ids_solicitud()
+        if not ids:
+            raise Exception('No se especificaron IDs válidos para importar')
         
-        if 'fb_conn' in locals():
-            fb_conn.close()
+        add_log("Iniciando proceso de importación")
         
-        if 'tunnel' in locals() and tunnel.is_active:
-            tunnel.close()
+        # Cada conexión a Firebird del importador ocupa su propio lugar del bulkhead
+        resultados = importar_con_turno(ids, add_log)
+        
+        estados = [estado for estado, _ in resultados.values()]
+        recibos_procesados = estados.count('procesado')
+        recibos_omitidos = estados.count('omitido')
+        errores = estados.count('error') + estados.count('rechazado')
         
         # Respuesta exitosa
-        if recibos_procesados > 0:
+        if recibos_procesados > 0 or recibos_omitidos > 0:
             response['status'] = 'success'
             response['message'] = f"Se importaron {recibos_procesados} recibos correctamente" + (
+                f", {recibos_omitidos} sin cambios se omitieron" if recibos_omitidos > 0 else ""
+            ) + (
                 f". Hubo {errores} errores." if errores > 0 else "."
             )
         else:
             response['message'] = f"No se pudo importar ningún recibo. Hubo {errores} errores."
         
+    except Saturado as e:
+        return respuesta_saturado(e)
+    
     except Exception as e:
         response['message'] = f'Error general: {str(e)}'
-        # Cerrar conexiones en caso de error
-        if 'conn_prod' in locals():
-            conn_prod.close()
-        if 'fb_conn' in locals():
-            fb_conn.close()
-        if 'tunnel' in locals() and tunnel.is_active:
-            tunnel.close()
     
     return jsonify(response)
 
-@app.route('/buscar_articulos_por_oc/<orden_compra>', methods=['GET'])
-def buscar_articulos_por_oc(orden_compra):
+def enviar_pendientes():
+    """
+    Envía a producción un lote de la bandeja de salida. Los envíos que fallan se reintentan
+    con espera exponencial; tras OUTBOX_MAX_INTENTOS quedan como 'fallidos' para revisión.
+    Los rechazados (sin orden de compra o artículo) quedan 'fallidos' de inmediato: reintentar
+    no los corrige, y al editar el recibo se encola un envío nuevo.
+    Devuelve el número de envíos procesados en el lote.
+    
+    Cada lote se reclama con un UPDATE condicional antes de enviarlo ('en_proceso' con un
+    identificador propio), de modo que varios procesos del servidor no envíen el mismo recibo.
+    Si el proceso muere a mitad del envío, el reclamo vence tras OUTBOX_RECLAMO_VIGENCIA
+    y otro ciclo vuelve a tomar el lote.
+    """
+    ahora = datetime.datetime.now()
+    abiertos = (EnvioProduccion.estado.in_(('pendiente', 'en_proceso')), EnvioProduccion.proximo_intento <= ahora)
+    candidatos = [envio_id for envio_id, in (db.session.query(EnvioProduccion.id)
+                                             .filter(*abiertos)
+                                             .order_by(EnvioProduccion.id)
+                                             .limit(app.config['OUTBOX_TAMANO_LOTE']))]
+    if not candidatos:
+        db.session.rollback()
+        return 0
+    
+    # El filtro se vuelve a evaluar en el UPDATE: si otro proceso reclamó las filas antes,
+    # su proximo_intento ya quedó en el futuro y no se toman aquí
+    reclamo = uuid.uuid4().hex
+    vencimiento = ahora + datetime.timedelta(seconds=app.config['OUTBOX_RECLAMO_VIGENCIA'])
+    (db.session.query(EnvioProduccion)
+     .filter(EnvioProduccion.id.in_(candidatos), *abiertos)
+     .update({'estado': 'en_proceso', 'reclamo': reclamo, 'proximo_intento': vencimiento},
+             synchronize_session=False))
+    db.session.commit()
+    
+    envios = (EnvioProduccion.query
+              .filter(EnvioProduccion.reclamo == reclamo)
+              .order_by(EnvioProduccion.id)
+              .all())
+    if not envios:
+        return 0
+    # Versión de cada envío al reclamarlo: si el recibo se guarda de nuevo durante el envío, cambia
+    versiones = {envio.id: envio.version or 0 for envio in envios}
+    
+    def del_lote(envio):
+        """Filtra el envío solo mientras siga reclamado por este lote."""
+        return (EnvioProduccion.query
+                .filter(EnvioProduccion.id == envio.id, EnvioProduccion.estado == 'en_proceso',
+                        EnvioProduccion.reclamo == reclamo))
+    
+    def liberar(envio, valores=None):
+        """Devuelve el envío a 'pendiente' (con los valores indicados) si sigue reclamado por este lote."""
+        del_lote(envio).update(dict({'estado': 'pendiente', 'reclamo': None,
+                                     'proximo_intento': datetime.datetime.now()}, **(valores or {})),
+                               synchronize_session=False)
+    
+    logs = []
     try:
-        # Aplicar safe_encode a la orden de compra
-        orden_compra_safe = safe_encode(orden_compra)
+        resultados = importar_con_turno([envio.recibo_id for envio in envios], logs.append)
+    except (CircuitoAbierto, Saturado):
+        # Producción caída, Firebird saturado u otra importación en curso: no se cuentan intentos,
+        # el lote se libera y se reintenta en el siguiente ciclo
+        db.session.rollback()
+        for envio in envios:
+            liberar(envio)
+        db.session.commit()
+        return 0
+    except Exception as e:
+        # Falla general (p. ej. producción no disponible): todo el lote se reintenta
+        db.session.rollback()
+        resultados = {envio.recibo_id: ('error', f'Error general: {str(e)}') for envio in envios}
+    
+    def cerrar_envio(envio, valores):
+        """
+        Marca el envío como terminado solo si nadie guardó el recibo después de reclamarlo;
+        si no, vuelve a 'pendiente' con su versión nueva y se envía otra vez.
+        """
+        cerrados = (del_lote(envio)
+                    .filter(db.func.coalesce(EnvioProduccion.version, 0) == versiones[envio.id])
+                    .update(dict(valores, reclamo=None), synchronize_session=False))
+        if not cerrados:
+            liberar(envio)
+    
+    ahora = datetime.datetime.now()
+    for envio in envios:
+        estado, mensaje = resultados.get(envio.recibo_id, ('error', 'Sin resultado'))
+        if estado in ('procesado', 'omitido'):
+            cerrar_envio(envio, {'estado': 'enviado', 'ultimo_error': None})
+            continue
+        
+        intentos = (envio.intentos or 0) + 1
+        if estado == 'rechazado' or intentos >= app.config['OUTBOX_MAX_INTENTOS']:
+            cerrar_envio(envio, {'estado': 'fallido', 'intentos': intentos, 'ultimo_error': (mensaje or '')[:500]})
+        else:
+            espera = min(app.config['OUTBOX_ESPERA_BASE'] * 2 ** (intentos - 1),
+                         app.config['OUTBOX_ESPERA_MAXIMA'])
+            liberar(envio, {'intentos': intentos, 'ultimo_error': (mensaje or '')[:500],
+                            'proximo_intento': ahora + datetime.timedelta(seconds=espera)})
+    db.session.commit()
+    return len(envios)
+
+def ciclo_enviador():
+    """Hilo del enviador: vacía la bandeja de salida en lotes pequeños y espera cuando no hay pendientes."""
+    while True:
+        procesados = 0
+        try:
+            with app.app_context():
+                procesados = enviar_pendientes()
+        except Exception as e:
+            print(f"Error en el envío automático a producción: {str(e)}")
         
+        # Lote completo: continuar de inmediato; si no, esperar al siguiente ciclo
+        if procesados < app.config['OUTBOX_TAMANO_LOTE']:
+            time.sleep(app.config['OUTBOX_INTERVALO'])
+
+_enviador = None
+_enviador_lock = threading.Lock()
+
+@app.before_request
+def iniciar_enviador():
+    """
+    Arranca el enviador con la primera petición atendida. No se arranca al importar el módulo
+    para que los procesos del pool de exportaciones no lo inicien también.
+    """
+    global _enviador
+    if _enviador is not None or not app.config['OUTBOX_ACTIVO'] or app.config.get('TESTING'):
+        return
+    with _enviador_lock:
+        if _enviador is None:
+            _enviador = threading.Thread(target=ciclo_enviador, name='enviador-produccion', daemon=True)
+            _enviador.start()
+
+@app.route('/envios_produccion', methods=['GET'])
+def estado_envios_produccion():
+    """Resumen de la bandeja de salida y detalle de los envíos fallidos."""
+    conteos = dict(db.session.query(EnvioProduccion.estado, db.func.count(EnvioProduccion.id))
+                   .group_by(EnvioProduccion.estado).all())
+    fallidos = (EnvioProduccion.query.filter(EnvioProduccion.estado == 'fallido')
+                .order_by(EnvioProduccion.id.desc()).limit(100).all())
+    return jsonify({
+        'status': 'success',
+        'pendientes': conteos.get('pendiente', 0),
+        'en_proceso': conteos.get('en_proceso', 0),
+        'enviados': conteos.get('enviado', 0),
+        'fallidos': conteos.get('fallido', 0),
+        'detalle_fallidos': [{
+            'id': envio.id,
+            'recibo_id': envio.recibo_id,
+            'intentos': envio.intentos,
+            'ultimo_error': envio.ultimo_error,
+            'fecha_actualizacion': envio.fecha_actualizacion.strftime('%Y-%m-%d %H:%M:%S') if envio.fecha_actualizacion else ''
+        } for envio in fallidos]
+    })
+
+@app.route('/envios_produccion/reintentar', methods=['POST'])
+def reintentar_envios_produccion():
+    """Vuelve a encolar los envíos fallidos (todos o los IDs de envío indicados)."""
+    try:
+        datos = request.get_json(silent=True) or {}
+        consulta = EnvioProduccion.query.filter(EnvioProduccion.estado == 'fallido')
+        if datos.get('ids'):
+            consulta = consulta.filter(EnvioProduccion.id.in_([int(i) for i in datos['ids']]))
+        reintentos = consulta.update({
+            'estado': 'pendiente',
+            'intentos': 0,
+            'proximo_intento': datetime.datetime.now()
+        }, synchronize_session=False)
+        db.session.commit()
+        return jsonify({'status': 'success', 'message': f'Se reencolaron {reintentos} envíos'})
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': f'Error: {str(e)}'})
+
+def leer_articulos_oc(cursor, orden_compra_safe):
+    """
+    Lee en Firebird, con un cursor ya abierto, los artículos de una orden de compra.
+    Devuelve el diccionario de respuesta de buscar_articulos_por_oc (también lo usa servicio_oc.py).
+    """
+    # Primero obtener el DOCTO_CM_ID de la orden de compra
+    cursor.execute('SELECT "DOCTO_CM_ID" FROM "DOCTOS_CM" WHERE "FOLIO" = ? AND "TIPO_DOCTO" = ?', 
+                  (orden_compra_safe, 'O'))
+    docto_cm_id_row = cursor.fetchone()
+    
+    if not docto_cm_id_row:
+        return {'status': 'error', 'message': f'No se encontró la orden de compra {orden_compra_safe}'}
+    
+    docto_cm_id = docto_cm_id_row[0]
+    
+    # Obtener los detalles de la orden de compra usando la nueva estructura del query
+    cursor.execute("""
+        SELECT 
+            DET."DOCTO_CM_DET_ID",
+            DET."DOCTO_CM_ID",
+            DET."CLAVE_ARTICULO",
+            DET."ARTICULO_ID",
+            ART."NOMBRE" AS ARTICULO,
+            DET."UNIDADES",
+            DET."UNIDADES_REC_DEV",
+            DET."UNIDADES_A_REC",
+            DET."UMED",
+            DET."PRECIO_UNITARIO",
+            DET."PRECIO_TOTAL_NETO",
+            DET."NOTAS",
+            PROV."NOMBRE" as PROVEEDOR
+        FROM 
+            "DOCTOS_CM_DET" DET
+            INNER JOIN "ARTICULOS" ART ON ART."ARTICULO_ID" = DET."ARTICULO_ID"
+            INNER JOIN "DOCTOS_CM" OC ON OC."DOCTO_CM_ID" = DET."DOCTO_CM_ID"
+            INNER JOIN "PROVEEDORES" PROV ON PROV."PROVEEDOR_ID" = OC."PROVEEDOR_ID"
+        WHERE 
+            DET."DOCTO_CM_ID" = ?
+    """, (docto_cm_id,))
+    
+    articulos = []
+    for row in cursor.fetchall():
+        articulos.append({
+            'docto_cm_det_id': row[0],
+            'docto_cm_id': row[1],
+            'clave_articulo': row[2],
+            'articulo_id': row[3],
+            'descripcion': safe_encode(row[4]),  # Aplicar safe_encode a textos
+            'unidades': row[5],
+            'unidades_recibidas': row[6],
+            'unidades_por_recibir': row[7],
+            'unidad_medida': safe_encode(row[8]),
+            'precio_unitario': row[9],
+            'precio_total': row[10],
+            'notas': safe_encode(row[11]) if row[11] else '',
+            'proveedor': safe_encode(row[12])
+        })
+    
+    return {
+        'status': 'success',
+        'articulos': articulos,
+        'docto_cm_id': docto_cm_id
+    }
+
+def consultar_articulos_por_oc(orden_compra_safe):
+    """Consulta en Firebird los artículos de una orden de compra; devuelve el diccionario de respuesta."""
+    try:
         # Establecer conexión con Firebird
         firebird_result = get_firebird_conn()
         if not firebird_result['status']:
-            return jsonify({'status': 'error', 'message': f'Error al conectar con Firebird: {firebird_result["message"]}'})
+            return {'status': 'error', 'message': f'Error al conectar con Firebird: {firebird_result["message"]}'}
         
         fb_conn = firebird_result['conn']
         tunnel = firebird_result['tunnel']
         
         try:
-            cursor = fb_conn.cursor()
-            
-            # Primero obtener el DOCTO_CM_ID de la orden de compra
-            cursor.execute('SELECT "DOCTO_CM_ID" FROM "DOCTOS_CM" WHERE "FOLIO" = ? AND "TIPO_DOCTO" = ?', 
-                          (orden_compra_safe, 'O'))
-            docto_cm_id_row = cursor.fetchone()
-            
-            if not docto_cm_id_row:
-                return jsonify({'status': 'error', 'message': f'No se encontró la orden de compra {orden_compra_safe}'})
-            
-            docto_cm_id = docto_cm_id_row[0]
-            
-            # Obtener los detalles de la orden de compra usando la nueva estructura del query
-            cursor.execute("""
-                SELECT 
-                    DET."DOCTO_CM_DET_ID",
-                    DET."DOCTO_CM_ID",
-                    DET."CLAVE_ARTICULO",
-                    DET."ARTICULO_ID",
-                    ART."NOMBRE" AS ARTICULO,
-                    DET."UNIDADES",
-                    DET."UNIDADES_REC_DEV",
-                    DET."UNIDADES_A_REC",
-                    DET."UMED",
-                    DET."PRECIO_UNITARIO",
-                    DET."PRECIO_TOTAL_NETO",
-                    DET."NOTAS",
-                    PROV."NOMBRE" as PROVEEDOR
-                FROM 
-                    "DOCTOS_CM_DET" DET
-                    INNER JOIN "ARTICULOS" ART ON ART."ARTICULO_ID" = DET."ARTICULO_ID"
-                    INNER JOIN "DOCTOS_CM" OC ON OC."DOCTO_CM_ID" = DET."DOCTO_CM_ID"
-                    INNER JOIN "PROVEEDORES" PROV ON PROV."PROVEEDOR_ID" = OC."PROVEEDOR_ID"
-                WHERE 
-                    DET."DOCTO_CM_ID" = ?
-            """, (docto_cm_id,))
-            
-            articulos = []
-            for row in cursor.fetchall():
-                articulos.append({
-                    'docto_cm_det_id': row[0],
-                    'docto_cm_id': row[1],
-                    'clave_articulo': row[2],
-                    'articulo_id': row[3],
-                    'descripcion': safe_encode(row[4]),  # Aplicar safe_encode a textos
-                    'unidades': row[5],
-                    'unidades_recibidas': row[6],
-                    'unidades_por_recibir': row[7],
-                    'unidad_medida': safe_encode(row[8]),
-                    'precio_unitario': row[9],
-                    'precio_total': row[10],
-                    'notas': safe_encode(row[11]) if row[11] else '',
-                    'proveedor': safe_encode(row[12])
-                })
-            
-            return jsonify({
-                'status': 'success',
-                'articulos': articulos,
-                'docto_cm_id': docto_cm_id
-            })
-            
+            return leer_articulos_oc(fb_conn.cursor(), orden_compra_safe)
+        
         finally:
             fb_conn.close()
             if tunnel.is_active:
@@ -930,12 +2652,275 @@ def buscar_articulos_por_oc(orden_compra):
     except Exception as e:
         if 'tunnel' in locals() and tunnel.is_active:
             tunnel.close()
+        return {'status': 'error', 'message': str(e)}
+
+def guardar_articulos_oc(orden_compra_safe, resultado):
+    """Guarda en cache_datos la respuesta de una orden encontrada, por ARTICULOS_OC_TTL segundos."""
+    if resultado['status'] == 'success':
+        cache_datos.guardar(('articulos_oc', orden_compra_safe), resultado, app.config['ARTICULOS_OC_TTL'])
+    return resultado
+
+@app.route('/buscar_articulos_por_oc/<orden_compra>', methods=['GET'])
+def buscar_articulos_por_oc(orden_compra):
+    # Aplicar safe_encode a la orden de compra
+    orden_compra_safe = safe_encode(orden_compra)
+    
+    # Una orden consultada hace poco (por cualquier proceso) se responde sin ir a Firebird
+    resultado = cache_datos.obtener(('articulos_oc', orden_compra_safe))
+    if resultado is not None:
+        return jsonify(resultado)
+    
+    # Varios usuarios abriendo la misma orden comparten una sola consulta a Firebird,
+    # que ocupa un lugar del bulkhead mientras se ejecuta
+    try:
+        return jsonify(guardar_articulos_oc(orden_compra_safe, vuelo_articulos_oc.ejecutar(
+            orden_compra_safe, bulkhead_firebird.llamar, consultar_articulos_por_oc, orden_compra_safe)))
+    except Saturado as e:
+        return respuesta_saturado(e)
+    except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)})
 
+# Folios de órdenes de compra con su proveedor para sugerencias mientras se escribe
+indice_oc = IndicePrefijos()
+_indice_oc_lock = threading.Lock()
+_indice_oc_intento = {'fecha': 0}
+
+def cargar_indice_oc():
+    """Lee de Firebird los folios de órdenes de compra y su proveedor, y reemplaza el índice."""
+    firebird_result = get_firebird_conn()
+    if not firebird_result['status']:
+        raise Exception(f'Error al conectar con Firebird: {firebird_result["message"]}')
+    
+    fb_conn = firebird_result['conn']
+    tunnel = firebird_result['tunnel']
+    try:
+        cursor = fb_conn.cursor()
+        cursor.execute("""
+            SELECT OC."FOLIO", PROV."NOMBRE"
+            FROM "DOCTOS_CM" OC
+                INNER JOIN "PROVEEDORES" PROV ON PROV."PROVEEDOR_ID" = OC."PROVEEDOR_ID"
+            WHERE OC."TIPO_DOCTO" = 'O'
+        """)
+        entradas = []
+        for folio, proveedor in cursor.fetchall():
+            folio = safe_encode(folio).strip()
+            valor = (folio, safe_encode(proveedor))
+            entradas.append((folio, valor))
+            # También encontrar el folio escribiendo solo el número, sin serie ni ceros a la izquierda
+            numero = re.sub(r'^\D*0*', '', folio)
+            if numero and numero != folio:
+                entradas.append((numero, valor))
+        indice_oc.reemplazar(entradas)
+    finally:
+        fb_conn.close()
+        if tunnel.is_active:
+            tunnel.close()
+
+def refrescar_indice_oc():
+    """
+    Actualiza el índice de órdenes de compra en segundo plano si tiene más de OC_INDICE_TTL segundos.
+    No bloquea al llamador: mientras tanto se responde con la versión anterior.
+    """
+    ahora = time.time()
+    if indice_oc.actualizado and ahora - indice_oc.actualizado < app.config['OC_INDICE_TTL']:
+        return
+    # Tras un fallo no reintentar en cada tecla
+    if ahora - _indice_oc_intento['fecha'] < app.config['OC_INDICE_REINTENTO']:
+        return
+    if not _indice_oc_lock.acquire(blocking=False):
+        return
+    _indice_oc_intento['fecha'] = ahora
+    
+    def tarea():
+        try:
+            bulkhead_firebird.llamar(cargar_indice_oc)
+        except Exception as e:
+            print(f"Error al actualizar el índice de órdenes de compra: {str(e)}")
+        finally:
+            _indice_oc_lock.release()
+    
+    threading.Thread(target=tarea, name='indice-oc', daemon=True).start()
+
+@app.route('/sugerir_oc', methods=['GET'])
+def sugerir_oc():
+    """Sugerencias de folios de orden de compra que empiezan con el texto escrito, desde el índice en memoria."""
+    refrescar_indice_oc()
+    sugerencias = indice_oc.buscar(request.args.get('q', ''), app.config['OC_SUGERENCIAS'])
+    return jsonify({
+        'status': 'success',
+        'sugerencias': [{'folio': folio, 'proveedor': proveedor} for folio, proveedor in sugerencias],
+        'cargando': indice_oc.actualizado is None
+    })
+
+# Valores ya capturados en los recibos, para autocompletar por frecuencia de uso
+CAMPOS_AUTOCOMPLETAR = ['proveedor', 'cliente', 'grado_acero', 'descripcion_material']
+indices_autocompletar = {campo: IndiceFrecuencias() for campo in CAMPOS_AUTOCOMPLETAR}
+_autocompletar_lock = threading.Lock()
+
+def indice_autocompletar(campo):
+    """Devuelve el índice del campo; la primera vez lo carga con los valores distintos de recibos_material."""
+    indice = indices_autocompletar[campo]
+    if not indice.cargado:
+        with _autocompletar_lock:
+            if not indice.cargado:
+                columna = getattr(ReciboMaterial, campo)
+                indice.cargar(db.session.query(columna, db.func.count(ReciboMaterial.id))
+                              .filter(columna.isnot(None), columna != '')
+                              .group_by(columna).all())
+    return indice
+
+def registrar_autocompletado(registros, cantidad=1):
+    """
+    Suma a los índices de autocompletado los valores de recibos ya guardados (dicts por campo).
+    Con cantidad=-1 descuenta los valores anteriores de un recibo editado.
+    """
+    for campo in CAMPOS_AUTOCOMPLETAR:
+        indice = indices_autocompletar[campo]
+        for registro in registros:
+            indice.sumar(registro.get(campo), cantidad)
+
+@app.route('/autocompletar/<campo>', methods=['GET'])
+def autocompletar(campo):
+    """Valores ya capturados en el campo que coinciden con el texto escrito, los más usados primero."""
+    if campo not in indices_autocompletar:
+        return jsonify({'status': 'error', 'message': f'Campo no válido: {campo}'}), 404
+    
+    sugerencias = indice_autocompletar(campo).buscar(request.args.get('q', ''), app.config['AUTOCOMPLETAR_SUGERENCIAS'])
+    return jsonify({
+        'status': 'success',
+        'sugerencias': [{'valor': valor, 'frecuencia': frecuencia} for valor, frecuencia in sugerencias]
+    })
+
+# Calentamiento: prepara conexiones, catálogos y plantillas antes de atender (servidor.py)
+estado_calentamiento = {'estado': 'pendiente', 'pasos': [], 'inicio': None, 'fin': None}
+_calentamiento_lock = threading.Lock()
+
+def abrir_conexiones_bd():
+    """Deja abiertas en el pool CALENTAR_CONEXIONES_BD conexiones a la base local."""
+    conexiones = []
+    try:
+        for _ in range(app.config['CALENTAR_CONEXIONES_BD']):
+            conexion = db.engine.connect()
+            conexiones.append(conexion)
+            conexion.execute(db.text('SELECT 1'))
+    finally:
+        for conexion in conexiones:
+            conexion.close()
+
+def cargar_catalogo_procedencias():
+    get_procedencias()
+    if _procedencias_conocidas['degradado']:
+        raise Exception('SQL Server de producción no respondió; se usará el catálogo al recuperarse')
+
+def compilar_plantillas():
+    """Compila todas las plantillas (o las lee de JINJA_CACHE_FOLDER) y las deja en memoria."""
+    for nombre in app.jinja_env.list_templates():
+        app.jinja_env.get_template(nombre)
+
+def cargar_indices_autocompletar():
+    for campo in CAMPOS_AUTOCOMPLETAR:
+        indice_autocompletar(campo)
+
+def importar_modulos_exportacion():
+    """Importa de antemano los módulos que app.py carga al primer uso (Excel y detección de codificación)."""
+    import openpyxl  # noqa: F401
+    import chardet  # noqa: F401
+
+def cargar_microsip():
+    """
+    Carga las órdenes de compra para sugerencias y deja abiertos un túnel SSH y una conexión
+    a Firebird que toma la primera consulta (get_firebird_conn), p. ej. de artículos por orden.
+    """
+    bulkhead_firebird.llamar(cargar_indice_oc)
+    _indice_oc_intento['fecha'] = time.time()
+    
+    resultado = circuito_firebird.llamar(abrir_conexion_firebird)
+    with _firebird_precalentado_lock:
+        anterior = _firebird_precalentado['resultado']
+        _firebird_precalentado.update(resultado=resultado, abierto=time.time())
+    if anterior is not None:
+        anterior['conn'].close()
+        if anterior['tunnel'].is_active:
+            anterior['tunnel'].close()
+
+def calentar():
+    """
+    Ejecuta los pasos de calentamiento una sola vez y devuelve el estado. Solo la base local
+    es indispensable: si producción o Microsip no responden se atiende en modo degradado.
+    """
+    with _calentamiento_lock:
+        if estado_calentamiento['estado'] in ('calentando', 'listo'):
+            return estado_calentamiento
+        estado_calentamiento.update(estado='calentando', pasos=[], inicio=time.time(), fin=None)
+    
+    pasos = [
+        ('conexiones_bd', abrir_conexiones_bd, True),
+        ('procedencias', cargar_catalogo_procedencias, False),
+        ('plantillas', compilar_plantillas, False),
+        ('autocompletar', cargar_indices_autocompletar, False),
+        ('modulos_exportacion', importar_modulos_exportacion, False)
+    ]
+    if app.config['CALENTAR_FIREBIRD']:
+        pasos.append(('microsip', cargar_microsip, False))
+    
+    listo = True
+    with app.app_context():
+        for nombre, funcion, indispensable in pasos:
+            inicio = time.perf_counter()
+            resultado = {'paso': nombre, 'ok': True}
+            try:
+                funcion()
+            except Exception as e:
+                resultado.update(ok=False, error=str(e))
+                listo = listo and not indispensable
+            resultado['ms'] = round((time.perf_counter() - inicio) * 1000)
+            estado_calentamiento['pasos'].append(resultado)
+        db.session.remove()
+    
+    estado_calentamiento.update(estado='listo' if listo else 'fallido', fin=time.time())
+    return estado_calentamiento
+
+@app.route('/listo', methods=['GET'])
+def listo():
+    """
+    Disponibilidad para el balanceador o el monitoreo: 200 solo cuando terminó el calentamiento.
+    Si nadie lo ejecutó (p. ej. con waitress-serve directo) o falló, se inicia en segundo plano.
+    """
+    if estado_calentamiento['estado'] in ('pendiente', 'fallido'):
+        threading.Thread(target=calentar, name='calentamiento', daemon=True).start()
+    
+    preparado = estado_calentamiento['estado'] == 'listo'
+    return jsonify({
+        'status': 'success' if preparado else 'error',
+        'estado': estado_calentamiento['estado'],
+        'pasos': estado_calentamiento['pasos'],
+        'segundos': round(estado_calentamiento['fin'] - estado_calentamiento['inicio'], 2)
+                    if estado_calentamiento['fin'] else None
+    }), 200 if preparado else 503
+
+@app.route('/metricas', methods=['GET'])
+def metricas():
+    """Métricas de operación: consultas agrupadas por single-flight, circuitos y colas de los bulkheads."""
+    return jsonify({
+        'bulkheads': {bulkhead_firebird.nombre: bulkhead_firebird.metricas()},
+        'single_flight': {vuelo.nombre: vuelo.metricas() for vuelo in (vuelo_procedencias, vuelo_articulos_oc)},
+        'circuitos': {circuito.nombre: circuito.metricas() for circuito in (circuito_produccion, circuito_firebird)},
+        'indice_oc': {
+            'entradas': len(indice_oc),
+            'actualizado': datetime.datetime.fromtimestamp(indice_oc.actualizado).strftime('%Y-%m-%d %H:%M:%S')
+                           if indice_oc.actualizado else None
+        },
+        'fragmentos': cache_fragmentos.metricas(),
+        'datos': cache_datos.metricas(),
+        'sesiones': cache_sesiones.metricas(),
+        'autocompletar': {campo: len(indice) if indice.cargado else None
+                          for campo, indice in indices_autocompletar.items()}
+    })
+
 if __name__ == '__main__':
-    # Crear tablas si no existen
+    # Crear tablas e índices si no existen
     with app.app_context():
-        db.create_all()
+        actualizar_esquema()
     
     # Asegurarse de tener chardet instalado
     try:
@@ -0,0 +1,78 @@
+"""
+Mide el tiempo de `import app` con `python -X importtime` y lo compara con un presupuesto.
+También verifica que las dependencias pesadas (que app.py importa solo al usarlas) no se
+carguen al arrancar. Termina con código 1 si se excede el presupuesto o si alguna se carga.
+
+Cada medición es un proceso nuevo; se reporta la menor de `--repeticiones` (la menos afectada
+por el ruido del equipo). El presupuesto depende del equipo: ajustarlo al servidor de planta.
+Ejecutar desde la raíz del proyecto:
+    python benchmarks/bench_arranque.py --presupuesto-ms 450
+    python benchmarks/bench_arranque.py --uri sqlite:///prueba.db   (sin SQL Server ni pyodbc)
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Deben importarse dentro de las funciones que los usan, no al cargar app.py
+PEREZOSOS = ['paramiko', 'sshtunnel', 'firebirdsql', 'openpyxl', 'chardet']
+
+
+def medir(uri):
+    """Importa app en un proceso nuevo. Devuelve (ms totales, {módulo: ms acumulados}, perezosos cargados)."""
+    codigo = ''
+    if uri:
+        codigo += f'import config; config.Config.SQLALCHEMY_DATABASE_URI = {uri!r}; '
+    codigo += f'import sys, app; print(",".join(m for m in {PEREZOSOS!r} if m in sys.modules))'
+
+    proceso = subprocess.run([sys.executable, '-X', 'importtime', '-c', codigo], cwd=RAIZ,
+                             capture_output=True, text=True)
+    if proceso.returncode != 0:
+        sys.exit(f'No se pudo importar app:\n{proceso.stderr[-2000:]}')
+
+    total = 0
+    directos = {}
+    for linea in proceso.stderr.splitlines():
+        if not linea.startswith('import time:') or 'cumulative' in linea:
+            continue
+        _, acumulado, nombre = linea[len('import time:'):].split('|')
+        profundidad = (len(nombre) - len(nombre.lstrip())) // 2
+        if nombre.strip() == 'app' and profundidad == 0:
+            total = int(acumulado) / 1000
+        elif profundidad == 1:
+            directos[nombre.strip()] = int(acumulado) / 1000
+
+    cargados = [m for m in proceso.stdout.strip().split(',') if m]
+    return total, directos, cargados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--presupuesto-ms', type=float, default=450)
+    parser.add_argument('--uri', help='SQLALCHEMY_DATABASE_URI para medir sin la base configurada')
+    args = parser.parse_args()
+
+    mediciones = [medir(args.uri) for _ in range(args.repeticiones)]
+    total, directos, cargados = min(mediciones, key=lambda medicion: medicion[0])
+
+    print(f'import app: {total:.0f} ms (menor de {args.repeticiones}; '
+          f'mayor {max(m[0] for m in mediciones):.0f} ms), presupuesto {args.presupuesto_ms:.0f} ms')
+    print('  importaciones directas más costosas:')
+    for nombre, ms in sorted(directos.items(), key=lambda par: -par[1])[:10]:
+        print(f'    {ms:7.1f} ms  {nombre}')
+
+    fallas = []
+    if total > args.presupuesto_ms:
+        fallas.append(f'import app tarda {total:.0f} ms, más que el presupuesto de {args.presupuesto_ms:.0f} ms')
+    if cargados:
+        fallas.append(f'se cargan al arrancar: {", ".join(cargados)}')
+    if fallas:
+        sys.exit('FALLA: ' + '; '.join(fallas))
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
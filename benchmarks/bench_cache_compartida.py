@@ -0,0 +1,76 @@
+"""
+Compara la tasa de aciertos y la latencia de las cachés de cache.py cuando las peticiones se
+reparten entre varios procesos del servidor, como con waitress o gunicorn detrás de un balanceador:
+  - memoria: cada proceso tiene su propia caché (cada uno repite la consulta de cada clave);
+  - sqlite: un archivo compartido por los procesos del equipo;
+  - redis: solo si se indica --redis y el paquete redis está instalado.
+
+Cada proceso atiende `--peticiones` consultas de claves con popularidad desigual (unas pocas
+órdenes muy consultadas y muchas raras); un fallo simula la consulta externa y guarda el resultado.
+Ejecutar desde la raíz del proyecto:
+    python benchmarks/bench_cache_compartida.py --procesos 1 4 8
+    python benchmarks/bench_cache_compartida.py --redis redis://localhost:6379/15
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import crear_cache  # noqa: E402
+
+VALOR = {'status': 'success', 'articulos': [{'descripcion': 'PLACA DE ACERO ASTM A36', 'unidades': 10}] * 5}
+
+
+def atender(parametros):
+    """Atiende las peticiones de un proceso. Devuelve (aciertos, fallos, segundos por consulta a la caché)."""
+    backend, ruta, url, claves, peticiones, semilla = parametros
+    cache = crear_cache(backend, 'bench', 50 * 1024 * 1024, ttl=300, ruta_sqlite=ruta, url_redis=url)
+    azar = random.Random(semilla)
+    aciertos = fallos = 0
+    duracion = 0
+    for _ in range(peticiones):
+        clave = ('articulos_oc', int(azar.paretovariate(0.5)) % claves)
+        inicio = time.perf_counter()
+        encontrado = cache.obtener(clave)
+        duracion += time.perf_counter() - inicio
+        if encontrado is None:
+            fallos += 1
+            cache.guardar(clave, VALOR)
+        else:
+            aciertos += 1
+    return aciertos, fallos, duracion / peticiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--procesos', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--peticiones', type=int, default=2000, help='peticiones por proceso')
+    parser.add_argument('--claves', type=int, default=5000)
+    parser.add_argument('--redis', help='URL de Redis para medir también ese backend (usa el espacio "bench")')
+    args = parser.parse_args()
+
+    backends = ['memoria', 'sqlite'] + (['redis'] if args.redis else [])
+    carpeta = tempfile.mkdtemp(prefix='bench_cache_')
+    for procesos in args.procesos:
+        print(f'{procesos} procesos, {args.peticiones} peticiones cada uno')
+        for backend in backends:
+            ruta = os.path.join(carpeta, f'cache_{backend}_{procesos}.db')
+            if backend == 'redis':
+                crear_cache('redis', 'bench', 0, url_redis=args.redis).invalidar()
+            with Pool(procesos) as pool:
+                resultados = pool.map(atender, [(backend, ruta, args.redis, args.claves, args.peticiones, semilla)
+                                                for semilla in range(procesos)])
+            aciertos = sum(resultado[0] for resultado in resultados)
+            fallos = sum(resultado[1] for resultado in resultados)
+            latencia = sum(resultado[2] for resultado in resultados) / len(resultados)
+            print(f'  {backend:8} aciertos {aciertos / (aciertos + fallos):6.1%}  '
+                  f'consultas externas {fallos:6}  {latencia * 1e6:7.1f} µs por lectura')
+
+
+if __name__ == '__main__':
+    main()
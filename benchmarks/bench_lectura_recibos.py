@@ -0,0 +1,121 @@
+"""
+Compara la lectura de recibos para listados y exportaciones:
+  - ORM: instancias completas de ReciboMaterial (mapa de identidad y seguimiento de cambios);
+  - proyección: consulta_lectura() con solo las columnas que usa cada vista.
+
+Para cada tamaño mide el CPU de cargar los recibos y armar las filas de exportación, y la memoria
+retenida por recibo mientras están cargados (tracemalloc). Por omisión usa una base SQLite temporal
+con recibos generados; con --uri se puede medir contra una copia de la base real (solo lee).
+Ejecutar desde la raíz del proyecto:
+    python benchmarks/bench_lectura_recibos.py --filas 10000 100000
+"""
+import argparse
+import datetime
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+
+
+def generar_recibos(aplicacion, filas):
+    """Llena la base temporal con `filas` recibos con textos de longitud realista."""
+    hoy = datetime.datetime.now()
+    registros = [{
+        'idcode': f'ID-{i:07d}',
+        'fecha': (hoy - datetime.timedelta(days=i % 365)).date(),
+        'orden_compra': f'OC{i % 5000:06d}',
+        'proveedor': f'ACEROS Y LAMINAS DEL NORTE {i % 200} SA DE CV',
+        'num_remision': f'R-{i:08d}',
+        'cantidad': float(i % 50),
+        'tipo': 'PLACA',
+        'descripcion_material': f'PLACA DE ACERO ASTM A36 1/2" X 96" X 240" LOTE {i % 1000}',
+        'grado_acero': 'A36',
+        'num_placa': f'P{i}',
+        'num_colada': f'C{i % 3000}',
+        'num_certificado': f'CERT-{i % 4000}',
+        'ot': f'OT-{i % 800}',
+        'cliente': f'CLIENTE {i % 150}',
+        'estatus': 'ACEPTADO',
+        'reporte_focc03': f'FOCC03-{i // 25}',
+        'procedencia': str(1 + i % 2),
+        'fecha_creacion': hoy - datetime.timedelta(seconds=i),
+        'fecha_modificacion': hoy - datetime.timedelta(seconds=i)
+    } for i in range(filas)]
+    for inicio in range(0, filas, 10000):
+        aplicacion.db.session.bulk_insert_mappings(aplicacion.ReciboMaterial, registros[inicio:inicio + 10000])
+    aplicacion.db.session.commit()
+
+
+def medir(aplicacion, cargar, procedencias):
+    """
+    Devuelve (segundos de CPU, bytes retenidos por recibo) de cargar y convertir los recibos.
+    El CPU y la memoria se miden en pasadas separadas: tracemalloc distorsiona los tiempos.
+    """
+    aplicacion.db.session.expunge_all()
+    gc.collect()
+    inicio = time.process_time()
+    recibos = cargar()
+    [aplicacion.fila_exportacion(recibo, procedencias) for recibo in recibos]
+    cpu = time.process_time() - inicio
+    del recibos
+
+    aplicacion.db.session.expunge_all()
+    gc.collect()
+    tracemalloc.start()
+    inicio_memoria = tracemalloc.get_traced_memory()[0]
+    recibos = cargar()
+    gc.collect()
+    retenida = tracemalloc.get_traced_memory()[0] - inicio_memoria
+    tracemalloc.stop()
+
+    total = len(recibos)
+    del recibos
+    aplicacion.db.session.expunge_all()
+    return cpu, retenida / max(total, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--uri', help='base existente a medir (no se modifica); por omisión SQLite temporal')
+    args = parser.parse_args()
+
+    carpeta = tempfile.mkdtemp(prefix='bench_lectura_')
+    config.Config.SQLALCHEMY_DATABASE_URI = args.uri or f"sqlite:///{os.path.join(carpeta, 'recibos.db')}"
+    config.Config.UPLOAD_FOLDER = os.path.join(carpeta, 'uploads')
+    config.Config.EXPORT_FOLDER = os.path.join(carpeta, 'exportaciones')
+    config.Config.EXPORT_CACHE_FOLDER = os.path.join(carpeta, 'exportaciones', 'cache')
+    import app as aplicacion
+
+    procedencias = {'1': 'Nacional', '2': 'Importado'}
+    with aplicacion.app.app_context():
+        aplicacion.db.create_all()
+        for filas in args.filas:
+            if not args.uri:
+                aplicacion.ReciboMaterial.query.delete()
+                generar_recibos(aplicacion, filas)
+
+            def orm():
+                return aplicacion.ReciboMaterial.query.order_by(aplicacion.ReciboMaterial.fecha_creacion.desc()).limit(filas).all()
+
+            def proyeccion():
+                return (aplicacion.consulta_lectura(aplicacion.CAMPOS_EXPORTACION)
+                        .order_by(aplicacion.ReciboMaterial.fecha_creacion.desc()).limit(filas).all())
+
+            cpu_orm, memoria_orm = medir(aplicacion, orm, procedencias)
+            cpu_proyeccion, memoria_proyeccion = medir(aplicacion, proyeccion, procedencias)
+
+            print(f'{filas} recibos (exportación, {len(aplicacion.CAMPOS_EXPORTACION)} columnas)')
+            print(f'  ORM:        {cpu_orm:7.2f} s CPU  {memoria_orm:8.0f} bytes/recibo')
+            print(f'  proyección: {cpu_proyeccion:7.2f} s CPU  {memoria_proyeccion:8.0f} bytes/recibo  '
+                  f'({cpu_orm / cpu_proyeccion:.1f}x más rápido, {memoria_orm / memoria_proyeccion:.1f}x menos memoria)')
+
+
+if __name__ == '__main__':
+    main()
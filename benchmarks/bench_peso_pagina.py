@@ -0,0 +1,93 @@
+"""
+Mide el peso de la página principal y de sus recursos servidos por la aplicación, sin comprimir
+(como se enviaban antes) y con gzip, y estima el tiempo de transferencia en la red de planta.
+
+Usa una base SQLite temporal con `--recibos` recibos generados. Los archivos de static/vendor solo
+se miden si ya se descargaron con descargar_recursos.py; mientras tanto la página los sigue cargando
+de su CDN, quedan fuera de los totales y se listan aparte. Ejecutar desde la raíz del proyecto:
+    python benchmarks/bench_peso_pagina.py --recibos 500 2000 --kbps 1000
+"""
+import argparse
+import datetime
+import os
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+
+
+def pedir(cliente, url, comprimir):
+    """Devuelve (bytes transferidos, milisegundos del servidor) de una petición GET."""
+    encabezados = {'Accept-Encoding': 'gzip'} if comprimir else {}
+    inicio = time.perf_counter()
+    respuesta = cliente.get(url, headers=encabezados)
+    duracion = (time.perf_counter() - inicio) * 1000
+    assert respuesta.status_code == 200, (url, respuesta.status_code)
+    return len(respuesta.get_data()), duracion
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--recibos', type=int, nargs='+', default=[500, 2000])
+    parser.add_argument('--kbps', type=float, default=1000, help='ancho de banda de la red de planta en kbit/s')
+    args = parser.parse_args()
+
+    carpeta = tempfile.mkdtemp(prefix='bench_peso_')
+    config.Config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(carpeta, 'recibos.db')}"
+    config.Config.UPLOAD_FOLDER = os.path.join(carpeta, 'uploads')
+    config.Config.EXPORT_FOLDER = os.path.join(carpeta, 'exportaciones')
+    config.Config.EXPORT_CACHE_FOLDER = os.path.join(carpeta, 'exportaciones', 'cache')
+    config.Config.OUTBOX_ACTIVO = False
+    import app as aplicacion
+
+    aplicacion.get_procedencias = lambda: [{'id': 1, 'descripcion': 'Nacional'}, {'id': 2, 'descripcion': 'Importado'}]
+    cliente = aplicacion.app.test_client()
+
+    with aplicacion.app.app_context():
+        aplicacion.db.create_all()
+        for total in args.recibos:
+            aplicacion.ReciboMaterial.query.delete()
+            hoy = datetime.date.today()
+            aplicacion.db.session.bulk_insert_mappings(aplicacion.ReciboMaterial, [{
+                'idcode': f'ID-{i:07d}',
+                'fecha': hoy - datetime.timedelta(days=i % 365),
+                'orden_compra': f'OC{i % 5000:06d}',
+                'proveedor': f'ACEROS Y LAMINAS DEL NORTE {i % 200} SA DE CV',
+                'num_remision': f'R-{i:08d}',
+                'descripcion_material': f'PLACA DE ACERO ASTM A36 1/2" X 96" X 240" LOTE {i % 1000}',
+                'cliente': f'CLIENTE {i % 150}',
+                'reporte_focc03': f'FOCC03-{i // 25}',
+                'procedencia': '1'
+            } for i in range(total)])
+            aplicacion.db.session.commit()
+
+            pagina = cliente.get('/').get_data(as_text=True)
+            urls = ['/', '/obtener_recibo/1'] + [url for url in re.findall(r'(?:src|href)="(/static/[^"]+)"', pagina)]
+            if 'idiomaTablas' in pagina:
+                urls += re.findall(r"idiomaTablas: '(/static/[^']+)'", pagina)
+            externos = (re.findall(r'(?:src|href)="(https?://[^"]+)"', pagina)
+                        + re.findall(r"idiomaTablas: '(https?://[^']+)'", pagina))
+
+            print(f'{total} recibos en el listado')
+            sumas = {False: 0, True: 0}
+            for url in urls:
+                medidas = {comprimir: pedir(cliente, url, comprimir) for comprimir in (False, True)}
+                for comprimir, (tamano, _) in medidas.items():
+                    sumas[comprimir] += tamano
+                print(f'  {url.split("?")[0][:60]:60} {medidas[False][0]:9,} B -> {medidas[True][0]:9,} B gzip '
+                      f'({medidas[False][1]:.0f} / {medidas[True][1]:.0f} ms servidor)')
+            for comprimir, etiqueta in ((False, 'sin comprimir'), (True, 'gzip')):
+                segundos = sumas[comprimir] * 8 / (args.kbps * 1000)
+                print(f'  total {etiqueta:13} {sumas[comprimir]:9,} B  ~{segundos:.2f} s a {args.kbps:.0f} kbit/s')
+            if externos:
+                print(f'  sin incluir {len(externos)} recursos que aún se cargan de CDN (ejecutar descargar_recursos.py):')
+                for url in externos:
+                    print(f'    {url}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Compara consultas de órdenes de compra por segundo:
+  - hilo por solicitud (diseño actual de app.py con waitress): cada consulta abre túnel y conexión
+    y ocupa uno de los `--hilos` hilos de waitress (4 por omisión) durante todo el viaje;
+  - servicio_oc.py: un proceso asyncio con `--conexiones` conexiones fijas, consultado por HTTP
+    con `--concurrencia` clientes simultáneos.
+
+No usa Microsip: un Firebird simulado agrega la latencia de conexión (SSH + attach) y la de cada
+consulta por el túnel. Ejecutar desde la raíz del proyecto:
+    python benchmarks/bench_servicio_oc.py --consultas 400 --concurrencia 50
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as aplicacion  # noqa: E402
+import servicio_oc  # noqa: E402
+
+
+class CursorSimulado:
+    def __init__(self, latencia):
+        self.latencia = latencia
+        self.filas = []
+
+    def execute(self, sql, parametros=()):
+        time.sleep(self.latencia)
+        if '"FOLIO"' in sql:
+            self.filas = [(1000 + len(parametros[0]),)]
+        else:
+            self.filas = [(i, parametros[0], f'CL-{i}', i, f'ARTICULO {i}', 10.0, 0.0, 10.0, 'PZA',
+                           5.0, 50.0, None, 'PROVEEDOR SIMULADO') for i in range(5)]
+
+    def fetchone(self):
+        return self.filas[0] if self.filas else None
+
+    def fetchall(self):
+        return self.filas
+
+
+class FirebirdSimulado:
+    """Conexión DB-API con la latencia de Microsip a través del túnel SSH."""
+
+    def __init__(self, latencia_conexion, latencia_consulta):
+        time.sleep(latencia_conexion)
+        self.latencia_consulta = latencia_consulta
+
+    def cursor(self):
+        return CursorSimulado(self.latencia_consulta)
+
+    def close(self):
+        pass
+
+
+class TunelSimulado:
+    is_active = False
+    local_bind_port = 0
+
+
+def medir_hilo_por_solicitud(ordenes, hilos, latencia_conexion, latencia_consulta):
+    def conexion_por_solicitud():
+        return {'status': True, 'conn': FirebirdSimulado(latencia_conexion, latencia_consulta),
+                'tunnel': TunelSimulado(), 'message': ''}
+
+    aplicacion.get_firebird_conn = conexion_por_solicitud
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+        resultados = list(ejecutor.map(aplicacion.consultar_articulos_por_oc, ordenes))
+    duracion = time.perf_counter() - inicio
+    assert all(r['status'] == 'success' for r in resultados), resultados[:1]
+    return duracion
+
+
+async def cliente_http(puerto, pendientes, respuestas):
+    reader, writer = await asyncio.open_connection('127.0.0.1', puerto)
+    try:
+        while pendientes:
+            orden = pendientes.pop()
+            writer.write(f'GET /buscar_articulos_por_oc/{orden} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+            await writer.drain()
+            estado = (await reader.readline()).split()[1]
+            longitud = 0
+            while True:
+                linea = await reader.readline()
+                if linea in (b'\r\n', b''):
+                    break
+                if linea.lower().startswith(b'content-length:'):
+                    longitud = int(linea.split(b':')[1])
+            await reader.readexactly(longitud)
+            respuestas.append(estado)
+    finally:
+        writer.close()
+
+
+async def medir_servicio(ordenes, concurrencia, conexiones, latencia_conexion, latencia_consulta):
+    servicio = servicio_oc.ServicioOC(lambda: FirebirdSimulado(latencia_conexion, latencia_consulta),
+                                      conexiones, max_en_cola=len(ordenes), timeout=60)
+    await servicio.iniciar()
+    servidor = await asyncio.start_server(servicio.atender, '127.0.0.1', 0)
+    puerto = servidor.sockets[0].getsockname()[1]
+
+    pendientes = list(ordenes)
+    respuestas = []
+    inicio = time.perf_counter()
+    await asyncio.gather(*(cliente_http(puerto, pendientes, respuestas) for _ in range(concurrencia)))
+    duracion = time.perf_counter() - inicio
+
+    servidor.close()
+    await servidor.wait_closed()
+    servicio.cerrar()
+    assert respuestas.count(b'200') == len(ordenes), set(respuestas)
+    return duracion, servicio.metricas()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--consultas', type=int, default=400)
+    parser.add_argument('--ordenes-distintas', type=int, default=0,
+                        help='órdenes distintas entre las consultas (0: todas distintas)')
+    parser.add_argument('--concurrencia', type=int, default=50, help='clientes HTTP simultáneos contra el servicio')
+    parser.add_argument('--hilos', type=int, default=4, help='hilos de waitress del diseño actual')
+    parser.add_argument('--conexiones', type=int, default=4, help='conexiones a Firebird del servicio')
+    parser.add_argument('--latencia-conexion', type=float, default=0.15, help='segundos para abrir túnel y conexión')
+    parser.add_argument('--latencia-consulta', type=float, default=0.02, help='segundos por consulta')
+    args = parser.parse_args()
+
+    distintas = args.ordenes_distintas or args.consultas
+    ordenes = [f'OC{i % distintas:05d}' for i in range(args.consultas)]
+
+    duracion_hilos = medir_hilo_por_solicitud(ordenes, args.hilos, args.latencia_conexion, args.latencia_consulta)
+    duracion_servicio, metricas = asyncio.run(medir_servicio(
+        ordenes, args.concurrencia, args.conexiones, args.latencia_conexion, args.latencia_consulta))
+
+    print(f'{args.consultas} consultas ({distintas} órdenes distintas), '
+          f'conexión {args.latencia_conexion * 1000:.0f} ms, consulta {args.latencia_consulta * 1000:.0f} ms')
+    print(f'  hilo por solicitud ({args.hilos} hilos):      {args.consultas / duracion_hilos:8.1f} consultas/s')
+    print(f'  servicio_oc ({args.conexiones} conexiones, {args.concurrencia} clientes): '
+          f'{args.consultas / duracion_servicio:8.1f} consultas/s '
+          f'({metricas["consultas"]} a Firebird, {metricas["coalescidas"]} agrupadas)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,352 @@
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Separador de las partes de una clave (tupla) al guardarla como texto en SQLite o Redis
+SEPARADOR_CLAVE = '\x1f'
+
+
+class CacheDisco:
+    """
+    Caché de archivos en disco con desalojo LRU según el tamaño total.
+    El último acceso se registra en la fecha de modificación de cada archivo,
+    por lo que varios procesos pueden compartir la misma carpeta y el mismo orden LRU.
+    """
+
+    def __init__(self, carpeta, max_bytes, extension=''):
+        self.carpeta = carpeta
+        self.max_bytes = max_bytes
+        self.extension = extension
+        os.makedirs(carpeta, exist_ok=True)
+
+    def _ruta(self, clave):
+        nombre = hashlib.sha256(clave.encode('utf-8')).hexdigest()
+        return os.path.join(self.carpeta, nombre + self.extension)
+
+    def obtener(self, clave):
+        """Devuelve la ruta del archivo en caché para la clave, o None si no existe."""
+        ruta = self._ruta(clave)
+        try:
+            # Marcar como usado recientemente
+            os.utime(ruta, None)
+        except FileNotFoundError:
+            return None
+        return ruta
+
+    def guardar(self, clave, datos):
+        """Guarda los bytes bajo la clave y desaloja lo menos usado si se excede el tamaño máximo."""
+        ruta = self._ruta(clave)
+        temporal = f'{ruta}.{uuid.uuid4().hex}.tmp'
+        with open(temporal, 'wb') as f:
+            f.write(datos)
+        os.replace(temporal, ruta)
+        self.desalojar()
+        return ruta
+
+    def desalojar(self):
+        """Elimina los archivos usados hace más tiempo hasta quedar dentro de max_bytes."""
+        entradas = []
+        for nombre in os.listdir(self.carpeta):
+            if nombre.endswith('.tmp'):
+                continue
+            ruta = os.path.join(self.carpeta, nombre)
+            try:
+                info = os.stat(ruta)
+            except FileNotFoundError:
+                continue
+            entradas.append((info.st_mtime, info.st_size, ruta))
+
+        total = sum(tamano for _, tamano, _ in entradas)
+        for _, tamano, ruta in sorted(entradas):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+            total -= tamano
+
+
+def clave_texto(clave):
+    """Convierte una clave (tupla) en texto; el prefijo de una tupla es prefijo de su texto."""
+    return ''.join(str(parte) + SEPARADOR_CLAVE for parte in clave)
+
+
+def tamano_valor(valor):
+    """Tamaño en caracteres de un valor: el texto tal cual, lo demás serializado en JSON."""
+    return len(valor) if isinstance(valor, str) else len(json.dumps(valor, default=str))
+
+
+class CacheMemoria:
+    """
+    Caché en memoria del proceso con desalojo LRU según el tamaño total en caracteres y
+    vencimiento opcional (`ttl` en segundos, por entrada o por omisión). Las claves son tuplas;
+    `invalidar` elimina todas las que empiezan con un prefijo.
+    CacheSQLite y CacheRedis tienen la misma interfaz y comparten las entradas entre procesos.
+    """
+
+    def __init__(self, max_caracteres, ttl=None):
+        self.max_caracteres = max_caracteres
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entradas = OrderedDict()  # clave -> (valor, tamaño, vence)
+        self.total = 0
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave):
+        """Devuelve el valor guardado para la clave, o None si no existe o ya venció."""
+        with self.lock:
+            entrada = self.entradas.get(clave)
+            if entrada is not None and entrada[2] is not None and entrada[2] <= time.time():
+                self.total -= self.entradas.pop(clave)[1]
+                entrada = None
+            if entrada is None:
+                self.fallos += 1
+                return None
+            self.entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[0]
+
+    def guardar(self, clave, valor, ttl=None):
+        """Guarda el valor y desaloja lo menos usado si se excede el tamaño máximo."""
+        tamano = tamano_valor(valor)
+        if tamano > self.max_caracteres:
+            return valor
+        ttl = ttl or self.ttl
+        with self.lock:
+            anterior = self.entradas.pop(clave, None)
+            if anterior is not None:
+                self.total -= anterior[1]
+            self.entradas[clave] = (valor, tamano, time.time() + ttl if ttl else None)
+            self.total += tamano
+            while self.total > self.max_caracteres:
+                _, desalojado = self.entradas.popitem(last=False)
+                self.total -= desalojado[1]
+        return valor
+
+    def invalidar(self, *prefijo):
+        """Elimina las entradas cuya clave empieza con `prefijo`."""
+        with self.lock:
+            for clave in [clave for clave in self.entradas if clave[:len(prefijo)] == prefijo]:
+                self.total -= self.entradas.pop(clave)[1]
+
+    def metricas(self):
+        with self.lock:
+            return {
+                'backend': 'memoria',
+                'entradas': len(self.entradas),
+                'caracteres': self.total,
+                'max_caracteres': self.max_caracteres,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos
+            }
+
+
+class CacheSQLite:
+    """
+    Caché compartida por todos los procesos del servidor en un archivo SQLite (modo WAL),
+    con la interfaz de CacheMemoria. Cada `espacio` es una tabla con su propio tamaño máximo;
+    los valores se guardan en JSON. El último uso se registra con resolución de USO_RESOLUCION
+    segundos para no escribir en cada lectura. Si el archivo no responde se comporta como
+    una caché vacía (cuenta el error y sigue).
+    """
+
+    USO_RESOLUCION = 60
+
+    def __init__(self, ruta, espacio, max_caracteres, ttl=None):
+        if not re.fullmatch(r'\w+', espacio):
+            raise ValueError(f'Nombre de espacio de caché no válido: {espacio}')
+        self.ruta = ruta
+        self.tabla = f'cache_{espacio}'
+        self.max_caracteres = max_caracteres
+        self.ttl = ttl
+        self.local = threading.local()
+        self.aciertos = 0
+        self.fallos = 0
+        self.errores = 0
+        os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+        self._conexion().execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.tabla} (
+                clave TEXT PRIMARY KEY, valor TEXT NOT NULL, tamano INTEGER NOT NULL,
+                vence REAL, usado REAL NOT NULL
+            )
+        """)
+        self._conexion().execute(f'CREATE INDEX IF NOT EXISTS ix_{self.tabla}_usado ON {self.tabla} (usado)')
+
+    def _conexion(self):
+        """Una conexión por hilo, en modo autocommit (las transacciones se abren explícitamente)."""
+        conexion = getattr(self.local, 'conexion', None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=5, isolation_level=None)
+            conexion.execute('PRAGMA journal_mode=WAL')
+            conexion.execute('PRAGMA synchronous=NORMAL')
+            self.local.conexion = conexion
+        return conexion
+
+    def _fallo(self, operacion, error):
+        self.errores += 1
+        print(f"Error en la caché {self.tabla} ({operacion}): {str(error)}")
+
+    def obtener(self, clave):
+        """Devuelve el valor guardado para la clave, o None si no existe o ya venció."""
+        texto = clave_texto(clave)
+        ahora = time.time()
+        try:
+            conexion = self._conexion()
+            fila = conexion.execute(f'SELECT valor, vence, usado FROM {self.tabla} WHERE clave = ?',
+                                    (texto,)).fetchone()
+            if fila is not None and fila[1] is not None and fila[1] <= ahora:
+                conexion.execute(f'DELETE FROM {self.tabla} WHERE clave = ? AND vence <= ?', (texto, ahora))
+                fila = None
+            if fila is None:
+                self.fallos += 1
+                return None
+            if ahora - fila[2] > self.USO_RESOLUCION:
+                conexion.execute(f'UPDATE {self.tabla} SET usado = ? WHERE clave = ?', (ahora, texto))
+        except sqlite3.Error as e:
+            self._fallo('obtener', e)
+            return None
+        self.aciertos += 1
+        return json.loads(fila[0])
+
+    def guardar(self, clave, valor, ttl=None):
+        """Guarda el valor; al exceder el tamaño máximo elimina lo vencido y después lo menos usado."""
+        texto = json.dumps(valor, default=str)
+        if len(texto) > self.max_caracteres:
+            return valor
+        ttl = ttl or self.ttl
+        ahora = time.time()
+        try:
+            conexion = self._conexion()
+            conexion.execute('BEGIN IMMEDIATE')
+            try:
+                conexion.execute(f'INSERT OR REPLACE INTO {self.tabla} (clave, valor, tamano, vence, usado) '
+                                 f'VALUES (?, ?, ?, ?, ?)',
+                                 (clave_texto(clave), texto, len(texto), ahora + ttl if ttl else None, ahora))
+                total = conexion.execute(f'SELECT COALESCE(SUM(tamano), 0) FROM {self.tabla}').fetchone()[0]
+                if total > self.max_caracteres:
+                    conexion.execute(f'DELETE FROM {self.tabla} WHERE vence <= ?', (ahora,))
+                    total = conexion.execute(f'SELECT COALESCE(SUM(tamano), 0) FROM {self.tabla}').fetchone()[0]
+                    for texto_clave, tamano in conexion.execute(
+                            f'SELECT clave, tamano FROM {self.tabla} ORDER BY usado').fetchall():
+                        if total <= self.max_caracteres:
+                            break
+                        conexion.execute(f'DELETE FROM {self.tabla} WHERE clave = ?', (texto_clave,))
+                        total -= tamano
+                conexion.execute('COMMIT')
+            except BaseException:
+                conexion.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            self._fallo('guardar', e)
+        return valor
+
+    def invalidar(self, *prefijo):
+        """Elimina las entradas cuya clave empieza con `prefijo`."""
+        texto = clave_texto(prefijo)
+        try:
+            self._conexion().execute(f'DELETE FROM {self.tabla} WHERE substr(clave, 1, ?) = ?',
+                                     (len(texto), texto))
+        except sqlite3.Error as e:
+            self._fallo('invalidar', e)
+
+    def metricas(self):
+        try:
+            entradas, total = self._conexion().execute(
+                f'SELECT COUNT(*), COALESCE(SUM(tamano), 0) FROM {self.tabla}').fetchone()
+        except sqlite3.Error:
+            entradas = total = None
+        return {
+            'backend': 'sqlite',
+            'entradas': entradas,
+            'caracteres': total,
+            'max_caracteres': self.max_caracteres,
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
+            'errores': self.errores
+        }
+
+
+class CacheRedis:
+    """
+    Caché compartida en un servidor Redis (o compatible), con la interfaz de CacheMemoria.
+    Las claves llevan el prefijo `espacio:`; el vencimiento lo aplica Redis y el desalojo por
+    tamaño queda a cargo de su política maxmemory (p. ej. allkeys-lru). Requiere el paquete
+    redis; si el servidor no responde se comporta como una caché vacía.
+    """
+
+    def __init__(self, url, espacio, ttl=None):
+        import redis
+        self.cliente = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+        self.error_redis = redis.RedisError
+        self.prefijo = f'{espacio}:'
+        self.ttl = ttl
+        self.aciertos = 0
+        self.fallos = 0
+        self.errores = 0
+
+    def _fallo(self, operacion, error):
+        self.errores += 1
+        print(f"Error en la caché Redis {self.prefijo} ({operacion}): {str(error)}")
+
+    def obtener(self, clave):
+        """Devuelve el valor guardado para la clave, o None si no existe o ya venció."""
+        try:
+            texto = self.cliente.get(self.prefijo + clave_texto(clave))
+        except self.error_redis as e:
+            self._fallo('obtener', e)
+            return None
+        if texto is None:
+            self.fallos += 1
+            return None
+        self.aciertos += 1
+        return json.loads(texto)
+
+    def guardar(self, clave, valor, ttl=None):
+        """Guarda el valor con vencimiento `ttl` (o el de la caché); sin vencimiento si ninguno se indica."""
+        ttl = ttl or self.ttl
+        try:
+            self.cliente.set(self.prefijo + clave_texto(clave), json.dumps(valor, default=str),
+                             ex=int(ttl) if ttl else None)
+        except self.error_redis as e:
+            self._fallo('guardar', e)
+        return valor
+
+    def invalidar(self, *prefijo):
+        """Elimina las entradas cuya clave empieza con `prefijo`."""
+        patron = re.sub(r'([*?\[\]\\])', r'\\\1', self.prefijo + clave_texto(prefijo)) + '*'
+        try:
+            claves = list(self.cliente.scan_iter(match=patron, count=500))
+            for inicio in range(0, len(claves), 500):
+                self.cliente.delete(*claves[inicio:inicio + 500])
+        except self.error_redis as e:
+            self._fallo('invalidar', e)
+
+    def metricas(self):
+        return {
+            'backend': 'redis',
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
+            'errores': self.errores
+        }
+
+
+def crear_cache(backend, espacio, max_caracteres, ttl=None, ruta_sqlite=None, url_redis=None):
+    """
+    Crea la caché `espacio` con el backend configurado: 'memoria' (cada proceso la suya),
+    'sqlite' (archivo compartido en el mismo equipo) o 'redis' (compartida entre equipos).
+    """
+    if backend == 'memoria':
+        return CacheMemoria(max_caracteres, ttl)
+    if backend == 'sqlite':
+        return CacheSQLite(ruta_sqlite, espacio, max_caracteres, ttl)
+    if backend == 'redis':
+        return CacheRedis(url_redis, espacio, ttl)
+    raise ValueError(f'Backend de caché desconocido: {backend}')
@@ -8,7 +8,99 @@ class Config:
     # Configuración general
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'clave-secreta-predeterminada'
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+    EXPORT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'exportaciones')
+    EXPORT_CACHE_FOLDER = os.path.join(EXPORT_FOLDER, 'cache')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max upload
+    MAX_LINEAS_LOTE = 500  # Máximo de líneas por alta de recibos en lote
+    IMPORTACION_TAMANO_LOTE = 500  # Filas por inserción al importar listas de empaque
+    IMPORTACION_MAX_ERRORES = 1000  # Máximo de errores detallados en el reporte de importación
+    MAX_PARAMETROS_IN = 1000  # IDs por consulta IN (SQL Server admite hasta 2100 parámetros)
+    SELECCION_TTL = 60 * 60  # Segundos que se conserva una selección guardada en el servidor
+    EXPORTACION_PROCESOS = 2  # Procesos para exportaciones en segundo plano
+    FIREBIRD_POOL_SIZE = 4  # Hilos que resuelven artículos al importar; cada conexión ocupa un lugar del bulkhead
+    # Tiempos de espera (segundos) de las dependencias remotas
+    SQLSERVER_PROD_TIMEOUT_CONEXION = 5
+    SQLSERVER_PROD_TIMEOUT_CONSULTA = 30
+    FIREBIRD_TIMEOUT = 30  # Conexión y lectura a través del túnel SSH
+    SSH_TIMEOUT = 10  # Conexión al servidor SSH y comprobación del túnel
+    SSH_KEEPALIVE = 30  # Segundos entre keepalives del túnel, para detectar conexiones caídas
+    # Bulkhead de Firebird: solicitudes simultáneas por el túnel, en espera y segundos máximos de espera
+    FIREBIRD_MAX_CONCURRENTES = 3
+    FIREBIRD_MAX_EN_COLA = 10
+    FIREBIRD_ESPERA_COLA = 10
+    # Servicio asíncrono de órdenes de compra (servicio_oc.py)
+    SERVICIO_OC_URL = os.environ.get('SERVICIO_OC_URL') or ''  # Vacío: la página consulta a app.py
+    SERVICIO_OC_HOST = os.environ.get('SERVICIO_OC_HOST') or '0.0.0.0'
+    SERVICIO_OC_PUERTO = int(os.environ.get('SERVICIO_OC_PUERTO') or 5001)
+    SERVICIO_OC_CONEXIONES = 4  # Conexiones a Firebird compartidas por todas las consultas
+    SERVICIO_OC_MAX_EN_COLA = 200  # Consultas esperando conexión antes de responder 503
+    SERVICIO_OC_TIMEOUT = 30
+    # Orígenes adicionales de la página que pueden consultar el servicio (separados por comas);
+    # la aplicación en el mismo equipo y puerto SERVIDOR_PUERTO siempre puede
+    SERVICIO_OC_ORIGENES = [origen.strip() for origen in (os.environ.get('SERVICIO_OC_ORIGENES') or '').split(',')
+                            if origen.strip()]
+    # Sugerencias de órdenes de compra mientras se escribe
+    OC_INDICE_TTL = 10 * 60  # Segundos antes de volver a leer los folios de Firebird
+    OC_INDICE_REINTENTO = 60  # Segundos de espera tras una actualización fallida
+    OC_SUGERENCIAS = 10
+    PROCEDENCIAS_TTL = 5 * 60  # Segundos antes de volver a consultar el catálogo al validar un ETag
+    # Sugerencias de proveedor, cliente, grado y descripción con los valores ya capturados
+    AUTOCOMPLETAR_SUGERENCIAS = 10
+    # Circuit breaker: fallos seguidos para marcar una dependencia como caída y segundos antes de reintentar
+    CIRCUITO_FALLOS = 3
+    CIRCUITO_ESPERA = 30
+    # Bandeja de salida: envío automático a producción de los recibos guardados
+    OUTBOX_ACTIVO = (os.environ.get('OUTBOX_ACTIVO') or '0') == '1'  # OUTBOX_ACTIVO=1 para enviar cada guardado
+    OUTBOX_TAMANO_LOTE = 20  # Recibos por lote del enviador
+    OUTBOX_INTERVALO = 30  # Segundos entre revisiones cuando no hay lotes completos
+    OUTBOX_MAX_INTENTOS = 8  # Intentos antes de marcar un envío como fallido
+    OUTBOX_ESPERA_BASE = 60  # Segundos de espera tras el primer fallo (se duplica en cada intento)
+    OUTBOX_ESPERA_MAXIMA = 60 * 60  # Espera máxima entre reintentos
+    OUTBOX_RECLAMO_VIGENCIA = 15 * 60  # Segundos que un lote reclamado queda reservado para su proceso
+    EXPORTACION_TTL = 2 * 60 * 60  # Segundos que se conserva un archivo exportado para descarga
+    # Exportaciones incrementales: segundos de retraso de la cota superior (más que el guardado más
+    # largo) y segundos ya exportados que se repiten en la siguiente exportación de un consumidor
+    EXPORTACION_INCREMENTAL_RETRASO = 60
+    EXPORTACION_INCREMENTAL_SOLAPE = 5 * 60
+    EXPORT_CACHE_MAX_BYTES = 200 * 1024 * 1024  # Tamaño máximo de la caché de exportaciones
+    # Cachés de fragmentos y datos: 'memoria' (cada proceso la suya), 'sqlite' (compartida entre los
+    # procesos del equipo) o 'redis' (compartida entre equipos; requiere el paquete redis)
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND') or 'memoria'
+    CACHE_SQLITE_RUTA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'cache.db')
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL') or 'redis://localhost:6379/0'
+    FRAGMENTOS_CACHE_MAX_CARACTERES = 5 * 1024 * 1024  # Tamaño máximo de los fragmentos HTML
+    FRAGMENTOS_CACHE_TTL = 24 * 60 * 60  # Los fragmentos de versiones anteriores dejan de ocupar lugar
+    DATOS_CACHE_MAX_CARACTERES = 20 * 1024 * 1024  # Tamaño máximo de los resultados de consultas externas
+    # Selecciones guardadas y trabajos de exportación: deben verse desde cualquier proceso del servidor,
+    # por eso no usan 'memoria' salvo que se indique (SESIONES_CACHE_BACKEND=memoria con un solo proceso)
+    SESIONES_CACHE_BACKEND = os.environ.get('SESIONES_CACHE_BACKEND') or 'sqlite'
+    SESIONES_CACHE_MAX_CARACTERES = 20 * 1024 * 1024
+    ARTICULOS_OC_TTL = 60  # Segundos que se reutilizan los artículos de una orden de compra consultada
+    JINJA_CACHE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'jinja')
+    # Arranque con servidor.py: calentamiento antes de atender y parámetros de waitress
+    CALENTAR_AL_INICIAR = (os.environ.get('CALENTAR_AL_INICIAR') or '1') == '1'
+    CALENTAR_CONEXIONES_BD = 2  # Conexiones a la base local abiertas en el pool antes de atender
+    CALENTAR_FIREBIRD = (os.environ.get('CALENTAR_FIREBIRD') or '0') == '1'  # Abrir el túnel SSH y cargar las OC
+    CALENTAR_FIREBIRD_VIGENCIA = 10 * 60  # Segundos que el túnel abierto al calentar espera la primera consulta
+    SERVIDOR_HOST = os.environ.get('SERVIDOR_HOST') or '0.0.0.0'
+    SERVIDOR_PUERTO = int(os.environ.get('SERVIDOR_PUERTO') or 5000)
+    SERVIDOR_HILOS = int(os.environ.get('SERVIDOR_HILOS') or 4)
+    COMPRESION_MINIMA = 500  # Bytes mínimos para comprimir una respuesta con gzip
+    COMPRESION_NIVEL = 6
+    # Bibliotecas de terceros: copia local en static/ (descargar_recursos.py) -> URL de origen en el CDN
+    RECURSOS_EXTERNOS = {
+        'vendor/bootstrap-5.3.0-alpha1.min.css': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/css/bootstrap.min.css',
+        'vendor/bootstrap-icons-1.8.1/bootstrap-icons.css': 'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.8.1/font/bootstrap-icons.css',
+        'vendor/bootstrap-icons-1.8.1/fonts/bootstrap-icons.woff2': 'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.8.1/font/fonts/bootstrap-icons.woff2',
+        'vendor/bootstrap-icons-1.8.1/fonts/bootstrap-icons.woff': 'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.8.1/font/fonts/bootstrap-icons.woff',
+        'vendor/dataTables-1.11.5.bootstrap5.min.css': 'https://cdn.datatables.net/1.11.5/css/dataTables.bootstrap5.min.css',
+        'vendor/jquery-3.6.0.min.js': 'https://code.jquery.com/jquery-3.6.0.min.js',
+        'vendor/bootstrap-5.3.0-alpha1.bundle.min.js': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/js/bootstrap.bundle.min.js',
+        'vendor/jquery.dataTables-1.11.5.min.js': 'https://cdn.datatables.net/1.11.5/js/jquery.dataTables.min.js',
+        'vendor/dataTables-1.11.5.bootstrap5.min.js': 'https://cdn.datatables.net/1.11.5/js/dataTables.bootstrap5.min.js',
+        'vendor/dataTables-1.11.5.es-ES.json': 'https://cdn.datatables.net/plug-ins/1.11.5/i18n/es-ES.json',
+        'vendor/sweetalert2-11.all.min.js': 'https://cdn.jsdelivr.net/npm/sweetalert2@11/dist/sweetalert2.all.min.js'
+    }
 
     # Configuración SQL Server Local
     SQLSERVER_LOCAL = {
@@ -40,7 +132,7 @@ class Config:
         'port': int(os.environ.get('SSH_PORT') or 22),
         'username': os.environ.get('SSH_USERNAME') or 'Administrador',
         'password': os.environ.get('SSH_PASSWORD') or 'f4m1s42021.,',
-        'local_port': int(os.environ.get('SSH_LOCAL_PORT') or 3050),
+        'local_port': int(os.environ.get('SSH_LOCAL_PORT') or 0),  # 0: puerto libre, permite túneles simultáneos
         'remote_host': os.environ.get('SSH_REMOTE_HOST') or 'localhost',
         'remote_port': int(os.environ.get('SSH_REMOTE_PORT') or 3050)
     }
@@ -0,0 +1,54 @@
+"""
+Descarga a static/vendor/ las bibliotecas de terceros que las páginas cargaban de CDN externos
+(Config.RECURSOS_EXTERNOS: Bootstrap, Bootstrap Icons con sus fuentes, jQuery, DataTables con su
+traducción es-ES y SweetAlert2), para servirlas desde la aplicación con huella y caché de un año.
+
+Mientras un archivo no exista localmente, las plantillas siguen usando su URL del CDN.
+Ejecutar una vez desde la raíz del proyecto, en un equipo con acceso a internet:
+    python descargar_recursos.py            (omite los archivos ya descargados)
+    python descargar_recursos.py --todos    (vuelve a descargarlos todos)
+"""
+import argparse
+import os
+import sys
+import urllib.request
+
+from config import Config
+
+CARPETA_STATIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+
+def descargar(nombre, url):
+    """Descarga un recurso a static/<nombre> pasando por un archivo temporal."""
+    ruta = os.path.join(CARPETA_STATIC, *nombre.split('/'))
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with urllib.request.urlopen(url, timeout=30) as respuesta:
+        datos = respuesta.read()
+    with open(ruta + '.tmp', 'wb') as f:
+        f.write(datos)
+    os.replace(ruta + '.tmp', ruta)
+    return len(datos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--todos', action='store_true', help='descargar también los archivos que ya existen')
+    args = parser.parse_args()
+
+    errores = 0
+    for nombre, url in Config.RECURSOS_EXTERNOS.items():
+        if not args.todos and os.path.exists(os.path.join(CARPETA_STATIC, *nombre.split('/'))):
+            print(f'  {nombre}: ya existe')
+            continue
+        try:
+            print(f'  {nombre}: {descargar(nombre, url)} bytes')
+        except Exception as e:
+            errores += 1
+            print(f'  {nombre}: error al descargar {url}: {str(e)}')
+
+    if errores:
+        sys.exit(f'{errores} recursos no se descargaron; las páginas usarán su CDN')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import bisect
+import heapq
+import threading
+import time
+import unicodedata
+
+
+class IndicePrefijos:
+    """
+    Índice en memoria para búsquedas por prefijo sobre claves ordenadas (bisect).
+    Se reconstruye completo con `reemplazar`; las búsquedas leen la versión vigente
+    sin bloquear, ya que el cambio de versión es una sola asignación.
+    Un mismo valor puede tener varias claves (p. ej. un folio con y sin ceros a la izquierda).
+    """
+
+    def __init__(self):
+        self._datos = ([], [])
+        self.actualizado = None
+
+    @staticmethod
+    def normalizar(texto):
+        return str(texto or '').strip().upper()
+
+    def reemplazar(self, entradas):
+        """Reconstruye el índice con pares (clave, valor); los valores deben ser hashables."""
+        pares = sorted(((self.normalizar(clave), valor) for clave, valor in entradas if clave),
+                       key=lambda par: par[0])
+        self._datos = ([clave for clave, _ in pares], [valor for _, valor in pares])
+        self.actualizado = time.time()
+
+    def buscar(self, prefijo, limite=10):
+        """Devuelve hasta `limite` valores distintos cuya clave empieza con `prefijo`, en orden de clave."""
+        prefijo = self.normalizar(prefijo)
+        if not prefijo:
+            return []
+
+        claves, valores = self._datos
+        resultados = []
+        vistos = set()
+        i = bisect.bisect_left(claves, prefijo)
+        while i < len(claves) and claves[i].startswith(prefijo) and len(resultados) < limite:
+            if valores[i] not in vistos:
+                vistos.add(valores[i])
+                resultados.append(valores[i])
+            i += 1
+        return resultados
+
+    def __len__(self):
+        return len(self._datos[0])
+
+
+class IndiceFrecuencias:
+    """
+    Índice de autocompletado de los valores capturados en un campo, ordenado por frecuencia de uso.
+    Los valores que solo difieren en mayúsculas, acentos o espacios se agrupan y se sugiere la
+    variante más usada. Se busca por prefijo del valor o de cualquiera de sus palabras.
+    Se carga una vez con `cargar` y después se actualiza con `sumar` en cada guardado.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.claves = []  # (prefijo de búsqueda, valor normalizado), ordenadas
+        self.grupos = {}  # valor normalizado -> {variante capturada: frecuencia}
+        self.totales = {}  # valor normalizado -> frecuencia de todas sus variantes
+        self.cargado = False
+
+    @staticmethod
+    def normalizar(texto):
+        texto = unicodedata.normalize('NFKD', str(texto or ''))
+        texto = ''.join(c for c in texto if not unicodedata.combining(c))
+        return ' '.join(texto.upper().split())
+
+    @staticmethod
+    def _sufijos(normalizado):
+        """El valor completo y lo que sigue a cada espacio, para buscar por cualquier palabra."""
+        palabras = normalizado.split(' ')
+        return {' '.join(palabras[i:]) for i in range(len(palabras))}
+
+    def cargar(self, pares):
+        """Reemplaza el contenido con pares (valor, frecuencia), p. ej. de un GROUP BY."""
+        grupos = {}
+        for valor, frecuencia in pares:
+            valor = str(valor or '').strip()
+            if not valor or not frecuencia:
+                continue
+            grupo = grupos.setdefault(self.normalizar(valor), {})
+            grupo[valor] = grupo.get(valor, 0) + frecuencia
+        claves = sorted((sufijo, normalizado) for normalizado in grupos for sufijo in self._sufijos(normalizado))
+        totales = {normalizado: sum(grupo.values()) for normalizado, grupo in grupos.items()}
+        with self.lock:
+            self.grupos = grupos
+            self.totales = totales
+            self.claves = claves
+            self.cargado = True
+
+    def sumar(self, valor, cantidad=1):
+        """Suma (o resta, con cantidad negativa) usos de un valor. No hace nada si aún no se carga."""
+        valor = str(valor or '').strip()
+        if not valor:
+            return
+        normalizado = self.normalizar(valor)
+        with self.lock:
+            if not self.cargado:
+                return
+            grupo = self.grupos.get(normalizado)
+            if grupo is None:
+                if cantidad <= 0:
+                    return
+                grupo = self.grupos[normalizado] = {}
+                for sufijo in self._sufijos(normalizado):
+                    bisect.insort(self.claves, (sufijo, normalizado))
+
+            anterior = grupo.get(valor, 0)
+            grupo[valor] = max(anterior + cantidad, 0)
+            self.totales[normalizado] = self.totales.get(normalizado, 0) + grupo[valor] - anterior
+            if not grupo[valor]:
+                del grupo[valor]
+            if not grupo:
+                del self.grupos[normalizado]
+                del self.totales[normalizado]
+                for sufijo in self._sufijos(normalizado):
+                    i = bisect.bisect_left(self.claves, (sufijo, normalizado))
+                    if i < len(self.claves) and self.claves[i] == (sufijo, normalizado):
+                        del self.claves[i]
+
+    def buscar(self, prefijo, limite=10):
+        """Devuelve hasta `limite` pares (valor, frecuencia) que coinciden con el prefijo, los más usados primero."""
+        prefijo = self.normalizar(prefijo)
+        if not prefijo:
+            return []
+
+        with self.lock:
+            candidatos = set()
+            i = bisect.bisect_left(self.claves, (prefijo,))
+            while i < len(self.claves) and self.claves[i][0].startswith(prefijo):
+                candidatos.add(self.claves[i][1])
+                i += 1
+
+            mejores = heapq.nsmallest(limite, candidatos,
+                                      key=lambda normalizado: (-self.totales[normalizado], normalizado))
+            return [(max(self.grupos[normalizado].items(), key=lambda variante: variante[1])[0],
+                     self.totales[normalizado])
+                    for normalizado in mejores]
+
+    def __len__(self):
+        return len(self.grupos)
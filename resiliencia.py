@@ -0,0 +1,239 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class _Llamada:
+    """Consulta en curso: los llamadores que llegan después esperan su resultado."""
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Agrupa llamadas concurrentes con la misma clave: solo la primera ejecuta la consulta
+    y las demás esperan y comparten su resultado (o su excepción).
+    No guarda resultados: una llamada que llega después de terminar la consulta ejecuta otra.
+    """
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.lock = threading.Lock()
+        self.en_curso = {}
+        self.llamadas = 0
+        self.ejecuciones = 0
+        self.coalescidas = 0
+
+    def ejecutar(self, clave, funcion, *args, **kwargs):
+        with self.lock:
+            self.llamadas += 1
+            llamada = self.en_curso.get(clave)
+            if llamada is None:
+                llamada = _Llamada()
+                self.en_curso[clave] = llamada
+                self.ejecuciones += 1
+                lider = True
+            else:
+                self.coalescidas += 1
+                lider = False
+
+        if not lider:
+            llamada.evento.wait()
+            if llamada.error is not None:
+                raise llamada.error
+            return llamada.resultado
+
+        try:
+            llamada.resultado = funcion(*args, **kwargs)
+            return llamada.resultado
+        except Exception as e:
+            llamada.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.en_curso[clave]
+            llamada.evento.set()
+
+    def metricas(self):
+        with self.lock:
+            return {
+                'llamadas': self.llamadas,
+                'ejecuciones': self.ejecuciones,
+                'coalescidas': self.coalescidas,
+                'en_curso': len(self.en_curso)
+            }
+
+
+class CircuitoAbierto(Exception):
+    """La dependencia está marcada como caída: la llamada se rechaza sin intentarla."""
+
+    def __init__(self, mensaje, reintentar_en):
+        super().__init__(mensaje)
+        self.reintentar_en = reintentar_en
+
+
+class CircuitBreaker:
+    """
+    Corta las llamadas a una dependencia remota tras `fallos_maximos` fallos seguidos.
+    Mientras está abierto rechaza de inmediato con CircuitoAbierto; pasados `espera` segundos
+    deja pasar una sola llamada de prueba (semiabierto) que lo cierra si tiene éxito.
+    """
+
+    def __init__(self, nombre, fallos_maximos, espera):
+        self.nombre = nombre
+        self.fallos_maximos = fallos_maximos
+        self.espera = espera
+        self.lock = threading.Lock()
+        self.estado = 'cerrado'
+        self.fallos = 0
+        self.abierto_desde = None
+        self.prueba_en_curso = False
+        self.rechazos = 0
+        self.aperturas = 0
+
+    def _rechazar(self):
+        self.rechazos += 1
+        reintentar_en = max(1, int(self.espera - (time.monotonic() - self.abierto_desde)))
+        raise CircuitoAbierto(f'{self.nombre} no disponible temporalmente', reintentar_en)
+
+    def llamar(self, funcion, *args, **kwargs):
+        with self.lock:
+            if self.estado == 'abierto':
+                if time.monotonic() - self.abierto_desde < self.espera:
+                    self._rechazar()
+                self.estado = 'semiabierto'
+            if self.estado == 'semiabierto':
+                if self.prueba_en_curso:
+                    self._rechazar()
+                self.prueba_en_curso = True
+
+        try:
+            resultado = funcion(*args, **kwargs)
+        except Exception:
+            self._registrar_fallo()
+            raise
+        self._registrar_exito()
+        return resultado
+
+    def _registrar_exito(self):
+        with self.lock:
+            self.estado = 'cerrado'
+            self.fallos = 0
+            self.prueba_en_curso = False
+
+    def _registrar_fallo(self):
+        with self.lock:
+            self.fallos += 1
+            if self.estado == 'semiabierto' or self.fallos >= self.fallos_maximos:
+                if self.estado != 'abierto':
+                    self.aperturas += 1
+                self.estado = 'abierto'
+                self.abierto_desde = time.monotonic()
+            self.prueba_en_curso = False
+
+    def abierto(self):
+        """Indica si la dependencia se considera caída (abierto o esperando la llamada de prueba)."""
+        return self.estado != 'cerrado'
+
+    def metricas(self):
+        with self.lock:
+            return {
+                'estado': self.estado,
+                'fallos_consecutivos': self.fallos,
+                'aperturas': self.aperturas,
+                'rechazos': self.rechazos
+            }
+
+
+class Saturado(Exception):
+    """El bulkhead de la dependencia está lleno: la solicitud se rechaza en lugar de esperar sin límite."""
+
+    def __init__(self, mensaje, reintentar_en):
+        super().__init__(mensaje)
+        self.reintentar_en = reintentar_en
+
+
+class Bulkhead:
+    """
+    Limita las llamadas concurrentes a una dependencia a `max_concurrentes`.
+    Hasta `max_en_cola` llamadas más esperan turno como máximo `espera` segundos;
+    si la cola está llena o se agota la espera se lanza Saturado.
+    """
+
+    def __init__(self, nombre, max_concurrentes, max_en_cola, espera):
+        self.nombre = nombre
+        self.max_concurrentes = max_concurrentes
+        self.max_en_cola = max_en_cola
+        self.espera = espera
+        self.condicion = threading.Condition()
+        self.activos = 0
+        self.en_cola = 0
+        self.max_cola_observada = 0
+        self.aceptadas = 0
+        self.rechazadas = 0
+        self.vencidas = 0
+
+    def adquirir(self):
+        with self.condicion:
+            if self.activos >= self.max_concurrentes or self.en_cola > 0:
+                if self.en_cola >= self.max_en_cola:
+                    self.rechazadas += 1
+                    raise Saturado(f'{self.nombre} saturado: demasiadas solicitudes en espera', self.espera)
+
+                self.en_cola += 1
+                self.max_cola_observada = max(self.max_cola_observada, self.en_cola)
+                limite = time.monotonic() + self.espera
+                try:
+                    while self.activos >= self.max_concurrentes:
+                        restante = limite - time.monotonic()
+                        if restante <= 0:
+                            self.vencidas += 1
+                            raise Saturado(f'{self.nombre} saturado: se agotó el tiempo de espera', self.espera)
+                        self.condicion.wait(restante)
+                finally:
+                    self.en_cola -= 1
+
+            self.activos += 1
+            self.aceptadas += 1
+
+    def intentar_adquirir(self):
+        """Toma un lugar solo si hay uno libre y nadie espera turno; devuelve si lo tomó."""
+        with self.condicion:
+            if self.activos >= self.max_concurrentes or self.en_cola > 0:
+                return False
+            self.activos += 1
+            self.aceptadas += 1
+            return True
+
+    def liberar(self):
+        with self.condicion:
+            self.activos -= 1
+            self.condicion.notify()
+
+    @contextmanager
+    def ocupar(self):
+        self.adquirir()
+        try:
+            yield
+        finally:
+            self.liberar()
+
+    def llamar(self, funcion, *args, **kwargs):
+        with self.ocupar():
+            return funcion(*args, **kwargs)
+
+    def metricas(self):
+        with self.condicion:
+            return {
+                'activos': self.activos,
+                'en_cola': self.en_cola,
+                'max_concurrentes': self.max_concurrentes,
+                'max_en_cola': self.max_en_cola,
+                'max_cola_observada': self.max_cola_observada,
+                'aceptadas': self.aceptadas,
+                'rechazadas': self.rechazadas,
+                'vencidas': self.vencidas
+            }
@@ -0,0 +1,290 @@
+"""
+Servicio asíncrono de consulta de órdenes de compra en Microsip (Firebird).
+
+Atiende GET /buscar_articulos_por_oc/<orden_compra> con la misma respuesta que la ruta de
+app.py, pero sin ocupar un hilo de waitress por consulta: un solo proceso asyncio mantiene
+abierto el túnel SSH y unas pocas conexiones a Firebird (SERVICIO_OC_CONEXIONES), y reparte
+entre ellas todas las consultas concurrentes. El driver de Firebird es bloqueante, por lo que
+cada consulta se ejecuta en un hilo con su propia conexión mientras el ciclo de eventos sigue
+atendiendo. Las consultas simultáneas de la misma orden se agrupan en una sola.
+Si Microsip no responde al arrancar o el túnel se cae, las conexiones (y el túnel) se vuelven
+a abrir en las consultas siguientes, sin reiniciar el servicio.
+
+Solo la página de la aplicación puede consultarlo desde el navegador (CORS): el mismo equipo
+en el puerto SERVIDOR_PUERTO, o los orígenes de SERVICIO_OC_ORIGENES.
+
+Uso: python servicio_oc.py  (y SERVICIO_OC_URL=http://servidor:5001 para que la página lo use)
+"""
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlsplit
+
+import app as aplicacion
+
+MENSAJES_HTTP = {200: 'OK', 404: 'Not Found', 405: 'Method Not Allowed', 503: 'Service Unavailable',
+                 504: 'Gateway Timeout'}
+
+
+class TunelMicrosip:
+    """Túnel SSH a Microsip compartido por las conexiones del servicio; se vuelve a abrir si se cayó."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tunel = None
+
+    def conectar(self):
+        """Abre una conexión a Firebird a través del túnel, abriéndolo antes si no está activo."""
+        with self.lock:
+            if self.tunel is None or not self.tunel.is_active:
+                self.cerrar_tunel()
+                resultado = aplicacion.abrir_conexion_firebird()
+                self.tunel = resultado['tunnel']
+                return resultado['conn']
+            puerto = self.tunel.local_bind_port
+        return aplicacion.conectar_firebird(puerto)[0]
+
+    def cerrar_tunel(self):
+        if self.tunel is not None and self.tunel.is_active:
+            self.tunel.close()
+        self.tunel = None
+
+
+class ServicioOC:
+    """
+    Consulta órdenes de compra repartiendo las solicitudes entre `conexiones` conexiones fijas.
+    `abrir_conexion` devuelve una conexión DB-API nueva; se usa al iniciar y para reponer
+    una conexión que falló.
+    """
+
+    def __init__(self, abrir_conexion, conexiones, max_en_cola, timeout):
+        self.abrir_conexion = abrir_conexion
+        self.total_conexiones = conexiones
+        self.max_en_cola = max_en_cola
+        self.timeout = timeout
+        self.ejecutor = ThreadPoolExecutor(max_workers=conexiones, thread_name_prefix='servicio-oc')
+        self.libres = None
+        self.en_curso = {}
+        self.en_cola = 0
+        self.consultas = 0
+        self.coalescidas = 0
+        self.rechazadas = 0
+        self.errores = 0
+
+    async def iniciar(self):
+        """Abre las conexiones; las que fallan (p. ej. Microsip no responde) se reintentan al usarlas."""
+        loop = asyncio.get_running_loop()
+        self.libres = asyncio.Queue()
+        for _ in range(self.total_conexiones):
+            try:
+                self.libres.put_nowait(await loop.run_in_executor(self.ejecutor, self.abrir_conexion))
+            except Exception as e:
+                print(f"Error al conectar con Firebird al iniciar; se reintentará en la primera consulta: {str(e)}")
+                self.libres.put_nowait(_ConexionPendiente(self.abrir_conexion))
+
+    def _consultar(self, conn, orden_compra):
+        """
+        Se ejecuta en un hilo del ejecutor con una conexión exclusiva. Guarda la respuesta en la
+        caché de órdenes consultadas que comparte con app.py (cache_datos).
+        """
+        return aplicacion.guardar_articulos_oc(orden_compra, aplicacion.leer_articulos_oc(conn.cursor(), orden_compra))
+
+    async def _ejecutar(self, orden_compra):
+        loop = asyncio.get_running_loop()
+        # La caché (SQLite o Redis) se lee fuera del ciclo de eventos y sin ocupar una conexión a Firebird
+        resultado = await loop.run_in_executor(None, aplicacion.cache_datos.obtener, ('articulos_oc', orden_compra))
+        if resultado is not None:
+            return 200, resultado
+
+        if self.en_cola >= self.max_en_cola:
+            self.rechazadas += 1
+            return 503, {'status': 'error', 'message': 'Servicio de órdenes de compra saturado. Intente de nuevo en unos segundos.'}
+
+        self.en_cola += 1
+        try:
+            conn = await self.libres.get()
+        finally:
+            self.en_cola -= 1
+
+        try:
+            self.consultas += 1
+            return 200, await loop.run_in_executor(self.ejecutor, self._consultar, conn, orden_compra)
+        except Exception as e:
+            # Reponer la conexión: pudo quedar inservible
+            self.errores += 1
+            try:
+                conn.close()
+            except Exception:
+                pass
+            try:
+                conn = await loop.run_in_executor(self.ejecutor, self.abrir_conexion)
+            except Exception as error_conexion:
+                print(f"Error al reconectar con Firebird: {str(error_conexion)}")
+                conn = None
+            return 200, {'status': 'error', 'message': str(e)}
+        finally:
+            if conn is not None:
+                self.libres.put_nowait(conn)
+            else:
+                # Se reintentará abrirla en la siguiente consulta que la tome
+                self.libres.put_nowait(_ConexionPendiente(self.abrir_conexion))
+
+    async def buscar(self, orden_compra):
+        """Consulta una orden; las solicitudes concurrentes de la misma orden comparten la consulta."""
+        tarea = self.en_curso.get(orden_compra)
+        if tarea is None:
+            tarea = asyncio.ensure_future(self._ejecutar(orden_compra))
+            self.en_curso[orden_compra] = tarea
+            tarea.add_done_callback(lambda _: self.en_curso.pop(orden_compra, None))
+        else:
+            self.coalescidas += 1
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(tarea), self.timeout)
+        except asyncio.TimeoutError:
+            return 504, {'status': 'error', 'message': 'Microsip no respondió a tiempo'}
+
+    def metricas(self):
+        return {
+            'conexiones': self.total_conexiones,
+            'conexiones_libres': self.libres.qsize() if self.libres else 0,
+            'en_cola': self.en_cola,
+            'en_curso': len(self.en_curso),
+            'consultas': self.consultas,
+            'coalescidas': self.coalescidas,
+            'rechazadas': self.rechazadas,
+            'errores': self.errores
+        }
+
+    def origen_permitido(self, origen, host):
+        """Origen de la página que puede leer las respuestas: la aplicación en el mismo equipo o SERVICIO_OC_ORIGENES."""
+        if not origen:
+            return None
+        config = aplicacion.app.config
+        equipo = urlsplit(f'//{host}').hostname if host else None
+        if origen in config['SERVICIO_OC_ORIGENES'] or (
+                equipo and origen == f"http://{equipo}:{config['SERVIDOR_PUERTO']}"):
+            return origen
+        return None
+
+    async def despachar(self, metodo, ruta):
+        ruta = urlsplit(ruta).path
+        if metodo != 'GET':
+            return 405, {'status': 'error', 'message': 'Método no permitido'}
+        if ruta.startswith('/buscar_articulos_por_oc/'):
+            orden_compra = aplicacion.safe_encode(unquote(ruta[len('/buscar_articulos_por_oc/'):]))
+            if not orden_compra:
+                return 404, {'status': 'error', 'message': 'Orden de compra no especificada'}
+            return await self.buscar(orden_compra)
+        if ruta == '/metricas':
+            return 200, self.metricas()
+        return 404, {'status': 'error', 'message': 'Ruta no encontrada'}
+
+    async def atender(self, reader, writer):
+        """Atiende una conexión HTTP/1.1 con keep-alive."""
+        try:
+            while True:
+                linea = await reader.readline()
+                if not linea:
+                    break
+                partes = linea.decode('latin-1').split()
+                if len(partes) < 2:
+                    break
+                metodo, ruta = partes[0], partes[1]
+
+                mantener = not (len(partes) > 2 and partes[2] == 'HTTP/1.0')
+                origen = host = None
+                while True:
+                    encabezado = await reader.readline()
+                    if encabezado in (b'\r\n', b'\n', b''):
+                        break
+                    nombre, _, valor = encabezado.decode('latin-1').partition(':')
+                    nombre = nombre.strip().lower()
+                    if nombre == 'connection':
+                        mantener = valor.strip().lower() != 'close'
+                    elif nombre == 'origin':
+                        origen = valor.strip()
+                    elif nombre == 'host':
+                        host = valor.strip()
+
+                estado, datos = await self.despachar(metodo, ruta)
+                cuerpo = json.dumps(datos).encode('utf-8')
+                encabezados = [
+                    f'HTTP/1.1 {estado} {MENSAJES_HTTP[estado]}',
+                    'Content-Type: application/json',
+                    f'Content-Length: {len(cuerpo)}',
+                    'Vary: Origin',
+                    f"Connection: {'keep-alive' if mantener else 'close'}"
+                ]
+                permitido = self.origen_permitido(origen, host)
+                if permitido:
+                    encabezados.append(f'Access-Control-Allow-Origin: {permitido}')
+                if estado == 503:
+                    encabezados.append('Retry-After: 5')
+                writer.write(('\r\n'.join(encabezados) + '\r\n\r\n').encode('latin-1') + cuerpo)
+                await writer.drain()
+                if not mantener:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def cerrar(self):
+        if self.libres is not None:
+            while not self.libres.empty():
+                try:
+                    self.libres.get_nowait().close()
+                except Exception:
+                    pass
+        self.ejecutor.shutdown(wait=False)
+
+
+class _ConexionPendiente:
+    """Conexión que no se pudo reponer: se abre al usarla por primera vez."""
+
+    def __init__(self, abrir_conexion):
+        self.abrir_conexion = abrir_conexion
+        self.conn = None
+
+    def cursor(self):
+        if self.conn is None:
+            self.conn = self.abrir_conexion()
+        return self.conn.cursor()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+async def servir(servicio, host, puerto, listo=None):
+    """Inicia el servicio y atiende hasta que se cancele. `listo` (asyncio.Event) se activa al escuchar."""
+    await servicio.iniciar()
+    servidor = await asyncio.start_server(servicio.atender, host, puerto)
+    if listo is not None:
+        listo.set()
+    try:
+        async with servidor:
+            await servidor.serve_forever()
+    finally:
+        servicio.cerrar()
+
+
+def main():
+    config = aplicacion.app.config
+    tunel = TunelMicrosip()
+    servicio = ServicioOC(tunel.conectar, config['SERVICIO_OC_CONEXIONES'],
+                          config['SERVICIO_OC_MAX_EN_COLA'], config['SERVICIO_OC_TIMEOUT'])
+    print(f"Servicio de órdenes de compra en {config['SERVICIO_OC_HOST']}:{config['SERVICIO_OC_PUERTO']} "
+          f"con {config['SERVICIO_OC_CONEXIONES']} conexiones a Firebird")
+    try:
+        asyncio.run(servir(servicio, config['SERVICIO_OC_HOST'], config['SERVICIO_OC_PUERTO']))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        tunel.cerrar_tunel()
+
+
+if __name__ == '__main__':
+    main()
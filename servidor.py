@@ -0,0 +1,38 @@
+"""
+Arranque de la aplicación con waitress. Antes de atender actualiza el esquema de la base
+local (app.actualizar_esquema: tablas, columnas e índices nuevos) y, si falla, no arranca.
+Luego ejecuta el calentamiento (app.calentar):
+abre conexiones a la base local, carga el catálogo de procedencias y los índices de
+autocompletado, compila las plantillas (con caché en instance/jinja) y, con CALENTAR_FIREBIRD=1,
+carga las órdenes de compra de Microsip y deja abiertos un túnel SSH y una conexión que usa la
+primera consulta a Firebird. Así la primera petición no paga esos costos.
+
+GET /listo responde 200 cuando el calentamiento terminó y 503 mientras tanto o si falló.
+Uso: python servidor.py  (CALENTAR_AL_INICIAR=0 para atender sin calentar)
+"""
+from waitress import serve
+
+import app as aplicacion
+
+
+def main():
+    config = aplicacion.app.config
+    # Siempre, aun sin calentamiento: el código espera las columnas e índices que agrega
+    with aplicacion.app.app_context():
+        aplicacion.actualizar_esquema()
+    print("Esquema de la base local actualizado")
+    
+    if config['CALENTAR_AL_INICIAR']:
+        estado = aplicacion.calentar()
+        for paso in estado['pasos']:
+            detalle = 'ok' if paso['ok'] else f"error: {paso['error']}"
+            print(f"  {paso['paso']:20} {paso['ms']:6} ms  {detalle}")
+        print(f"Calentamiento {estado['estado']} en {estado['fin'] - estado['inicio']:.1f} s")
+
+    print(f"Atendiendo en {config['SERVIDOR_HOST']}:{config['SERVIDOR_PUERTO']} con {config['SERVIDOR_HILOS']} hilos")
+    serve(aplicacion.app, host=config['SERVIDOR_HOST'], port=config['SERVIDOR_PUERTO'],
+          threads=config['SERVIDOR_HILOS'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+@echo off
+cd /d "C:\Users\Serv System\Desktop\calidad"
+python servicio_oc.py
+pause
\ No newline at end of file
@@ -1,18 +1,73 @@
 // Variables globales
 let eventosInicializados = false;
+const CAMPOS_AUTOCOMPLETAR = ['proveedor', 'cliente', 'grado_acero', 'descripcion_material'];
+const temporizadoresSugerencias = {};
+const consultasSugerencias = {};
+
+// Llenar el datalist de un campo con sugerencias mientras se escribe (con espera para no consultar en cada tecla).
+// convertir(response) devuelve las opciones a mostrar.
+function sugerirValores(campo, idLista, url, convertir) {
+    const texto = $('#' + campo).val().trim();
+    const lista = $('#' + idLista);
+    clearTimeout(temporizadoresSugerencias[campo]);
+
+    if (!texto) {
+        lista.empty();
+        return;
+    }
+
+    temporizadoresSugerencias[campo] = setTimeout(function() {
+        // Ignorar respuestas de consultas anteriores que lleguen tarde
+        const consulta = consultasSugerencias[campo] = (consultasSugerencias[campo] || 0) + 1;
+        $.getJSON(url, { q: texto }, function(response) {
+            if (consulta !== consultasSugerencias[campo] || response.status !== 'success') return;
+            lista.empty().append(convertir(response));
+        });
+    }, 150);
+}
+
+// Sugerir folios de orden de compra
+function sugerirOrdenesCompra() {
+    sugerirValores('orden_compra', 'sugerencias_oc', URLS_RECIBOS.sugerirOc, function(response) {
+        return response.sugerencias.map(function(sugerencia) {
+            return $('<option>').val(sugerencia.folio).text(sugerencia.proveedor);
+        });
+    });
+}
+
+// Sugerir valores ya capturados en otros recibos, los más usados primero
+function sugerirValoresCapturados() {
+    const campo = this.id;
+    sugerirValores(campo, 'sugerencias_' + campo, URLS_RECIBOS.autocompletar + campo, function(response) {
+        return response.sugerencias.map(function(sugerencia) {
+            return $('<option>').val(sugerencia.valor);
+        });
+    });
+}
+
+// Guardar en el formulario las llaves de Microsip del artículo elegido (o limpiarlas)
+function asignarArticuloMicrosip(articulo) {
+    $('#docto_cm_det_id').val(articulo ? articulo.docto_cm_det_id : '');
+    $('#articulo_id').val(articulo ? articulo.articulo_id : '');
+    $('#clave_articulo').val(articulo ? articulo.clave_articulo : '');
+}
 
 // Función para cargar artículos al cambiar el número de orden de compra
 function cargarArticulosPorOrdenCompra() {
     const ordenCompra = $('#orden_compra').val().trim();
-    
+
     // Limpiar el selector de materiales
     $('#material_selector').empty().append('<option value="">Seleccione un material</option>');
     $('#material_selector_container').hide();
-    
+
+    // Las llaves guardadas pertenecen a la orden anterior
+    $('#idordencompra').val('');
+    asignarArticuloMicrosip(null);
+
     if (!ordenCompra) {
         return;
     }
-    
+
     // Mostrar indicador de carga
     Swal.fire({
         title: 'Cargando materiales...',
@@ -22,23 +77,23 @@ function cargarArticulosPorOrdenCompra() {
             Swal.showLoading();
         }
     });
-    
+
     // Realizar la solicitud AJAX
     $.ajax({
-        url: `/buscar_articulos_por_oc/${ordenCompra}`,
+        url: URLS_RECIBOS.buscarArticulosPorOc + encodeURIComponent(ordenCompra),
         type: 'GET',
         dataType: 'json',
         success: function(response) {
             Swal.close();
-            
+
             if (response.status === 'success') {
                 const articulos = response.articulos;
-                
+
                 if (articulos.length === 0) {
                     Swal.fire('Información', 'La orden de compra no tiene artículos asociados', 'info');
                     return;
                 }
-                
+
                 // Si hay un solo artículo, llenar directamente los campos
                 if (articulos.length === 1) {
                     $('#descripcion_material').val(articulos[0].descripcion);
@@ -46,27 +101,30 @@ function cargarArticulosPorOrdenCompra() {
                     $('#proveedor').val(articulos[0].proveedor);
                     // Guardar el ID de orden de compra
                     $('#idordencompra').val(response.docto_cm_id);
+                    asignarArticuloMicrosip(articulos[0]);
                     return;
                 }
-                
+
                 // Si hay más de un artículo, mostrar selector
                 $('#material_selector_container').show();
-                
+
                 // Llenar el selector de materiales
                 articulos.forEach(function(articulo) {
                     $('#material_selector').append(
-                        `<option value="${articulo.articulo_id}" 
+                        `<option value="${articulo.articulo_id}"
                          data-descripcion="${articulo.descripcion}"
+                         data-docto-cm-det-id="${articulo.docto_cm_det_id}"
+                         data-clave-articulo="${articulo.clave_articulo}"
                          data-unidades="${articulo.unidades}"
                          data-proveedor="${articulo.proveedor}">
                          ${articulo.descripcion} (${articulo.unidades} unidades)
                          </option>`
                     );
                 });
-                
+
                 // Almacenar el ID de documento para uso posterior
                 $('#idordencompra').val(response.docto_cm_id);
-                
+
                 // Notificar al usuario
                 Swal.fire('Éxito', 'Seleccione un material de la lista', 'success');
             } else {
@@ -75,7 +133,7 @@ function cargarArticulosPorOrdenCompra() {
         },
         error: function(xhr, status, error) {
             Swal.close();
-            Swal.fire('Error', 'Ocurrió un error al cargar los materiales', 'error');
+            Swal.fire('Error', mensajeErrorAjax(xhr, 'Ocurrió un error al cargar los materiales'), 'error');
             console.error(error);
         }
     });
@@ -84,16 +142,28 @@ function cargarArticulosPorOrdenCompra() {
 // Función para manejar la selección de material
 function seleccionarMaterial() {
     const optionSelected = $('#material_selector option:selected');
-    
+
     if (optionSelected.val()) {
+        // Limpiar: eliminar solo "(n unidades)" del texto de la opción
+        const cleanDescription = optionSelected.text()
+            .replace(/\s*\(\d+\.?\d*\s*unidades\)\s*$/, '')
+            .trim();
+
         // Llenar campos con datos del material seleccionado
-        $('#descripcion_material').val(optionSelected.data('descripcion'));
+        $('#descripcion_material').val(cleanDescription);
         $('#cantidad').val(optionSelected.data('unidades'));
         $('#proveedor').val(optionSelected.data('proveedor'));
+        asignarArticuloMicrosip({
+            docto_cm_det_id: optionSelected.data('docto-cm-det-id'),
+            articulo_id: optionSelected.val(),
+            clave_articulo: optionSelected.data('clave-articulo')
+        });
     } else {
         // Limpiar campos si no hay selección
         $('#descripcion_material').val('');
         $('#cantidad').val('');
+        $('#proveedor').val('');
+        asignarArticuloMicrosip(null);
     }
 }
 
@@ -111,11 +181,11 @@ function configurarInterfazBusquedaMateriales() {
                 </div>
             </div>
         `;
-        
+
         // Insertar después de la fila que contiene orden_compra
         $(selectorHtml).insertAfter($('#orden_compra').closest('.row'));
     }
-    
+
     // Asegurarse de que exista el campo oculto
     if (!$('#idordencompra').length) {
         $('<input type="hidden" id="idordencompra" name="idordencompra">').appendTo('#formRecibo');
@@ -125,29 +195,152 @@ function configurarInterfazBusquedaMateriales() {
 // Inicialización una sola vez de eventos
 function inicializarEventos() {
     if (eventosInicializados) return;
-    
+
     // Configurar UI
     configurarInterfazBusquedaMateriales();
-    
+
     // Eliminar cualquier evento previo
-    $('#orden_compra').off('change');
+    $('#orden_compra').off('change input');
     $(document).off('change', '#material_selector');
-    
+    $('#descripcion_material').off('input');
+    CAMPOS_AUTOCOMPLETAR.forEach(function(campo) {
+        $('#' + campo).off('input', sugerirValoresCapturados);
+    });
+
     // Agregar nuevos listeners
     $('#orden_compra').on('change', cargarArticulosPorOrdenCompra);
+    $('#orden_compra').on('input', sugerirOrdenesCompra);
     $(document).on('change', '#material_selector', seleccionarMaterial);
-    
+    CAMPOS_AUTOCOMPLETAR.forEach(function(campo) {
+        $('#' + campo).on('input', sugerirValoresCapturados);
+    });
+
+    // Si la descripción se escribe a mano, el artículo ya no corresponde a la línea elegida
+    $('#descripcion_material').on('input', function() {
+        asignarArticuloMicrosip(null);
+    });
+
     eventosInicializados = true;
 }
 
+// Mensaje del servidor en respuestas de error (p. ej. 503 cuando Microsip está saturado)
+function mensajeErrorAjax(xhr, mensajePorDefecto) {
+    return (xhr.responseJSON && xhr.responseJSON.message) || mensajePorDefecto;
+}
+
+// Escapar texto antes de insertarlo como HTML en la tabla
+function escaparHtml(texto) {
+    return $('<div>').text(texto === null || texto === undefined ? '' : texto).html();
+}
+
+// Convertir fecha 'YYYY-MM-DD' al formato 'DD/MM/YYYY' usado en el listado
+function formatearFecha(fecha) {
+    if (!fecha) return '';
+    const [anio, mes, dia] = fecha.split('-');
+    return `${dia}/${mes}/${anio}`;
+}
+
+// Construir las celdas de una fila del listado con el mismo formato que index.html
+function construirFilaRecibo(recibo) {
+    const archivo = recibo.archivo
+        ? `<a href="/descargar_archivo/${recibo.id}" class="btn btn-sm btn-info"><i class="bi bi-download"></i></a>`
+        : '';
+
+    return [
+        `<input type="checkbox" class="seleccion-recibo" value="${recibo.id}">`,
+        escaparHtml(recibo.idcode),
+        formatearFecha(recibo.fecha),
+        escaparHtml(recibo.orden_compra),
+        escaparHtml(recibo.proveedor),
+        escaparHtml(recibo.num_remision),
+        escaparHtml(recibo.descripcion_material),
+        escaparHtml(recibo.cliente),
+        escaparHtml(recibo.reporte_focc03),
+        archivo,
+        `<button type="button" class="btn btn-sm btn-primary ver-detalles" data-id="${recibo.id}">
+            <i class="bi bi-eye"></i>
+         </button>
+         <button type="button" class="btn btn-sm btn-warning editar-recibo" data-id="${recibo.id}">
+            <i class="bi bi-pencil"></i>
+         </button>`
+    ];
+}
+
+// Actualizar (o agregar) solo la fila del recibo guardado sin recargar el listado
+function actualizarFilaRecibo(recibo) {
+    const tabla = $('#tablaRecibos').DataTable();
+    const celdas = construirFilaRecibo(recibo);
+
+    // Buscar en todas las páginas, no solo en las filas visibles
+    const fila = $(tabla.rows().nodes()).find(`.seleccion-recibo[value="${recibo.id}"]`).closest('tr');
+
+    if (fila.length) {
+        tabla.row(fila).data(celdas).draw(false);
+    } else {
+        const nodo = tabla.row.add(celdas).draw(false).node();
+        $(nodo).find('td:last').addClass('table-actions');
+    }
+}
+
+// Encolar una exportación en el servidor, consultar su estado y descargarla al terminar
+function exportarEnSegundoPlano(datos) {
+    Swal.fire({
+        title: 'Generando exportación...',
+        text: 'El archivo se descargará al terminar',
+        allowOutsideClick: false,
+        didOpen: () => {
+            Swal.showLoading();
+        }
+    });
+
+    $.ajax({
+        url: URLS_RECIBOS.exportaciones,
+        type: 'POST',
+        contentType: 'application/json',
+        data: JSON.stringify(datos),
+        dataType: 'json',
+        success: function(response) {
+            if (response.status !== 'success') {
+                Swal.fire('Error', response.message, 'error');
+                return;
+            }
+            consultarEstadoExportacion(response.url_estado);
+        },
+        error: function() {
+            Swal.fire('Error', 'No se pudo iniciar la exportación', 'error');
+        }
+    });
+}
+
+function consultarEstadoExportacion(urlEstado) {
+    $.ajax({
+        url: urlEstado,
+        type: 'GET',
+        dataType: 'json',
+        success: function(response) {
+            if (response.estado === 'terminado') {
+                Swal.close();
+                window.location.href = response.url_descarga;
+            } else if (response.estado === 'error') {
+                Swal.fire('Error', response.message || 'La exportación falló', 'error');
+            } else {
+                setTimeout(() => consultarEstadoExportacion(urlEstado), 2000);
+            }
+        },
+        error: function() {
+            Swal.fire('Error', 'No se pudo consultar el estado de la exportación', 'error');
+        }
+    });
+}
+
 // Cuando se abre el documento
 $(document).ready(function() {
     inicializarEventos();
-    
+
     // Inicializar DataTable
     $('#tablaRecibos').DataTable({
         language: {
-            url: '//cdn.datatables.net/plug-ins/1.11.5/i18n/es-ES.json'
+            url: URLS_RECIBOS.idiomaTablas
         },
         paging: true,
         ordering: true,
@@ -155,32 +348,66 @@ $(document).ready(function() {
         searching: false,
         pageLength: 10
     });
-    
-    // Manejar el formulario de nuevo/editar recibo
+
+    // Guardar el recibo por AJAX y actualizar solo su fila
     $('#btnGuardarRecibo').click(function() {
-        $('#formRecibo').submit();
+        const formData = new FormData($('#formRecibo')[0]);
+
+        Swal.fire({
+            title: 'Guardando...',
+            allowOutsideClick: false,
+            didOpen: () => {
+                Swal.showLoading();
+            }
+        });
+
+        $.ajax({
+            url: URLS_RECIBOS.guardarReciboJson,
+            type: 'POST',
+            data: formData,
+            processData: false,
+            contentType: false,
+            dataType: 'json',
+            success: function(response) {
+                Swal.close();
+
+                if (response.status === 'success') {
+                    actualizarFilaRecibo(response.recibo);
+                    $('#modalNuevoRecibo').modal('hide');
+                    Swal.fire('Éxito', response.message, 'success');
+                } else {
+                    Swal.fire('Error', response.message, 'error');
+                }
+            },
+            error: function() {
+                Swal.close();
+                Swal.fire('Error', 'Ocurrió un error al guardar el recibo', 'error');
+            }
+        });
     });
-    
+
     // Abrir modal para nuevo recibo
     $('#btnNuevoRecibo').click(function() {
         resetearFormulario();
         $('#modalNuevoRecibo').modal('show');
     });
-    
+
     // Función para resetear formulario
     function resetearFormulario() {
         $('#formRecibo')[0].reset();
         $('#formRecibo input[name="id"]').val('');
         $('#formRecibo input[name="accion"]').val('nuevo');
+        $('#idordencompra').val('');
+        asignarArticuloMicrosip(null);
         $('.modal-title').text('Nuevo Recibo de Material');
-        $('#fecha').val($('#fecha').attr('value') || '');
+        $('#fecha').val(FECHA_HOY);
         $('#material_selector_container').hide();
     }
-    
+
     // Abrir modal para editar
     $(document).on('click', '.editar-recibo', function() {
         const id = $(this).data('id');
-        
+
         // Mostrar spinner o mensaje de carga
         Swal.fire({
             title: 'Cargando datos...',
@@ -189,7 +416,7 @@ $(document).ready(function() {
                 Swal.showLoading();
             }
         });
-        
+
         // Cargar datos del recibo
         $.ajax({
             url: `/obtener_recibo/${id}`,
@@ -197,10 +424,10 @@ $(document).ready(function() {
             dataType: 'json',
             success: function(data) {
                 Swal.close();
-                
+
                 if (data.status === 'success') {
                     const recibo = data.recibo;
-                    
+
                     // Asignar valores a los campos
                     $('#formRecibo input[name="id"]').val(recibo.id);
                     $('#formRecibo input[name="accion"]').val('editar');
@@ -222,13 +449,14 @@ $(document).ready(function() {
                     $('#reporte_focc03').val(recibo.reporte_focc03);
                     $('#procedencia').val(recibo.procedencia);
                     $('#idordencompra').val(recibo.idordencompra);
-                    
+                    asignarArticuloMicrosip(recibo);
+
                     // Ocultar el selector de materiales en modo edición
                     $('#material_selector_container').hide();
-                    
+
                     // Cambiar título del modal
                     $('.modal-title').text('Editar Recibo de Material');
-                    
+
                     // Mostrar el modal
                     $('#modalNuevoRecibo').modal('show');
                 } else {
@@ -241,58 +469,135 @@ $(document).ready(function() {
             }
         });
     });
-    
- 
-    
+
+    // Ver detalles (delegado para que funcione en filas agregadas por AJAX)
+    $(document).on('click', '.ver-detalles', function() {
+        const id = $(this).data('id');
+        $.ajax({
+            url: `/detalles_recibo/${id}`,
+            type: 'GET',
+            success: function(data) {
+                $('#contenidoDetalles').html(data);
+                $('#modalDetalles').modal('show');
+            },
+            error: function() {
+                Swal.fire('Error', 'No se pudieron cargar los detalles', 'error');
+            }
+        });
+    });
+
     // Manejo de selección de recibos
     $('#seleccionarTodos').change(function() {
         $('.seleccion-recibo').prop('checked', $(this).prop('checked'));
         actualizarBotonesSeleccion();
     });
-    
+
     $(document).on('change', '.seleccion-recibo', function() {
         actualizarBotonesSeleccion();
     });
-    
+
     function actualizarBotonesSeleccion() {
         const haySeleccionados = $('.seleccion-recibo:checked').length > 0;
         $('#btnExportarSeleccionados').prop('disabled', !haySeleccionados);
         $('#btnImportarSQL').prop('disabled', !haySeleccionados);
-        
+
         // Verificar si hay recibos con el mismo valor en reporte_focc03
         const reportesSeleccionados = new Set();
         $('.seleccion-recibo:checked').each(function() {
             const reporte = $(this).closest('tr').find('td:eq(8)').text().trim();
             if (reporte) reportesSeleccionados.add(reporte);
         });
-        
+
         $('#btnExportarReporte').prop('disabled', reportesSeleccionados.size !== 1);
     }
-    
-    // Exportar a Excel todos los registros
+
+    // Importar lista de empaque (.xlsx / .csv) del proveedor
+    $('#btnImportarArchivo').click(function() {
+        $('#archivoImportacion').val('').click();
+    });
+
+    $('#archivoImportacion').change(function() {
+        const archivo = this.files[0];
+        if (!archivo) return;
+
+        const formData = new FormData();
+        formData.append('archivo', archivo);
+
+        Swal.fire({
+            title: 'Importando...',
+            text: archivo.name,
+            allowOutsideClick: false,
+            didOpen: () => {
+                Swal.showLoading();
+            }
+        });
+
+        $.ajax({
+            url: URLS_RECIBOS.importarArchivo,
+            type: 'POST',
+            data: formData,
+            processData: false,
+            contentType: false,
+            dataType: 'json',
+            success: function(response) {
+                let html = '';
+                if (response.errores && response.errores.length > 0) {
+                    html += '<div class="mt-3"><pre class="bg-dark text-white p-3 text-start" style="max-height: 300px; overflow-y: auto;">';
+                    response.errores.forEach(error => {
+                        html += escaparHtml(`Fila ${error.fila}: ${error.mensaje}`) + '\n';
+                    });
+                    html += '</pre></div>';
+                }
+
+                Swal.fire({
+                    title: response.status === 'success' ? 'Importación terminada' : 'Error',
+                    html: escaparHtml(response.message) + html,
+                    icon: response.status === 'success' ? 'success' : 'error'
+                }).then(() => {
+                    // Las filas nuevas se muestran recargando el listado una sola vez
+                    if (response.insertados > 0) {
+                        window.location.reload();
+                    }
+                });
+            },
+            error: function() {
+                Swal.fire('Error', 'Ocurrió un error al importar el archivo', 'error');
+            }
+        });
+    });
+
+    // Exportar a Excel todos los registros como trabajo en segundo plano
     $('#btnExportarExcel').click(function() {
-        window.location.href = `${window.location.pathname}exportar_excel?todos=1`;
+        exportarEnSegundoPlano({ todos: 1 });
+    });
+
+    // Exportar todo como CSV (se descarga en streaming)
+    $('#btnExportarCsv').click(function() {
+        window.location.href = `${URLS_RECIBOS.exportarCsv}?todos=1`;
     });
-    
+
     // Exportar a Excel seleccionados
     $('#btnExportarSeleccionados').click(function() {
         const ids = [];
         $('.seleccion-recibo:checked').each(function() {
             ids.push($(this).val());
         });
-        
+
         if (ids.length > 0) {
-            window.location.href = `${window.location.pathname}exportar_excel?ids=${ids.join(',')}`;
+            // Enviar los IDs por POST para no depender del límite de longitud de la URL
+            const form = $('<form>', { method: 'POST', action: URLS_RECIBOS.exportarExcel })
+                .append($('<input>', { type: 'hidden', name: 'ids', value: ids.join(',') }));
+            form.appendTo('body').submit().remove();
         }
     });
-    
+
     // Importar a SQL Server
     $('#btnImportarSQL').click(function() {
         const ids = [];
         $('.seleccion-recibo:checked').each(function() {
             ids.push($(this).val());
         });
-        
+
         if (ids.length > 0) {
             Swal.fire({
                 title: '¿Confirmar importación?',
@@ -304,7 +609,7 @@ $(document).ready(function() {
             }).then((result) => {
                 if (result.isConfirmed) {
                     $.ajax({
-                        url: `${window.location.pathname}importar_sqlserver`,
+                        url: URLS_RECIBOS.importarSqlserver,
                         type: 'POST',
                         contentType: 'application/json',
                         data: JSON.stringify({ ids: ids }),
@@ -318,7 +623,7 @@ $(document).ready(function() {
                                 });
                                 html += '</pre></div>';
                             }
-                            
+
                             if (response.status === 'success') {
                                 Swal.fire({
                                     title: 'Éxito',
@@ -333,21 +638,21 @@ $(document).ready(function() {
                                 });
                             }
                         },
-                        error: function() {
-                            Swal.fire('Error', 'Ocurrió un error durante la importación', 'error');
+                        error: function(xhr) {
+                            Swal.fire('Error', mensajeErrorAjax(xhr, 'Ocurrió un error durante la importación'), 'error');
                         }
                     });
                 }
             });
         }
     });
-    
+
     // Generar Reporte FO-CC-03
     $('#btnExportarReporte').click(function() {
         const reporteId = $('.seleccion-recibo:checked').first().closest('tr').find('td:eq(8)').text().trim();
-        
+
         if (reporteId) {
-            window.location.href = `${window.location.pathname}exportar_reporte_focc03?reporte=${encodeURIComponent(reporteId)}`;
+            window.location.href = `${URLS_RECIBOS.exportarReporte}?reporte=${encodeURIComponent(reporteId)}`;
         }
     });
-});
\ No newline at end of file
+});